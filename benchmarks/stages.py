@@ -0,0 +1,205 @@
+"""
+Pipeline benchmark: times each stage behind crvx.main on synthetic logbooks (see synthetic.py) of increasing size.
+
+Stages are the uncached functions the pipeline.py stages call, in the order the page runs them, with the page's
+default filters. Chart stages build the chart and serialize it to JSON, as Streamlit does. Each stage runs
+--repeat times and reports the fastest time. It is then run once more under tracemalloc for its peak memory, as
+tracing slows it down. Results are tagged with the commit and package versions, so that runs can be compared:
+
+    python benchmarks/stages.py [--sizes 1000 100000 ...] [--json results.json] [--compare baseline.json]
+"""
+import argparse
+import json
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+import warnings
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'src'))
+
+import cube  # noqa: E402
+import dateindex  # noqa: E402
+import plot  # noqa: E402
+import preprocess as pre  # noqa: E402
+import sources  # noqa: E402
+import splitgrades  # noqa: E402
+import trainingload  # noqa: E402
+from constants import TOP_KS  # noqa: E402
+from synthetic import generate_logbook  # noqa: E402
+
+DEFAULT_SIZES = [1_000, 10_000, 100_000, 1_000_000]
+COLOURMAP = 'inferno'
+NUM_DRAWS = 1000
+
+
+def _date_index(ctx):
+    df_activity = dateindex.sort_by_date(ctx['activity'], ctx['activity']['date'])
+    df_in = dateindex.sort_by_date(ctx['distribute_climbs'], ctx['distribute_climbs']['date'])
+    return df_activity, df_in, dateindex.build(df_activity, df_in)
+
+
+def _filter(ctx):
+    """ Filters like the page's default: the 'all' date filter, with every workout type selected."""
+    df_activity, df_in, date_index = ctx['date_index']
+    start_date, end_date = date_index.preset_range('all')
+    df_activity = df_activity.iloc[date_index.activity_rows(start_date, end_date)]
+    types = list(df_activity['workout_type'].unique())
+    df_in = df_in.iloc[date_index.climb_rows(start_date, end_date)]
+    df_in = df_in[df_in['workout_type'].isin(types)]
+    return {'activity': df_activity, 'climbs': df_in, 'freq': plot.time_resolution(start_date, end_date),
+            'start_date': start_date, 'end_date': end_date,
+            'cube': cube.select(ctx['cube_build'], start_date, end_date, types)}
+
+
+def _count_attempts(df_in):
+    df_att = df_in.copy()
+    df_att['attempts'] = df_att['attempts'].fillna(1).astype(int)
+    df_att = pre.count_attempts(df_att)
+    df_att['sent_str'] = df_att['sent'].astype(str)
+    return df_att
+
+
+# (name, function of the outputs of previous stages keyed by name)
+STAGES = [
+    ('load_parquet', lambda ctx: sources.FileSource('bench', ctx['dir']).load()[0]),
+    ('format_columns', lambda ctx: pre.format_columns(pre.drop_nan_rows(ctx['raw']))),
+    ('activity', lambda ctx: pre.get_climbing_activity_df(ctx['format_columns']['indoor_sessions'],
+                                                          ctx['format_columns']['outdoor'])),
+    ('distribute_climbs', lambda ctx: pre.distribute_climbs(
+        pd.merge(ctx['format_columns']['indoor'], ctx['format_columns']['indoor_sessions'][['date', 'workout_type']],
+                 how='left', on='date'),
+        random_seed=42)),
+    ('cube_build', lambda ctx: cube.build(ctx['distribute_climbs'])),
+    ('cumulative_sends', lambda ctx: cube.cumulative_sends(ctx['cube_build'])),
+    ('date_index', _date_index),
+    ('filter', _filter),
+    ('session_totals', lambda ctx: cube.session_totals(ctx['filter']['cube'])),
+    ('cumulative_top_k', lambda ctx: pre.cumulative_top_k(
+        ctx['filter']['climbs'][ctx['filter']['climbs']['sent']], TOP_KS)[0]),
+    ('period_top_k', lambda ctx: cube.period_top_k(ctx['filter']['cube'], TOP_KS)),
+    ('daily_sends', lambda ctx: cube.daily_sends(ctx['filter']['cube'], ctx['cumulative_sends'],
+                                                 ctx['filter']['start_date'], ctx['filter']['end_date'])),
+    ('grade_totals', lambda ctx: cube.grade_totals(ctx['filter']['cube'], pyramid_ratio=2.0)),
+    ('workout_type_totals', lambda ctx: cube.workout_type_totals(ctx['filter']['cube'], pyramid_ratio=2.0)),
+    ('split_grade_sends', lambda ctx: splitgrades.build(pd.merge(
+        ctx['format_columns']['indoor'], ctx['activity'][['date', 'workout_type']], how='left', on='date'))),
+    ('split_grade_draws', lambda ctx: splitgrades.draw(
+        ctx['split_grade_sends'], ctx['filter']['start_date'], ctx['filter']['end_date'],
+        ctx['cube_build'].workout_types, 'M', NUM_DRAWS)),
+    ('split_grade_bands', lambda ctx: (splitgrades.v_points(ctx['split_grade_draws']),
+                                       splitgrades.grade_totals(ctx['split_grade_draws'], pyramid_ratio=2.0),
+                                       splitgrades.period_top_k(ctx['split_grade_draws'], TOP_KS))),
+    ('training_load', lambda ctx: trainingload.build(ctx['format_columns']['indoor_sessions'], ctx['cube_build'])),
+    ('training_load_select', lambda ctx: ctx['training_load'].select(
+        ctx['filter']['start_date'], ctx['filter']['end_date'], ctx['cube_build'].workout_types,
+        freq=ctx['filter']['freq'])),
+    ('count_attempts', lambda ctx: _count_attempts(ctx['filter']['climbs'])),
+    ('expand_attempts', lambda ctx: pre.expand_attempts(ctx['filter']['climbs'].astype({'attempts': int}))),
+    ('chart_calendar', lambda ctx: plot.payload_size(
+        plot.calendar_heat_map_chart(ctx['filter']['activity'], label='workout_type', colourmap=COLOURMAP))),
+    ('chart_v_point_mean_and_sum', lambda ctx: plot.payload_size(
+        plot.v_point_mean_and_sum_chart(ctx['session_totals'], COLOURMAP))),
+    ('chart_top_k_sends', lambda ctx: plot.payload_size(plot.top_k_sends_chart(ctx['period_top_k'], COLOURMAP))),
+    ('chart_cum_top_k_sends', lambda ctx: plot.payload_size(
+        plot.cum_top_k_sends_chart(ctx['cumulative_top_k'], COLOURMAP))),
+    ('chart_cumulative_stacked_area', lambda ctx: plot.payload_size(plot.cumulative_stacked_area_chart(
+        ctx['daily_sends'], 'count_csum:Q', COLOURMAP, title='Total climb count', freq=ctx['filter']['freq']))),
+    ('chart_stacked_bar', lambda ctx: plot.payload_size(plot.stacked_bar_chart(
+        ctx['daily_sends'], 'v_points:Q', COLOURMAP, title='V Points', show_labels=True, freq=ctx['filter']['freq']))),
+    ('chart_total_v_grade', lambda ctx: plot.payload_size(
+        plot.total_v_grade_horizontal_bar_char(ctx['grade_totals'], COLOURMAP, draw_targets=True))),
+    ('chart_workout_type_v_grade', lambda ctx: plot.payload_size(
+        plot.workout_type_v_grade_bar_charts(ctx['workout_type_totals'], COLOURMAP, draw_targets=True))),
+    ('chart_training_load', lambda ctx: plot.payload_size(plot.training_load_chart(
+        ctx['training_load_select'][ctx['training_load_select']['metric'] == 'v_points'], COLOURMAP, 'V-points',
+        freq=ctx['filter']['freq']))),
+    ('chart_attempts', lambda ctx: plot.payload_size(plot.get_attempt_bar_chart(ctx['count_attempts'], COLOURMAP))),
+    ('chart_send_attempt_normalized', lambda ctx: plot.payload_size(plot.get_send_attempt_normalized(
+        ctx['count_attempts'][ctx['count_attempts']['sent']], COLOURMAP))),
+    ('chart_attempt_and_send_bubble', lambda ctx: plot.payload_size(
+        plot.get_attempt_and_send_bubble_chart(ctx['count_attempts'], COLOURMAP))),
+]
+
+
+def _peak_memory(func, ctx) -> int:
+    tracemalloc.start()
+    try:
+        func(ctx)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def run_stages(num_climbs: int, repeat: int = 3, seed: int = 0, memory: bool = True):
+    """ Seconds and peak traced bytes of each stage, on a logbook of num_climbs climbs."""
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        ctx = {'raw': generate_logbook(num_climbs, seed), 'dir': tmp_dir}
+        sources.write_files(ctx['raw'], tmp_dir)
+
+        results = {}
+        for name, func in STAGES:
+            times = []
+            for _ in range(repeat):
+                start = time.perf_counter()
+                ctx[name] = func(ctx)
+                times.append(time.perf_counter() - start)
+            results[name] = {'seconds': min(times)}
+            if memory:
+                results[name]['peak_bytes'] = _peak_memory(func, ctx)
+    return results
+
+
+def environment():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                                cwd=Path(__file__).parent).stdout.strip()
+    except OSError:
+        commit = None
+    return {'commit': commit, 'python': platform.python_version(), 'numpy': np.__version__,
+            'pandas': pd.__version__, 'machine': platform.machine()}
+
+
+def print_results(results, baseline=None):
+    for size, stages in results['sizes'].items():
+        print(f'{int(size):,} climbs')
+        for name, result in stages.items():
+            line = f'  {name:<32}{result["seconds"] * 1000:>10.1f} ms'
+            if 'peak_bytes' in result:
+                line += f'{result["peak_bytes"] / 1024 ** 2:>10.1f} MiB'
+            base = (baseline or {}).get('sizes', {}).get(size, {}).get(name)
+            if base:
+                line += f'{result["seconds"] / max(base["seconds"], 1e-9):>8.2f}x'
+            print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=DEFAULT_SIZES, help='Numbers of climbs to run.')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--no-memory', action='store_true', help="Don't measure peak memory, which is slow.")
+    parser.add_argument('--json', help='Also write the results to this JSON file.')
+    parser.add_argument('--compare', help='JSON results of a previous run, to print time ratios against.')
+    args = parser.parse_args()
+
+    # Streamlit warns about running its functions (e.g. st.warning) outside of an app
+    warnings.filterwarnings('ignore')
+
+    results = {'environment': environment(), 'seed': args.seed, 'repeat': args.repeat,
+               'sizes': {str(size): run_stages(size, args.repeat, args.seed, memory=not args.no_memory)
+                         for size in args.sizes}}
+
+    print_results(results, json.loads(Path(args.compare).read_text()) if args.compare else None)
+    if args.json:
+        Path(args.json).write_text(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
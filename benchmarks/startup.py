@@ -0,0 +1,113 @@
+"""
+Startup benchmark for the crvx entry point.
+
+Reports the cold import time of each module the app may import, each measured in a fresh interpreter, and the time to
+first render of the page against an offline fake workbook (see tests/fakes.py).
+
+    python benchmarks/startup.py [--json results.json] [--max-first-render SECONDS]
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+
+SRC_DIR = Path(__file__).resolve().parent.parent / 'src'
+TESTS_DIR = SRC_DIR.parent / 'tests'
+
+# Third party modules first, then the app's own modules, whose import times include their dependencies
+MODULES = ['streamlit', 'numpy', 'pandas', 'pyarrow', 'altair', 'matplotlib.pyplot', 'calmap', 'gspread',
+           'google.oauth2.service_account', 'pytz',
+           'constants', 'preprocess', 'cube', 'pipeline', 'components', 'plot', 'sheets', 'crvx']
+
+IMPORT_SCRIPT = """
+import sys, time
+sys.path.insert(0, {src_dir!r})
+start = time.perf_counter()
+import {module}
+print(time.perf_counter() - start)
+"""
+
+APP_SCRIPT = """
+import datetime as dt
+import sys
+sys.path.insert(0, {src_dir!r})
+sys.path.insert(0, {tests_dir!r})
+import crvx, sources
+from fakes import FakeWorkbook, FakeWorksheet
+
+days = [dt.date(2020, 1, 1) + dt.timedelta(days=2 * i) for i in range(300)]
+climbs = [['Date', 'V Grade', 'Count Multiplier', 'Attempts (w/ send)', 'Sent']]
+climbs += [[d.strftime('%d/%m/%Y'), f'V{{i % 8}}', '1', str(1 + i % 3), 'TRUE'] for d in days for i in range(8)]
+sessions = [['Date', 'workout type', 'climbing time', 'total time']]
+sessions += [[d.strftime('%d/%m/%Y'), ['board', 'volume'][i % 2], '60', '90'] for i, d in enumerate(days)]
+outdoor = [['Date', 'Grade'], [(days[-1] + dt.timedelta(days=1)).strftime('%d/%m/%Y'), 'V3']]
+
+workbook = FakeWorkbook('Startup Benchmark', [
+    FakeWorksheet('Indoor Bouldering Climbs', climbs, {{'raw_climb_data': 'A1:E'}}),
+    FakeWorksheet('Indoor Bouldering Sessions', sessions, {{'raw_session_data': 'A1:D'}}),
+    FakeWorksheet('Outdoor Bouldering', outdoor),
+])
+sources.get_workbook = lambda name: workbook
+crvx.main()
+"""
+
+RENDER_SCRIPT = """
+import time
+start = time.perf_counter()
+from streamlit.testing.v1 import AppTest
+app = AppTest.from_file({app_path!r}, default_timeout=600)
+app.run()
+first_render = time.perf_counter() - start
+assert not app.exception, app.exception
+start = time.perf_counter()
+app.run()
+print(first_render, time.perf_counter() - start)
+"""
+
+
+def _run(script: str, env=None) -> str:
+    return subprocess.run([sys.executable, '-c', script], check=True, capture_output=True, text=True,
+                          env=env).stdout.split()
+
+
+def import_times():
+    return {module: float(_run(IMPORT_SCRIPT.format(src_dir=str(SRC_DIR), module=module))[0]) for module in MODULES}
+
+
+def render_times():
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        app_path = Path(tmp_dir) / 'app.py'
+        app_path.write_text(APP_SCRIPT.format(src_dir=str(SRC_DIR), tests_dir=str(TESTS_DIR)))
+        env = {**os.environ, 'CRVX_SNAPSHOT_DIR': tmp_dir}
+        first_render, rerender = _run(RENDER_SCRIPT.format(app_path=str(app_path)), env=env)
+    return {'first_render': float(first_render), 'rerender': float(rerender)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--json', help='Also write the results to this JSON file.')
+    parser.add_argument('--max-first-render', type=float, help='Exit with an error if the first render is slower.')
+    args = parser.parse_args()
+
+    results = {'imports': import_times(), 'render': render_times()}
+
+    print('Cold import time')
+    for module, seconds in results['imports'].items():
+        print(f'  {module:<32}{seconds * 1000:>8.0f} ms')
+    print('Page render (offline fake workbook)')
+    for stage, seconds in results['render'].items():
+        print(f'  {stage:<32}{seconds * 1000:>8.0f} ms')
+
+    if args.json:
+        Path(args.json).write_text(json.dumps(results, indent=2))
+
+    if args.max_first_render is not None and results['render']['first_render'] > args.max_first_render:
+        sys.exit(f'First render took {results["render"]["first_render"]:.2f}s, '
+                 f'over the budget of {args.max_first_render:.2f}s')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,92 @@
+"""
+Synthetic logbook generator, for benchmarking the pipeline at sizes no real logbook reaches (yet).
+
+Generates the raw tables of a logbook as they come out of sheets.sync_workbook and pre.header_to_col: string values
+under the sheet headers. Grades follow a pyramid, with some split grades (e.g. "V3-5") and VB, and harder climbs take
+more attempts and are sent less often. Logbooks are deterministic given the number of climbs and the seed.
+
+    python benchmarks/synthetic.py NUM_CLIMBS OUTPUT_DIR [--format csv] [--seed 0]
+
+writes a logbook readable by sources.FileSource, e.g. with CRVX_LOGBOOK=files://OUTPUT_DIR.
+"""
+import argparse
+import sys
+from pathlib import Path
+from typing import Dict
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'src'))
+
+START_DATE = pd.Timestamp('1970-01-01')
+MAX_SESSIONS = 40_000  # Keeps the dates within pandas' range, with larger logbooks logging more climbs per session
+CLIMBS_PER_SESSION = 10
+SESSIONS_PER_OUTDOOR_DAY = 20
+
+GRADES = [f'V{g}' for g in range(10)] + ['VB', 'VB-1', 'V2-4', 'V3-5', 'V4-6', 'V5-7']
+GRADE_WEIGHTS = [0.6 ** g for g in range(10)] + [0.5, 0.2, 0.15, 0.1, 0.05, 0.02]
+GRADE_DIFFICULTY = [g for g in range(10)] + [-1, 0, 3, 4, 5, 6]  # Roughly, for attempts and sends
+WORKOUT_TYPES = ['board', 'projecting', 'volume', 'technique']
+
+
+def generate_logbook(num_climbs: int, seed: int = 0) -> Dict[str, pd.DataFrame]:
+    """ Raw 'indoor', 'indoor_sessions' and 'outdoor' tables with num_climbs indoor climbs (rows)."""
+    rng = np.random.default_rng(seed)
+    num_sessions = int(np.clip(num_climbs // CLIMBS_PER_SESSION, 1, min(num_climbs, MAX_SESSIONS)))
+
+    # Training days about every other day, leaving free days for outdoor climbing
+    days = np.sort(rng.choice(2 * num_sessions, num_sessions, replace=False))
+    date_strs = (START_DATE + pd.to_timedelta(days, unit='D')).strftime('%d/%m/%Y').to_numpy(dtype=object)
+
+    # Every session has at least one climb
+    session_idx = np.sort(np.r_[np.arange(num_sessions), rng.integers(0, num_sessions, num_climbs - num_sessions)])
+
+    grade_idx = rng.choice(len(GRADES), num_climbs, p=np.array(GRADE_WEIGHTS) / sum(GRADE_WEIGHTS))
+    difficulty = np.array(GRADE_DIFFICULTY)[grade_idx]
+    attempts = np.minimum(rng.geometric(1 / (1.5 + difficulty.clip(0) / 3)), 20)
+    sent = rng.random(num_climbs) < 0.95 - difficulty.clip(0) * 0.07
+    multiplier = np.where(rng.random(num_climbs) < 0.1, rng.integers(2, 5, num_climbs), 1)
+
+    indoor = pd.DataFrame({'Date': date_strs[session_idx],
+                           'V Grade': np.array(GRADES, dtype=object)[grade_idx],
+                           'Count Multiplier': multiplier.astype(str).astype(object),
+                           'Attempts (w/ send)': attempts.astype(str).astype(object),
+                           'Sent': np.where(sent, 'TRUE', 'FALSE').astype(object)})
+
+    climbing_time = rng.integers(30, 150, num_sessions)
+    indoor_sessions = pd.DataFrame({'Date': date_strs,
+                                    'workout type': np.array(WORKOUT_TYPES, dtype=object)[
+                                        rng.integers(0, len(WORKOUT_TYPES), num_sessions)],
+                                    'climbing time': climbing_time.astype(str).astype(object),
+                                    'total time': (climbing_time + rng.integers(0, 60, num_sessions)).astype(str)
+                                    .astype(object)})
+
+    free_days = np.setdiff1d(np.arange(2 * num_sessions), days)
+    outdoor_days = np.sort(rng.choice(free_days, max(1, num_sessions // SESSIONS_PER_OUTDOOR_DAY), replace=False))
+    outdoor = pd.DataFrame({'Date': (START_DATE + pd.to_timedelta(outdoor_days, unit='D')).strftime('%d/%m/%Y')
+                            .to_numpy(dtype=object),
+                            'Grade': np.array(GRADES[:8], dtype=object)[rng.integers(0, 8, len(outdoor_days))]})
+
+    # Indexed from 1 like the output of header_to_col
+    all_data = {'indoor': indoor, 'indoor_sessions': indoor_sessions, 'outdoor': outdoor}
+    for df in all_data.values():
+        df.index += 1
+    return all_data
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('num_climbs', type=int)
+    parser.add_argument('output_dir')
+    parser.add_argument('--format', choices=['parquet', 'csv'], default='parquet')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    import sources
+
+    sources.write_files(generate_logbook(args.num_climbs, args.seed), args.output_dir, fmt=args.format)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,23 +1,25 @@
-import datetime
+import datetime as dt
+from typing import Dict, List
+
 import streamlit as st
 
+import dateindex
+import logbooks
+import profiling
+
 
-def add_date_filter(min_date: datetime.date, max_date: datetime.date):
-    new_start_date = min_date
-    new_end_date = max_date
+def add_date_filter(date_index: dateindex.DateIndex):
+    min_date = date_index.min_date
+    max_date = date_index.max_date
 
     # Date selection
     date_filter = st.sidebar.radio(
         "Date filter",
-        ('all', 'YTD', '1y', '6m', 'custom'))
+        (*dateindex.PRESETS, 'custom'))
     if date_filter == 'all':
-        return new_start_date, new_end_date
-    elif date_filter == 'YTD':
-        new_start_date = max_date.replace(month=1, day=1)
-    elif date_filter == '1y':
-        new_start_date = max_date - datetime.timedelta(weeks=52)
-    elif date_filter == '6m':
-        new_start_date = max_date - datetime.timedelta(weeks=26)
+        return min_date, max_date
+    elif date_filter in dateindex.PRESETS:
+        new_start_date, new_end_date = date_index.preset_range(date_filter)
     else:
         new_start_date = st.sidebar.date_input('Start date', min_date, min_value=min_date)
         new_end_date = st.sidebar.date_input('End date', max_date, max_value=max_date)
@@ -26,3 +28,81 @@ def add_date_filter(min_date: datetime.date, max_date: datetime.date):
         st.error('Error: End date must fall after start date.')
 
     return new_start_date, new_end_date
+
+
+def add_payload_size_toggle():
+    st.sidebar.checkbox('Show chart payload sizes', value=False, key='show_payload_sizes')
+
+
+def add_profiling_toggle():
+    """ Toggles profiling of the following reruns with profiling.rerun, see is_profiling."""
+    st.sidebar.checkbox('Profile reruns', value=False, key='profile_reruns')
+    st.sidebar.checkbox('Write cProfile dumps', value=False, key='profile_dumps',
+                        disabled=not st.session_state.get('profile_reruns', False))
+
+
+def is_profiling():
+    """ Whether to profile this rerun and to dump it, as toggled by add_profiling_toggle in the previous rerun."""
+    profile = st.session_state.get('profile_reruns', False)
+    return profile, profile and st.session_state.get('profile_dumps', False)
+
+
+@profiling.timed(name='st.altair_chart')
+def altair_chart(chart, **kwargs):
+    """ st.altair_chart, followed by the chart's payload size if enabled with add_payload_size_toggle."""
+    st.altair_chart(chart, **kwargs)
+    if st.session_state.get('show_payload_sizes', False):
+        import plot  # Not imported at the top, so that importing components doesn't import altair
+
+        st.caption(f'_Chart payload: {plot.payload_size(chart) / 1024:.1f} KiB_')
+
+
+def add_logbook_select(registry: Dict[str, str]) -> str:
+    """
+    Selects the logbook from the `?logbook=` URL parameter, or with a sidebar select box if there are several, and
+    returns its source spec. The selection is written back to the URL so that it can be shared.
+    """
+    logbook_ids = list(registry)
+    logbook_id = st.query_params.get('logbook', logbook_ids[0])
+    if logbook_id not in registry:
+        st.sidebar.warning(f'Unknown logbook "{logbook_id}", showing "{logbook_ids[0]}" instead.')
+        logbook_id = logbook_ids[0]
+
+    if len(logbook_ids) > 1:
+        logbook_id = st.sidebar.selectbox('Logbook', logbook_ids, index=logbook_ids.index(logbook_id))
+    st.query_params['logbook'] = logbook_id
+    return registry[logbook_id]
+
+
+def add_freshness_indicator(fetch_time: dt.datetime, freshness: logbooks.Freshness):
+    """ When the shown data was fetched, and whether it's being refreshed or the last refresh failed."""
+    import pytz
+
+    age = dt.datetime.now(dt.timezone.utc) - fetch_time
+    st.sidebar.write(f'_Last fetch @ '
+                     f'{fetch_time.astimezone(pytz.timezone("Europe/London")).isoformat(timespec="seconds", sep=" ")}'
+                     f' ({age.total_seconds() // 60:.0f}min old, 1min cache)._')
+    if freshness.refreshing:
+        st.sidebar.caption('Refreshing in the background, the new data shows on the next rerun...')
+    if freshness.error:
+        st.sidebar.warning(f'Refresh failed, showing the last good data: {freshness.error}')
+
+
+def add_section_select(titles: List[str]) -> str:
+    """
+    Selects the section to show, like tabs but so that only the selected one is computed. The selection is read from
+    and written back to the `?section=` URL parameter, like add_logbook_select.
+    """
+    if st.session_state.get('section') not in titles:
+        title = st.query_params.get('section')
+        st.session_state['section'] = title if title in titles else titles[0]
+    title = st.radio('Section', titles, key='section', horizontal=True, label_visibility='collapsed')
+    st.query_params['section'] = title
+    return title
+
+
+def add_split_grade_draws_select() -> int:
+    """ Number of resolutions of split grades to draw for uncertainty bands (see splitgrades), 1 for none."""
+    return st.sidebar.select_slider('Split grade draws', options=[1, 10, 100, 1000], value=1,
+                                    help='Resolves split grades (e.g. "V3-5") this many times, to show the median and '
+                                         '5-95th percentiles of the V-points, grade totals and top-K sends.')
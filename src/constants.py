@@ -1,4 +1,73 @@
+import numpy as np
+
 MAX_VGRADE = 11
 
 V_GRADE_MULT = {f'V{grade}': grade for grade in range(MAX_VGRADE)}
-V_GRADE_MULT['V0'] = 0.5
\ No newline at end of file
+V_GRADE_MULT['V0'] = 0.5
+
+# V_GRADE_MULT indexed by integer grade
+V_GRADE_MULT_ARRAY = np.array([V_GRADE_MULT[f'V{grade}'] for grade in range(MAX_VGRADE)])
+
+# Specifies what top-K sends on which to take mean.
+TOP_KS = [1, 3, 5, 10, 20]
+# Periods over which the mean of top-K sends can be taken, and their pandas frequencies.
+TOP_K_PERIODS = {'Week': 'W', 'Month': 'M', 'Quarter': 'Q'}
+# Grade pyramid shapes, by the ratio of climbs between consecutive grades. A sequence gives the ratio of each step
+# from V0-V1 upwards, with the last ratio repeating for the steps above it. None is a custom shape input by the user.
+PYRAMID_SHAPES = {'2x': 2.0, '3x': 3.0, '1.5x': 1.5, 'Steepening': (1.5, 1.5, 2.0, 2.0, 2.5, 3.0), 'Custom': None}
+# Training load metrics (see trainingload.METRICS), by their titles.
+TRAINING_LOAD_METRICS = {'V-points': 'v_points', 'Climbs': 'climbs', 'Climbing minutes': 'climbing_time',
+                         'Session minutes': 'total_time'}
+# Acute:chronic workload ratios commonly taken to balance fitness and injury risk.
+ACWR_TARGET_RANGE = (0.8, 1.3)
+
+SEQUENTIAL_CMAPS = [
+    # 'blues',
+    # 'tealblues',
+    # 'teals',
+    # 'greens',
+    # 'browns',
+    # 'oranges',
+    # 'reds',
+    # 'purples',
+    # 'warmgreys',
+    # 'greys', # TODO: Re-enable Vega colormaps with Matplotlib equivalent
+    'viridis',
+    'magma',
+    'inferno',
+    'plasma',
+    # 'bluegreen',
+    # 'bluepurpl',
+    # 'oldgreen',
+    # 'oldorange',
+    # 'goldred',
+    # 'greenblue',
+    # 'orangered',
+    # 'purplebluegreen',
+    # 'purpleblue',
+    # 'purplered',
+    # 'redpurple',
+    # 'yellowgreenblue',
+    # 'yellowgreen',
+    # 'yelloworangebrown',
+    # 'yelloworangered',
+    # 'darkblue',
+    # 'darkgold',
+    # 'darkgreen',
+    # 'darkmulti',
+    # 'darkred',
+    # 'lightgreyred',
+    # 'lightgreyteal',
+    # 'lightmulti',
+    # 'lightorange',
+    # 'lighttealblue'
+]
+
+# First four of five samples of each matplotlib colourmap, used to colour the title without importing matplotlib.
+# Five samples as otherwise the "X" is too light on the white background.
+TITLE_COLOURS = {
+    'viridis': ['#440154', '#3b528b', '#21918c', '#5ec962'],
+    'magma': ['#000004', '#51127c', '#b73779', '#fc8961'],
+    'inferno': ['#000004', '#57106e', '#bc3754', '#f98e09'],
+    'plasma': ['#0d0887', '#7e03a8', '#cc4778', '#f89540'],
+}
@@ -1,103 +1,129 @@
 import datetime as dt
-import time
+import importlib
+import sys
+import threading
 
-import gspread
-import matplotlib
-import pandas as pd
-import pytz
 import streamlit as st
-import heapq
-from matplotlib import cm
 
-import plot, preprocess as pre
+import preprocess as pre
 import components
-from google.oauth2.service_account import Credentials
+import constants
+import logbooks
+import pipeline
+import profiling
+import sections
+import sources
+
+# Slow to import and not needed until the first chart, so imported in the background while the data is fetched.
+# Other heavy modules (gspread, pyarrow, matplotlib, ...) are only imported by the functions that need them.
+PRELOAD_MODULES = ['altair', 'plot']
 
 
 # TODO: Add step about giving sheet access to README
 
-@st.cache_data(ttl=60, show_spinner=True)
-def get_sheets_data(cache_arg: int):
+def preload_modules():
+    for module in PRELOAD_MODULES:
+        importlib.import_module(module)
+
+
+@st.cache_resource
+def get_logbook_cache() -> logbooks.LogbookCache:
+    try:
+        max_bytes = st.secrets.get('logbook_cache_bytes', logbooks.DEFAULT_MAX_BYTES)
+    except FileNotFoundError:
+        max_bytes = logbooks.DEFAULT_MAX_BYTES
+    return logbooks.LogbookCache(max_bytes=max_bytes, ttl=60, on_evict=pipeline.forget)
+
+
+def fetch_logbook_data(spec: str, full_refresh: bool) -> logbooks.LogbookData:
     """
-    The cache arg is simply used to control when we hit the cache, so that we can manually trigger a new data pull
-    by passing in a new cache_arg value.
+    Loads and prepares the logbook's data, usually off the script thread (see get_logbook_data), so that the page only
+    gets data that's ready to use, or the reason it isn't.
     """
+    source_data = sources.from_spec(spec).load(full_refresh=full_refresh)
+    all_data, df_activity, dropped_rows, err_msg = pipeline.prepare_data(source_data.all_data)
+    dropped_rows = {table: source_data.dropped_rows.get(table, 0) + num_rows
+                    for table, num_rows in dropped_rows.items()}
+    return logbooks.LogbookData(spec, all_data, df_activity, err_msg, dt.datetime.now(dt.timezone.utc),
+                                source_data.timings, sum(pre.memory_usage(all_data).values()),
+                                source_data.generations, dropped_rows)
 
-    gc = gspread.authorize(
-        Credentials.from_service_account_info(
-            st.secrets["gcp_service_account"],
-            scopes=[
-                'https://www.googleapis.com/auth/spreadsheets',
-                'https://www.googleapis.com/auth/drive'
-            ],
-        ))
 
-    workbook = gc.open('Climbing Data Long')
-    worksheet = workbook.worksheet('Indoor Bouldering Climbs')
-    indoor_bouldering_data = worksheet.get('raw_climb_data')
-    df_in = pre.header_to_col(pd.DataFrame(indoor_bouldering_data))
+@profiling.timed
+def get_logbook_data(spec: str, force: bool = False) -> logbooks.LogbookData:
+    """
+    Returns the logbook's data from the cache shared by every session, refreshing it in the background if it's older
+    than a minute, so only the first fetch of a logbook waits for it. Forcing a fetch reloads everything, so that
+    edits to existing rows are picked up too.
+    """
+    with st.spinner(f'Fetching {spec}...'):
+        return get_logbook_cache().get(spec, lambda: fetch_logbook_data(spec, full_refresh=force), force=force,
+                                       validate=lambda logbook_data: logbook_data.error)
 
-    worksheet = workbook.worksheet('Indoor Bouldering Sessions')
-    indoor_bouldering_sessions = worksheet.get('raw_session_data')
-    df_in_sess = pre.header_to_col(pd.DataFrame(indoor_bouldering_sessions))
 
-    outdoor_bouldering_data = workbook.worksheet('Outdoor Bouldering').get()
-    df_out = pre.header_to_col(pd.DataFrame(outdoor_bouldering_data))
+def main():
+    with profiling.rerun(*components.is_profiling()):
+        render_page()
 
-    return {'indoor': df_in, 'indoor_sessions': df_in_sess, 'outdoor': df_out}, dt.datetime.now(dt.timezone.utc)
 
+def render_page():
+    if not all(module in sys.modules for module in PRELOAD_MODULES):
+        threading.Thread(target=preload_modules, daemon=True).start()
 
-def main():
     # Sidebar
-    colourmap = st.sidebar.selectbox('Colourmap', options=plot.SEQUENTIAL_CMAPS,
-                                     index=plot.SEQUENTIAL_CMAPS.index('inferno'))
+    colourmap = st.sidebar.selectbox('Colourmap', options=constants.SEQUENTIAL_CMAPS,
+                                     index=constants.SEQUENTIAL_CMAPS.index('inferno'))
+    calendar_renderer = st.sidebar.radio('Calendar heat map renderer', ('altair', 'matplotlib'))
 
     st.sidebar.markdown('---')
-    cache_arg = 0
-    if st.sidebar.button('Fetch data now!'):
-        cache_arg = int(time.time())
-    all_data, fetch_time = get_sheets_data(cache_arg)
+    logbook_spec = components.add_logbook_select(logbooks.get_registry())
+    logbook_data = get_logbook_data(logbook_spec, force=st.sidebar.button('Fetch data now!'))
+    all_data, fetch_time, fetch_timings = logbook_data.all_data, logbook_data.fetch_time, logbook_data.fetch_timings
+    data_version = logbook_data.version
 
-    st.sidebar.write(f'_Last fetch @ '
-                     f'{fetch_time.astimezone(pytz.timezone("Europe/London")).isoformat(timespec="seconds", sep=" ")}'
-                     f' (1min cache)._')
+    freshness = get_logbook_cache().freshness(logbook_spec)
+    components.add_freshness_indicator(freshness.fetch_time or fetch_time, freshness)
+    st.sidebar.caption(' | '.join(f'{name}: {t * 1000:.0f}ms' for name, t in fetch_timings.items()))
 
     st.sidebar.markdown('---')
 
     # Title
-    cmap = cm.get_cmap(colourmap, 5)  # Draw extra sample otherwise the "X" is too light on the white background
+    title_colours = constants.TITLE_COLOURS[colourmap]
     st.markdown(f'<div style="font-family:sans-serif;font-size:300%;font-weight:bold">'
-                f'<span style="color:{matplotlib.colors.rgb2hex(cmap(0)[:3])}">C</span>'
-                f'<span style="color:{matplotlib.colors.rgb2hex(cmap(1)[:3])}">R</span>'
-                f'<span style="color:{matplotlib.colors.rgb2hex(cmap(2)[:3])}">V</span>'
-                f'<span style="color:{matplotlib.colors.rgb2hex(cmap(3)[:3])}">X</span>'
+                f'<span style="color:{title_colours[0]}">C</span>'
+                f'<span style="color:{title_colours[1]}">R</span>'
+                f'<span style="color:{title_colours[2]}">V</span>'
+                f'<span style="color:{title_colours[3]}">X</span>'
                 f'</div>',
                 unsafe_allow_html=True)
     st.write('_**C**limbing **R**ecord **V**isualisation e**X**perience_')
 
     # Initial processing
-    all_data = pre.drop_nan_rows(all_data)
-    all_data = pre.format_columns(all_data)
-    err_msg = pre.validate_indoor_data(all_data['indoor'], all_data['indoor_sessions'])
-    if err_msg:
-        st.error(err_msg)
+    for table, num_rows in logbook_data.dropped_rows.items():
+        if num_rows:  # Dropped when fetched, maybe in a background refresh, so warned about here
+            st.warning(f'Dropped {num_rows} rows with NaNs from dataframe {table}...')
+    if logbook_data.error:
+        st.error(logbook_data.error)
         st.stop()
+    df_activity_all = logbook_data.df_activity
+    st.sidebar.caption('Memory: ' + ' | '.join(f'{name}: {num_bytes / 1024:.0f}KiB'
+                                               for name, num_bytes in pre.memory_usage(all_data).items()))
 
-    df_activity = pre.get_climbing_activity_df(all_data['indoor_sessions'], all_data['outdoor'])
+    df_in_all, grade_cube_all, date_index = pipeline.get_grade_cube(
+        data_version, logbook_data.lineage, all_data['indoor'], all_data['indoor_sessions'], df_activity_all)
 
     # Filter date (sidebar)
-    start_date = df_activity['date'].min()
-    filtered_start_date, filtered_end_date = components.add_date_filter(start_date, df_activity['date'].max())
+    start_date = date_index.min_date
+    filtered_start_date, filtered_end_date = components.add_date_filter(date_index)
     date_fmt="%Y/%m/%d"
     f'_Tracking Climbing from: {start_date.strftime(date_fmt)}. ' \
     f'Currently viewing: {filtered_start_date.strftime(date_fmt)} to {filtered_end_date.strftime(date_fmt)}_'
 
-    df_activity = df_activity[(df_activity.index >= filtered_start_date.strftime('%Y-%m-%d')) &
-                              (df_activity.index <= filtered_end_date.strftime('%Y-%m-%d'))]
+    df_activity = pipeline.filter_activity(data_version, df_activity_all, date_index, filtered_start_date,
+                                           filtered_end_date)
 
     # Workout type filter (sidebar)
     st.sidebar.markdown('---')
-    df_in = pd.merge(all_data['indoor'], df_activity, how='left', on='date')
     workout_types = list(df_activity['workout_type'].unique())
     selected_types = st.sidebar.multiselect(
         'Workout types',
@@ -108,123 +134,35 @@ def main():
         st.error('No workout types selected :(')
         return
 
-    df_in = df_in[df_in['workout_type'].isin(selected_types)]
+    import plot  # Usually already imported by preload_modules
 
-    # Calculate common dataframes
-    df_in = pre.distribute_climbs(df_in, random_seed=42)
+    num_draws = components.add_split_grade_draws_select()
 
-    # Aggregate sent climbs
-    df_sent = df_in[df_in['sent']]  # drop unsent climbs
-    df_agg = df_sent.groupby(['date', 'v_grade']).agg(count=('sent', 'sum')).reset_index()
-    df_agg['v_points'] = df_agg.apply(pre.apply_v_grade_multiplier, axis=1, args=('count',))  # noqa
+    st.sidebar.markdown('---')
+    components.add_payload_size_toggle()
+    components.add_profiling_toggle()
+    time_freq = plot.time_resolution(filtered_start_date, filtered_end_date)
+
+    # Calculate common dataframes
+    key = pipeline.FilterKey(data_version, filtered_start_date, filtered_end_date, tuple(selected_types))
+    df_in, grade_cube = pipeline.get_climbs(key, df_in_all, grade_cube_all, date_index)
 
-    # Add in missing grades
-    df_agg = pre.expand_date_grades(df_agg)
+    # Headline numbers and the calendar first, as they're quick, then the selected section
+    sections.render_summary(pipeline.get_summary(key, grade_cube))
 
     '## Climbing Activity'
 
-    st.pyplot(plot.calendar_heat_map(df_activity, label='workout_type', colourmap=colourmap))
-
-    session_tab, timeseries_tab, grade_tab, attempts_tab = st.tabs(["Session", "Time Series", "Grade Total", "Attempts"])
-
-    with session_tab:
-        '## Session Visualisation'
-        df_agg_sess = df_agg.groupby('date').agg(
-            v_points_total_sess=pd.NamedAgg('v_points', 'sum'),
-            count_total_sess=pd.NamedAgg('count', 'sum')
-        ).reset_index()
-        df_agg_sess['v_points_mean_sess'] = df_agg_sess['v_points_total_sess']/df_agg_sess['count_total_sess']
-        st.altair_chart(plot.v_point_mean_and_sum_chart(df_agg_sess, colourmap) ,use_container_width=True)
-
-        top_ks = sorted([1, 3, 5, 10, 20])  # Specifies what top-K sends on which to take mean. Force sorted.
-
-        # By taking a top-k (for largest k) on full DF we speed-up the partial sorting further down.
-        top_sends = df_sent.groupby(pd.Grouper(key='date', freq='M'))['v_grade'].nlargest(top_ks[-1])
-
-        top_k_per_month = []
-        for date, month_top_sends in top_sends.groupby(level=0):
-            month_top_sends = month_top_sends.sort_values(ascending=False)
-            for k in top_ks:
-                top_k_per_month.append({'date': date, 'k': k, 'mean_top_k': month_top_sends.head(k).mean()})
-        df_top_sends = pd.DataFrame(top_k_per_month)
-
-        st.altair_chart(plot.top_k_sends_chart(df_top_sends, colourmap), use_container_width=True)
-
-        # Compute cumulative top-k for various ks
-        cum_top_k_heaps = {k: [] for k in top_ks}  # A dict of min-heaps
-        cum_top_k_sums = {k: 0 for k in top_ks}  # Sum for each heap in cum_top_k_heaps
-        mean_top_k = []
-        for i, row in df_sent.iterrows():
-            for k in top_ks:
-                cum_top_k_sums[k] += row['v_grade']
-                if len(cum_top_k_heaps[k]) < k:
-                    heapq.heappush(cum_top_k_heaps[k], row['v_grade'])
-                else:
-                    popped_val = heapq.heappushpop(cum_top_k_heaps[k], row['v_grade'])
-                    cum_top_k_sums[k] -= popped_val
-
-                mean_top_k.append({'date': row['date'], 'k': k, 'cum_mean_top_k': cum_top_k_sums[k]/k})
-        df_cum_top_k = pd.DataFrame(mean_top_k)
-
-        st.altair_chart(plot.cum_top_k_sends_chart(df_cum_top_k, colourmap), use_container_width=True)
-
-    with timeseries_tab:
-        '## Time series visualisations'
-        df_agg['count_csum'] = df_agg.groupby(['v_grade'])['count'].cumsum()
-        df_agg['v_points_csum'] = df_agg.apply(pre.apply_v_grade_multiplier, axis=1, args=('count_csum',))  # noqa
-
-        show_bar_labels = st.checkbox('Show bar chart labels', value=False)
-
-        st.altair_chart(plot.cumulative_stacked_area_chart(df_agg, "count_csum:Q", colourmap,
-                                                           title='Total climb count'),
-                        use_container_width=True)
-
-        st.altair_chart(
-            plot.stacked_bar_chart(df_agg, 'count:Q', colourmap, title='Climb Count', show_labels=show_bar_labels),
-            use_container_width=True)
-
-        st.altair_chart(plot.cumulative_stacked_area_chart(df_agg, "v_points_csum:Q", colourmap,
-                                                           title='Total V-point'),
-                        use_container_width=True)
-
-        st.altair_chart(
-            plot.stacked_bar_chart(df_agg, 'v_points:Q', colourmap, title='V Points', show_labels=show_bar_labels),
-            use_container_width=True)
-
-    with grade_tab:
-        '## Grade Total Visualisations'
-        draw_targets = st.checkbox('Enable "grade pyramid" target bars (grey).', value=False)
-        total_v_grades = df_sent.groupby('v_grade').agg(total_count=('sent', 'sum')).reset_index()
-        total_v_grades['target_count'] = pre.get_pyramid_targets(total_v_grades['total_count'])
-        st.altair_chart(
-            plot.total_v_grade_horizontal_bar_char(total_v_grades, colourmap, draw_targets=draw_targets).properties(
-                width=550,
-                height=350),
-            use_container_width=True)
-
-        st.altair_chart(plot.workout_type_v_grade_bar_charts(df_sent, colourmap).properties(
-            width=175,
-            height=250),
-            use_container_width=False)
-
-    with attempts_tab:
-        '## Attempt Visualisations'
-
-        df_att = df_in.copy()
-        df_att['attempts'] = df_att['attempts'].fillna(1).astype(int)
-        df_att = pre.expand_attempts(df_att)
-        df_att = df_att.groupby(['v_grade', 'attempt_num', 'sent']).agg(count=('date', 'count')).reset_index()
-        df_att['sent_str'] = df_att['sent'].astype(str)
-        st.altair_chart(plot.get_attempt_bar_chart(df_att, colourmap), use_container_width=True)
-
-        df_sent = df_att[df_att['sent']].copy()
-
-        st.altair_chart(plot.get_send_attempt_normalized(df_sent, colourmap), use_container_width=True)
-
-        if st.checkbox('Hide flashes', value=True):
-            df_att = df_att[(df_att['attempt_num'] > 1) | (~df_att['sent'])]
-
-        st.altair_chart(plot.get_attempt_and_send_bubble_chart(df_att, colourmap), use_container_width=True)
+    if calendar_renderer == 'altair':
+        components.altair_chart(plot.calendar_heat_map_chart(df_activity, label='workout_type', colourmap=colourmap),
+                                use_container_width=False)
+    else:
+        st.image(pipeline.render_calendar_heat_map(data_version, df_activity, filtered_start_date, filtered_end_date,
+                                                   colourmap))
+
+    inputs = sections.get_inputs(key, logbook_data.lineage, all_data, df_in_all, grade_cube_all, df_in, grade_cube,
+                                 colourmap=colourmap, time_freq=time_freq, num_draws=num_draws)
+    section_title = components.add_section_select([section.title for section in sections.SECTIONS])
+    sections.render(next(section for section in sections.SECTIONS if section.title == section_title), inputs)
 
     st.sidebar.markdown('---')
     st.sidebar.markdown('[_GitHub Source_](https://github.com/miguelarocao/crvx)')
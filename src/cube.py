@@ -0,0 +1,218 @@
+"""
+Dense (date x grade x workout type x sent) climb counts, built once per data version.
+
+Every aggregate shown in the app is a slice or a sum over the cube, so filtering by date or workout type is an index
+operation rather than a re-filter and re-group of the per-climb rows.
+"""
+import datetime as dt
+from dataclasses import dataclass
+from typing import Optional, Sequence
+
+import numpy as np
+import pandas as pd
+
+import preprocess as pre
+from constants import MAX_VGRADE, V_GRADE_MULT_ARRAY
+
+
+@dataclass
+class GradeCube:
+    dates: pd.DatetimeIndex  # Sorted unique climb dates
+    workout_types: pd.Index
+    counts: np.ndarray  # Climb counts indexed by (date, v_grade, workout_type, sent)
+
+    @property
+    def sends(self) -> np.ndarray:
+        """ Sent climbs per (date, v_grade), summed over workout types."""
+        return self.counts[..., 1].sum(axis=2)
+
+
+def build(df_in: pd.DataFrame) -> GradeCube:
+    """ Builds the cube from distributed climbs, i.e. with integer grades and workout types merged in."""
+    date_idx, dates = pd.factorize(df_in['date'], sort=True)
+    type_idx, workout_types = pd.factorize(df_in['workout_type'].astype(str), sort=True)
+    grades = df_in['v_grade'].to_numpy(dtype=int)
+
+    counts = np.zeros((len(dates), max(MAX_VGRADE, grades.max(initial=0) + 1), len(workout_types), 2), dtype=int)
+    np.add.at(counts, (date_idx, grades, type_idx, df_in['sent'].to_numpy(dtype=int)), 1)
+    return GradeCube(dates=pd.DatetimeIndex(dates), workout_types=pd.Index(workout_types), counts=counts)
+
+
+def add(cube: GradeCube, df_in: pd.DataFrame) -> GradeCube:
+    """
+    The cube with more distributed climbs added to it, e.g. appended ones, which only builds a cube of those. Same as
+    building the cube of all the climbs.
+    """
+    new = build(df_in)
+    dates = cube.dates.union(new.dates)
+    workout_types = cube.workout_types.union(new.workout_types)
+    counts = np.zeros((len(dates), max(cube.counts.shape[1], new.counts.shape[1]), len(workout_types), 2), dtype=int)
+    for part in (cube, new):
+        counts[np.ix_(dates.get_indexer(part.dates), np.arange(part.counts.shape[1]),
+                      workout_types.get_indexer(part.workout_types), [0, 1])] += part.counts
+    return GradeCube(dates=dates, workout_types=workout_types, counts=counts)
+
+
+def select(cube: GradeCube, start_date: dt.date, end_date: dt.date, workout_types: Sequence[str]) -> GradeCube:
+    """ Selects the dates in [start_date, end_date] and the given workout types."""
+    start = cube.dates.searchsorted(pd.Timestamp(start_date), side='left')
+    end = cube.dates.searchsorted(pd.Timestamp(end_date), side='right')
+    type_mask = cube.workout_types.isin(workout_types)
+    return GradeCube(dates=cube.dates[start:end], workout_types=cube.workout_types[type_mask],
+                     counts=cube.counts[start:end][:, :, type_mask])
+
+
+@dataclass
+class CumulativeSends:
+    """ Running totals of the sends of a cube, so that the cumulative sends of any selection are a subtraction."""
+    dates: pd.DatetimeIndex
+    workout_types: pd.Index
+    totals: np.ndarray  # Sends up to and including each date, indexed by (date, v_grade, workout_type)
+
+    def select(self, start_date: dt.date, end_date: dt.date, workout_types: Sequence[str]) -> np.ndarray:
+        """ Cumulative sends per (date, v_grade) from start_date, for the dates in [start_date, end_date]."""
+        start = self.dates.searchsorted(pd.Timestamp(start_date), side='left')
+        end = self.dates.searchsorted(pd.Timestamp(end_date), side='right')
+        totals = self.totals[:, :, self.workout_types.isin(workout_types)]
+        before_start = totals[start - 1].sum(axis=1) if start else 0
+        return totals[start:end].sum(axis=2) - before_start
+
+
+def cumulative_sends(cube: GradeCube) -> CumulativeSends:
+    return CumulativeSends(dates=cube.dates, workout_types=cube.workout_types,
+                           totals=np.cumsum(cube.counts[..., 1], axis=0))
+
+
+def extend_cumulative_sends(cumulative: CumulativeSends, cube: GradeCube, from_date: dt.date) -> CumulativeSends:
+    """
+    Updates the running totals to a cube that only differs from the one they were computed from on or after
+    from_date, e.g. after climbs were appended to the logbook. Only the totals from from_date onwards are computed,
+    unless the dates before it, the grades or the workout types changed.
+    """
+    start = cube.dates.searchsorted(pd.Timestamp(from_date), side='left')
+    if (not cumulative.workout_types.equals(cube.workout_types) or
+            cumulative.totals.shape[1] != cube.counts.shape[1] or
+            not cumulative.dates[:start].equals(cube.dates[:start])):
+        return cumulative_sends(cube)
+
+    before_start = cumulative.totals[start - 1] if start else 0
+    totals = np.concatenate([cumulative.totals[:start], before_start + np.cumsum(cube.counts[start:, ..., 1], axis=0)])
+    return CumulativeSends(dates=cube.dates, workout_types=cube.workout_types, totals=totals)
+
+
+def daily_sends(cube: GradeCube, cumulative: CumulativeSends, start_date: dt.date,
+                end_date: dt.date) -> pd.DataFrame:
+    """
+    Sent climb counts and V-points for each date and grade of a selected cube, along with their cumulative sums from
+    start_date. The cumulative sums come from the running totals of the whole cube, which the selection must be
+    from, and the same dates. Only covers the dates and grades with at least one send, but includes every (date,
+    grade) pair among those.
+    """
+    sends = cube.sends
+    date_mask = sends.sum(axis=1) > 0
+    grade_mask = sends.sum(axis=0) > 0
+    sends = sends[date_mask][:, grade_mask]
+    dates = cube.dates[date_mask]
+    grades = np.flatnonzero(grade_mask)
+    sends_csum = cumulative.select(start_date, end_date, cube.workout_types)[date_mask][:, grade_mask]
+
+    df = pd.DataFrame({'date': np.repeat(dates, len(grades)),
+                       'v_grade': np.tile(grades, len(dates)),
+                       'count': sends.ravel(),
+                       'count_csum': sends_csum.ravel()})
+    return pre.add_v_points(df, {'v_points': 'count', 'v_points_csum': 'count_csum'})
+
+
+def session_totals(cube: GradeCube) -> pd.DataFrame:
+    """ Total and mean V-points, and send count, for each date with at least one send."""
+    sends = cube.sends
+    date_mask = sends.sum(axis=1) > 0
+    sends = sends[date_mask]
+    df_agg_sess = pd.DataFrame({'date': cube.dates[date_mask],
+                                'v_points_total_sess': sends @ V_GRADE_MULT_ARRAY[np.arange(sends.shape[1])],
+                                'count_total_sess': sends.sum(axis=1)})
+    df_agg_sess['v_points_mean_sess'] = df_agg_sess['v_points_total_sess']/df_agg_sess['count_total_sess']
+    return df_agg_sess
+
+
+@dataclass
+class Summary:
+    sessions: int  # Dates with at least one climb
+    climbs: int
+    sends: int
+    v_points: float  # V0 sends are worth half a V-point
+    max_grade: Optional[int]  # Hardest grade sent, if any
+
+
+def summary(cube: GradeCube) -> Summary:
+    """ Headline totals of the cube."""
+    counts = cube.counts.sum(axis=2)  # (date, v_grade, sent)
+    sends = counts[..., 1].sum(axis=0)
+    sent_grades = np.flatnonzero(sends)
+    return Summary(sessions=int((counts.sum(axis=(1, 2)) > 0).sum()),
+                   climbs=int(counts.sum()),
+                   sends=int(sends.sum()),
+                   v_points=float(sends @ V_GRADE_MULT_ARRAY[np.arange(len(sends))]),
+                   max_grade=int(sent_grades[-1]) if len(sent_grades) else None)
+
+
+def _sent_grade_range(totals: np.ndarray) -> np.ndarray:
+    """ Mask of the grades from the lowest to the highest one sent, for each column of grade totals."""
+    sent = totals > 0
+    return (np.cumsum(sent, axis=0) > 0) & (np.cumsum(sent[::-1], axis=0)[::-1] > 0)
+
+
+def grade_totals(cube: GradeCube, pyramid_ratio=None) -> pd.DataFrame:
+    """
+    Total sent climbs of each grade with at least one send. Given a pyramid ratio (see pre.get_pyramid_targets), also
+    the pyramid's target counts, for every grade from the lowest to the highest one sent.
+    """
+    totals = cube.sends.sum(axis=0)
+    if pyramid_ratio is None:
+        grades = np.flatnonzero(totals)
+        return pd.DataFrame({'v_grade': grades, 'total_count': totals[grades]})
+
+    grades = np.flatnonzero(_sent_grade_range(totals))
+    return pd.DataFrame({'v_grade': grades, 'total_count': totals[grades],
+                         'target_count': pre.get_pyramid_targets(totals, pyramid_ratio)[grades]})
+
+
+def workout_type_totals(cube: GradeCube, pyramid_ratio=None) -> pd.DataFrame:
+    """
+    Total sent climbs of each (workout type, grade) with at least one send. Given a pyramid ratio, also the targets of
+    each workout type's pyramid, for every grade from the lowest to the highest one sent with that workout type.
+    """
+    totals = cube.counts[..., 1].sum(axis=0)  # (v_grade, workout_type)
+    if pyramid_ratio is None:
+        grades, types = np.nonzero(totals)
+        return pd.DataFrame({'workout_type': cube.workout_types[types],
+                             'v_grade': grades,
+                             'count': totals[grades, types]})
+
+    grades, types = np.nonzero(_sent_grade_range(totals))
+    return pd.DataFrame({'workout_type': cube.workout_types[types],
+                         'v_grade': grades,
+                         'count': totals[grades, types],
+                         'target_count': pre.get_pyramid_targets(totals, pyramid_ratio)[grades, types]})
+
+
+def period_top_k(cube: GradeCube, top_ks: Sequence[int], freq: str = 'M') -> pd.DataFrame:
+    """
+    Mean of the top-k sends of each period (e.g. 'W', 'M' or 'Q') with at least one send, for each k. Periods with
+    fewer than k sends take the mean of all their sends. Periods are labelled by their last day, like pd.Grouper.
+    """
+    ks = np.array(top_ks)
+    sends = cube.sends
+    date_mask = sends.sum(axis=1) > 0
+    if not date_mask.any():
+        return pd.DataFrame({'date': pd.DatetimeIndex([]), 'k': ks[:0], 'mean_top_k': np.zeros(0)})
+
+    # Grade histogram of each period, by summing the histograms of its dates
+    periods = cube.dates[date_mask].to_period(freq)
+    period_starts = np.flatnonzero(np.r_[True, periods[1:] != periods[:-1]])
+    period_counts = np.add.reduceat(sends[date_mask], period_starts, axis=0)
+
+    mean_top_k = pre.top_k_sums(period_counts, ks) / np.minimum(ks, period_counts.sum(axis=1)[:, None])
+    return pd.DataFrame({'date': np.repeat(periods[period_starts].end_time.normalize(), len(ks)),
+                         'k': np.tile(ks, len(period_starts)),
+                         'mean_top_k': mean_top_k.ravel()})
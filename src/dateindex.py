@@ -0,0 +1,61 @@
+"""
+Sorted dates of the activity and climbs frames, built once per data version, so that any date range resolves to row
+slices with a binary search rather than by comparing every row.
+"""
+import datetime as dt
+from dataclasses import dataclass
+from typing import Tuple
+
+import numpy as np
+import pandas as pd
+
+# Date filter presets, by how far back they go from the latest date. 'YTD' goes back to the start of its year.
+PRESETS = {'all': None, 'YTD': None, '1y': dt.timedelta(weeks=52), '6m': dt.timedelta(weeks=26)}
+
+
+@dataclass
+class DateIndex:
+    activity_dates: np.ndarray  # datetime64 of each activity row, sorted
+    climb_dates: np.ndarray  # datetime64 of each climb row, sorted
+
+    @property
+    def min_date(self) -> dt.date:
+        return pd.Timestamp(self.activity_dates[0]).date()
+
+    @property
+    def max_date(self) -> dt.date:
+        return pd.Timestamp(self.activity_dates[-1]).date()
+
+    def preset_range(self, preset: str) -> Tuple[dt.date, dt.date]:
+        """ Date range of one of the PRESETS, ending on the latest date."""
+        if preset == 'all':
+            return self.min_date, self.max_date
+        if preset == 'YTD':
+            return self.max_date.replace(month=1, day=1), self.max_date
+        return self.max_date - PRESETS[preset], self.max_date
+
+    def activity_rows(self, start_date: dt.date, end_date: dt.date) -> slice:
+        """ Rows of the activity frame in [start_date, end_date]."""
+        return _rows(self.activity_dates, start_date, end_date)
+
+    def climb_rows(self, start_date: dt.date, end_date: dt.date) -> slice:
+        """ Rows of the climbs frame in [start_date, end_date]."""
+        return _rows(self.climb_dates, start_date, end_date)
+
+
+def _rows(dates: np.ndarray, start_date: dt.date, end_date: dt.date) -> slice:
+    start = dates.searchsorted(np.datetime64(start_date, 'D'), side='left')
+    end = dates.searchsorted(np.datetime64(end_date, 'D') + 1, side='left')  # Any time on end_date
+    return slice(start, end)
+
+
+def sort_by_date(df: pd.DataFrame, dates: pd.Series) -> pd.DataFrame:
+    """ Sorts the frame by the given dates, keeping the order of rows on the same date."""
+    return df if dates.is_monotonic_increasing else df.iloc[np.argsort(dates.to_numpy(), kind='stable')]
+
+
+def build(df_activity: pd.DataFrame, df_climbs: pd.DataFrame) -> DateIndex:
+    """ Indexes the activity and climbs frames, which must be sorted by their date column (see sort_by_date)."""
+    assert df_activity['date'].is_monotonic_increasing, 'Activity must be sorted by date!'
+    assert df_climbs['date'].is_monotonic_increasing, 'Climbs must be sorted by date!'
+    return DateIndex(activity_dates=df_activity['date'].to_numpy(), climb_dates=df_climbs['date'].to_numpy())
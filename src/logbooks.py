@@ -0,0 +1,198 @@
+"""
+Registry of the logbooks the app can serve, and a process-wide cache of their data.
+
+Logbooks are configured in the Streamlit secrets, mapping the id used in the `?logbook=` URL parameter to the spec of
+its data source (see sources.from_spec), i.e. the name of a Google Sheets workbook or a local directory:
+
+    [logbooks]
+    default = "Climbing Data Long"
+    alex = "Alex's Climbing Data"
+    archive = "files:///data/climbing"
+
+Without secrets, the only logbook is the CRVX_LOGBOOK environment variable, or the default workbook if unset.
+
+The memory budget of the cache is the `logbook_cache_bytes` secret, 256 MiB by default. It only counts the logbooks'
+data: the pipeline's caches of what's derived from it hold up to pipeline.CACHE_ENTRIES entries per stage on top of it,
+and are dropped when a logbook is evicted (see crvx.get_logbook_cache).
+"""
+import os
+import datetime as dt
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import Callable, Dict, List, NamedTuple, Optional, Tuple
+
+import pandas as pd
+import streamlit as st
+
+DEFAULT_LOGBOOKS = {'default': os.environ.get('CRVX_LOGBOOK', 'Climbing Data Long')}
+DEFAULT_MAX_BYTES = 256 * 1024 ** 2
+
+
+def get_registry() -> Dict[str, str]:
+    """ Logbook ids and their source specs, from the secrets if configured."""
+    try:
+        return dict(st.secrets['logbooks'])
+    except (KeyError, FileNotFoundError):
+        return dict(DEFAULT_LOGBOOKS)
+
+
+class LogbookData(NamedTuple):
+    name: str  # Source spec
+    all_data: Dict[str, pd.DataFrame]  # Formatted, see pipeline.prepare_data
+    df_activity: Optional[pd.DataFrame]  # None if the data isn't valid
+    error: Optional[str]  # Why the data isn't valid, if it isn't
+    fetch_time: dt.datetime
+    fetch_timings: Dict[str, float]
+    num_bytes: int
+    generations: Dict[str, Optional[str]]  # See sources.SourceData
+    dropped_rows: Dict[str, int]  # Incomplete rows, shown by the page as fetches may run in the background
+
+    @property
+    def version(self) -> Tuple[str, dt.datetime]:
+        """ Identifies this data across logbooks, for keying caches of anything derived from it."""
+        return self.name, self.fetch_time
+
+    @property
+    def lineage(self) -> Tuple[Optional[str], ...]:
+        """
+        Generations of the climbs and sessions, which everything derived from the climbs depends on, as climbs only
+        take the workout types of the sessions (see pipeline.get_grade_cube).
+        """
+        return self.generations.get('indoor'), self.generations.get('indoor_sessions')
+
+    def has_same_tables(self, other: 'LogbookData') -> bool:
+        """
+        Whether the other data was fetched from the same tables, as told by their generations: tables with the same
+        generation and as many rows (kept or dropped) haven't changed.
+        """
+        return (None not in self.generations.values() and self.generations == other.generations and
+                self.dropped_rows == other.dropped_rows and
+                all(len(df) == len(other.all_data[table]) for table, df in self.all_data.items()))
+
+
+class Freshness(NamedTuple):
+    fetch_time: Optional[dt.datetime]  # Of the cached data, if any, or of its last refresh that found it unchanged
+    refreshing: bool
+    error: Optional[str]  # Why the last refresh failed, if it did
+
+
+class _Entry(NamedTuple):
+    refreshed: float  # Monotonic time of the last refresh, successful or not
+    fetch_time: dt.datetime  # Of the last successful refresh, see Freshness
+    data: LogbookData
+
+
+class LogbookCache:
+    """
+    Thread-safe cache of logbook data shared by every session, with a memory budget. The least recently used logbooks
+    are evicted first when over budget.
+
+    Data is served stale while it's revalidated: once it's older than the TTL, it's refreshed in a background thread
+    and the cached data is returned meanwhile. Refreshed data is swapped in if it passes validation, otherwise the
+    cached data is kept, and retried after another TTL. Refreshed data from the same tables (see
+    LogbookData.has_same_tables) isn't swapped in either, so that the version of the cached data, and everything
+    derived from it, is kept. Only logbooks that aren't cached yet are fetched in the
+    foreground, with concurrent requests coalesced into a single fetch, which all of them wait on.
+
+    on_evict is called with each evicted logbook, outside the lock, e.g. to drop the caches derived from its data.
+    """
+
+    def __init__(self, max_bytes: int = DEFAULT_MAX_BYTES, ttl: float = 60,
+                 on_evict: Optional[Callable[[str], None]] = None):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.on_evict = on_evict
+        self._lock = threading.Lock()
+        self._entries: 'OrderedDict[str, _Entry]' = OrderedDict()  # Least recently used first
+        self._in_flight: Dict[str, Future] = {}
+        self._errors: Dict[str, str] = {}
+
+    @property
+    def num_bytes(self) -> int:
+        with self._lock:
+            return sum(entry.data.num_bytes for entry in self._entries.values())
+
+    def get(self, logbook: str, fetch: Callable[[], LogbookData], force: bool = False,
+            validate: Optional[Callable[[LogbookData], Optional[str]]] = None) -> LogbookData:
+        """
+        Returns the cached data of the logbook, refreshing it in the background with fetch if it's expired or force is
+        set. validate returns why refreshed data can't replace the cached data, if it can't. Returns the fetched data
+        if the logbook isn't cached.
+        """
+        with self._lock:
+            entry = self._entries.get(logbook)
+            if entry is not None:
+                self._entries.move_to_end(logbook)
+                if (force or time.monotonic() - entry.refreshed >= self.ttl) and logbook not in self._in_flight:
+                    self._in_flight[logbook] = Future()
+                    threading.Thread(target=self._fetch, args=(logbook, fetch, validate), daemon=True).start()
+                return entry.data
+
+            future = self._in_flight.get(logbook)
+            if future is None:
+                self._in_flight[logbook] = Future()
+
+        if future is not None:
+            return future.result()
+        return self._fetch(logbook, fetch, raise_errors=True)
+
+    def freshness(self, logbook: str) -> Freshness:
+        with self._lock:
+            entry = self._entries.get(logbook)
+            return Freshness(entry.fetch_time if entry else None, logbook in self._in_flight,
+                             self._errors.get(logbook))
+
+    def _fetch(self, logbook: str, fetch: Callable[[], LogbookData],
+               validate: Optional[Callable[[LogbookData], Optional[str]]] = None, raise_errors: bool = False):
+        """ Fetches the logbook for the future in flight, swapping it into the cache unless it fails validation."""
+        future = self._in_flight[logbook]
+        try:
+            data = fetch()
+            error = validate(data) if validate is not None else None
+        except BaseException as e:
+            with self._lock:
+                self._failed(logbook, f'{type(e).__name__}: {e}')
+            future.set_exception(e)
+            if raise_errors:
+                raise
+            return None
+
+        evicted = []
+        with self._lock:
+            entry = self._entries.get(logbook)
+            if entry is not None and data.has_same_tables(entry.data):
+                data = entry.data
+            if error is None or entry is None:
+                self._entries[logbook] = _Entry(time.monotonic(), dt.datetime.now(dt.timezone.utc), data)
+                self._entries.move_to_end(logbook)
+                evicted = self._evict(keep=logbook)
+                self._errors.pop(logbook, None)
+                del self._in_flight[logbook]
+            else:
+                self._failed(logbook, error)
+        future.set_result(data)
+        if self.on_evict is not None:
+            for evicted_logbook in evicted:
+                self.on_evict(evicted_logbook)
+        return data
+
+    def _failed(self, logbook: str, error: str):
+        """ Keeps the cached data of the logbook, if any, until its next refresh after the TTL."""
+        del self._in_flight[logbook]
+        self._errors[logbook] = error
+        if logbook in self._entries:
+            self._entries[logbook] = self._entries[logbook]._replace(refreshed=time.monotonic())
+
+    def _evict(self, keep: str) -> List[str]:
+        """ Evicts the least recently used logbooks other than keep until within budget, and returns them."""
+        total = sum(entry.data.num_bytes for entry in self._entries.values())
+        evicted = []
+        for logbook in list(self._entries):
+            if total <= self.max_bytes:
+                break
+            if logbook != keep:
+                total -= self._entries.pop(logbook).data.num_bytes
+                evicted.append(logbook)
+        return evicted
@@ -0,0 +1,350 @@
+"""
+Cached stages of the data pipeline behind crvx.main.
+
+The data is prepared once per fetch by prepare_data, which isn't cached here as the logbook cache keeps its output (see
+crvx.fetch_logbook_data). Every other stage is keyed on the data version (the logbook and its fetch timestamp) and,
+after filtering, on the filter state. Dataframe arguments are prefixed with an underscore so Streamlit doesn't hash
+them: they are fully determined by the key. Display-only widgets (colourmap, labels, ...) never reach these
+functions, so toggling them only re-renders.
+"""
+import datetime as dt
+import io
+import operator
+from typing import Any, Callable, Dict, NamedTuple, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+import streamlit as st
+
+import cube
+import dateindex
+import preprocess as pre
+import profiling
+import splitgrades
+import trainingload
+from constants import TOP_KS
+
+CACHE_ENTRIES = 16  # Per stage, for every logbook, on top of the logbook cache's memory budget (see forget)
+
+DataVersion = Tuple[str, dt.datetime]  # (logbook source spec, fetch time), see logbooks.LogbookData.version
+Lineage = Tuple[Optional[str], ...]  # Generations of the climbs and sessions tables, see sources.SourceData
+
+
+class FilterKey(NamedTuple):
+    data_version: DataVersion
+    start_date: dt.date
+    end_date: dt.date
+    workout_types: Tuple[str, ...]
+
+
+@profiling.timed
+def prepare_data(raw_data: Dict[str, pd.DataFrame]):
+    """
+    Cleans, formats and validates the raw sheets data. Returns (all_data, df_activity, dropped_rows, err_msg), with
+    the activity sorted by date, or None if the data isn't valid, and the number of incomplete rows dropped from each
+    table.
+    """
+    all_data = pre.drop_nan_rows(raw_data)
+    dropped_rows = {name: len(df) - len(all_data[name]) for name, df in raw_data.items()}
+    all_data = pre.format_columns(all_data)
+    err_msg = pre.validate_indoor_data(all_data['indoor'], all_data['indoor_sessions'])
+    if err_msg:
+        return all_data, None, dropped_rows, err_msg
+
+    df_activity = pre.get_climbing_activity_df(all_data['indoor_sessions'], all_data['outdoor'])
+    return all_data, dateindex.sort_by_date(df_activity, df_activity['date']), dropped_rows, None
+
+
+@profiling.timed
+@st.cache_data(max_entries=CACHE_ENTRIES, show_spinner=False)
+def filter_activity(data_version: DataVersion, _df_activity: pd.DataFrame, _date_index: dateindex.DateIndex,
+                    start_date: dt.date, end_date: dt.date):
+    return _df_activity.iloc[_date_index.activity_rows(start_date, end_date)]
+
+
+@profiling.timed
+@st.cache_data(max_entries=CACHE_ENTRIES, show_spinner=False)
+def render_calendar_heat_map(data_version: DataVersion, _df_activity: pd.DataFrame, start_date: dt.date,
+                             end_date: dt.date, colourmap: str) -> bytes:
+    """ Renders the matplotlib calendar heat map of the filtered activity to PNG, only when its inputs change."""
+    import matplotlib.pyplot as plt
+    import plot
+
+    fig = plot.calendar_heat_map(_df_activity, label='workout_type', colourmap=colourmap)
+    buffer = io.BytesIO()
+    fig.savefig(buffer, format='png', dpi=200, bbox_inches='tight')  # Same as st.pyplot
+    plt.close(fig)
+    return buffer.getvalue()
+
+
+class AppendState(NamedTuple):
+    data_version: DataVersion
+    lineage: Lineage
+    last_rows: Tuple[int, ...]  # Label of the last row of each table the value covers
+    params: Tuple  # Of the stage, other than the tables
+    value: Any
+
+
+@st.cache_resource
+def _append_states() -> Dict[Tuple[str, str], AppendState]:
+    """ Latest value of each incremental stage for each logbook, shared by every session."""
+    return {}
+
+
+def forget(logbook: str):
+    """
+    Drops everything derived from the logbook's data, once the logbook cache evicts it, so that what's derived from
+    evicted logbooks doesn't outlive them. Streamlit can only clear every entry of a cached stage, so the stages are
+    cleared for every logbook, and recomputed on their next run.
+    """
+    states = _append_states()
+    for stage, state_logbook in list(states):
+        if state_logbook == logbook:
+            states.pop((stage, state_logbook), None)
+    st.cache_data.clear()
+
+
+def _build_or_extend(stage: str, data_version: DataVersion, lineage: Lineage, tables: Tuple[pd.DataFrame, ...],
+                     build: Callable[[], Any], extend: Callable[[Any, Tuple[pd.DataFrame, ...]], Any],
+                     params: Tuple = ()):
+    """
+    Builds the value of an incremental stage from the tables, or extends its value for the previous data version of
+    the logbook if that has the same lineage, i.e. the tables have only had rows appended since, and the stage had the
+    same params, e.g. filters. extend is given the previous value and the rows appended to each table. Without
+    appended rows, the previous value is reused.
+    """
+    logbook, fetch_time = data_version
+    states = _append_states()
+    prev = states.get((stage, logbook))
+    last_rows = tuple(int(df.index.max()) if len(df) else 0 for df in tables)
+
+    if (prev is not None and None not in lineage and prev.lineage == lineage and prev.params == params and
+            prev.data_version[1] <= fetch_time and all(map(operator.le, prev.last_rows, last_rows))):
+        appended = tuple(df[df.index > last_row] for df, last_row in zip(tables, prev.last_rows))
+        value = extend(prev.value, appended) if any(len(df) for df in appended) else prev.value
+    else:
+        value = build()
+
+    if prev is None or prev.data_version[1] <= fetch_time:
+        states[(stage, logbook)] = AppendState(data_version, lineage, last_rows, params, value)
+    return value
+
+
+def _first_date(appended: Tuple[pd.DataFrame, ...]) -> pd.Timestamp:
+    return min(df['date'].min() for df in appended if len(df))
+
+
+class DistributedClimbs(NamedTuple):
+    df_in: pd.DataFrame  # Sorted by date
+    grade_cube: cube.GradeCube
+    num_rows: int  # Distributed climbs, VB included, which the labels of the next ones start from
+    rng_state: dict  # Of the generator the split grades were resolved with, to resolve the next ones
+
+
+def _distribute_climbs(df_climbs: pd.DataFrame, df_sessions: pd.DataFrame, rng: np.random.Generator,
+                       num_rows: int = 0) -> pd.DataFrame:
+    """ Distributes the climbs, with the workout types of their sessions, labelled from num_rows."""
+    df_in = pd.merge(df_climbs, df_sessions[['date', 'workout_type']], how='left', on='date')
+    df_in = pre.distribute_climbs(df_in, random_seed=rng)
+    df_in.index += num_rows
+    return df_in
+
+
+def _extend_distributed_climbs(climbs: DistributedClimbs, df_climbs: pd.DataFrame,
+                               df_sessions: pd.DataFrame) -> DistributedClimbs:
+    """ Distributes appended climbs, resolving their split grades as if they had been distributed with the others."""
+    rng = np.random.default_rng()
+    rng.bit_generator.state = climbs.rng_state
+    df_new = _distribute_climbs(df_climbs, df_sessions, rng, climbs.num_rows)
+
+    df_in = climbs.df_in
+    workout_types = df_new['workout_type'].cat.categories  # Of every session, so including those of df_in
+    if not df_in['workout_type'].cat.categories.equals(workout_types):
+        df_in = df_in.assign(workout_type=df_in['workout_type'].cat.set_categories(workout_types))
+    df_in = pd.concat([df_in, df_new])
+    return DistributedClimbs(dateindex.sort_by_date(df_in, df_in['date']), cube.add(climbs.grade_cube, df_new),
+                             climbs.num_rows + int(df_climbs['count_multiplier'].sum()), rng.bit_generator.state)
+
+
+@profiling.timed
+@st.cache_data(max_entries=CACHE_ENTRIES, show_spinner=False)
+def get_grade_cube(data_version: DataVersion, lineage: Lineage, _df_climbs: pd.DataFrame, _df_sessions: pd.DataFrame,
+                   _df_activity: pd.DataFrame):
+    """
+    Distributes every climb and builds the grade cube, once per data version. Returns (df_in, grade_cube, date_index),
+    with the climbs sorted by date, and the date index of the activity and climbs. Like get_cumulative_sends, if the
+    climbs and sessions have only had rows appended since the previous data version of the logbook, only the appended
+    climbs are distributed and added to its cube.
+    """
+    def build():
+        rng = np.random.default_rng(42)
+        df_in = _distribute_climbs(_df_climbs, _df_sessions, rng)
+        return DistributedClimbs(dateindex.sort_by_date(df_in, df_in['date']), cube.build(df_in),
+                                 int(_df_climbs['count_multiplier'].sum()), rng.bit_generator.state)
+
+    climbs = _build_or_extend(
+        'distributed_climbs', data_version, lineage, (_df_climbs, _df_sessions), build=build,
+        extend=lambda climbs, appended: _extend_distributed_climbs(climbs, appended[0], _df_sessions))
+    return climbs.df_in, climbs.grade_cube, dateindex.build(_df_activity, climbs.df_in)
+
+
+@profiling.timed
+@st.cache_data(max_entries=CACHE_ENTRIES, show_spinner=False)
+def get_split_grade_sends(data_version: DataVersion, _df_climbs: pd.DataFrame,
+                          _df_sessions: pd.DataFrame) -> splitgrades.Sends:
+    """ The sends with their split grades unresolved, once per data version, see get_split_grade_draws."""
+    return splitgrades.build(pd.merge(_df_climbs, _df_sessions[['date', 'workout_type']], how='left', on='date'))
+
+
+@profiling.timed
+@st.cache_data(max_entries=CACHE_ENTRIES, show_spinner=False)
+def get_split_grade_draws(key: FilterKey, _sends: splitgrades.Sends, freq: str,
+                          num_draws: int) -> splitgrades.GradeDraws:
+    """ num_draws resolutions of the split grades of the filtered sends, as grade histograms of each period."""
+    return splitgrades.draw(_sends, key.start_date, key.end_date, key.workout_types, freq, num_draws)
+
+
+@profiling.timed
+@st.cache_data(max_entries=CACHE_ENTRIES, show_spinner=False)
+def get_v_point_bands(key: FilterKey, _sends: splitgrades.Sends, freq: str, num_draws: int) -> pd.DataFrame:
+    return splitgrades.v_points(get_split_grade_draws(key, _sends, freq, num_draws))
+
+
+@profiling.timed
+@st.cache_data(max_entries=CACHE_ENTRIES, show_spinner=False)
+def get_top_send_bands(key: FilterKey, _sends: splitgrades.Sends, freq: str, num_draws: int) -> pd.DataFrame:
+    return splitgrades.period_top_k(get_split_grade_draws(key, _sends, freq, num_draws), TOP_KS)
+
+
+@profiling.timed
+@st.cache_data(max_entries=CACHE_ENTRIES, show_spinner=False)
+def get_grade_total_bands(key: FilterKey, _sends: splitgrades.Sends, num_draws: int,
+                          pyramid_ratio=None) -> pd.DataFrame:
+    # Totals don't depend on the periods drawn in, so any frequency will do
+    return splitgrades.grade_totals(get_split_grade_draws(key, _sends, 'M', num_draws), pyramid_ratio)
+
+
+@profiling.timed
+@st.cache_data(max_entries=CACHE_ENTRIES, show_spinner=False)
+def get_cumulative_sends(data_version: DataVersion, lineage: Lineage, _df_climbs: pd.DataFrame,
+                         _grade_cube: cube.GradeCube) -> cube.CumulativeSends:
+    """
+    Running totals of the sends in the grade cube. If the previous data version of the logbook has the same lineage,
+    its climbs and sessions have only had rows appended since, so its running totals are extended from the date of
+    the first appended climb rather than computed from scratch.
+    """
+    return _build_or_extend(
+        'cumulative_sends', data_version, lineage, (_df_climbs,),
+        build=lambda: cube.cumulative_sends(_grade_cube),
+        extend=lambda sends, appended: cube.extend_cumulative_sends(sends, _grade_cube, _first_date(appended)))
+
+
+@profiling.timed
+@st.cache_data(max_entries=CACHE_ENTRIES, show_spinner=False)
+def get_training_load(data_version: DataVersion, lineage: Lineage, _df_climbs: pd.DataFrame,
+                      _df_sessions: pd.DataFrame, _grade_cube: cube.GradeCube) -> trainingload.TrainingLoad:
+    """ Training load of every session, extended from the first appended climb or session like get_cumulative_sends."""
+    return _build_or_extend(
+        'training_load', data_version, lineage, (_df_climbs, _df_sessions),
+        build=lambda: trainingload.build(_df_sessions, _grade_cube),
+        extend=lambda load, appended: trainingload.extend(load, _df_sessions, _grade_cube, _first_date(appended)))
+
+
+@profiling.timed
+@st.cache_data(max_entries=CACHE_ENTRIES, show_spinner=False)
+def get_climbs(key: FilterKey, _df_in: pd.DataFrame, _grade_cube: cube.GradeCube, _date_index: dateindex.DateIndex):
+    """ Selects the filtered climbs and grade cube. Returns (df_in, grade_cube)."""
+    df_in = _df_in.iloc[_date_index.climb_rows(key.start_date, key.end_date)]
+    if not df_in['workout_type'].isin(key.workout_types).all():
+        df_in = df_in[df_in['workout_type'].isin(key.workout_types)]
+    return df_in, cube.select(_grade_cube, key.start_date, key.end_date, key.workout_types)
+
+
+@profiling.timed
+@st.cache_data(max_entries=CACHE_ENTRIES, show_spinner=False)
+def get_summary(key: FilterKey, _grade_cube: cube.GradeCube) -> cube.Summary:
+    return cube.summary(_grade_cube)
+
+
+class CumulativeTopK(NamedTuple):
+    df_cum_top_k: pd.DataFrame  # Of every send from the start date, see pre.cumulative_top_k
+    state: pre.CumTopKState
+    last_date: Optional[pd.Timestamp]  # Of the last send, if any
+
+
+def _cumulative_top_k(df_in: pd.DataFrame, from_date: pd.Timestamp, workout_types: Tuple[str, ...],
+                      top_k: Optional[CumulativeTopK] = None) -> CumulativeTopK:
+    """ Cumulative top-k of the sends from from_date of the climbs, sorted by date, resumed from top_k if given."""
+    df_in = df_in.iloc[df_in['date'].searchsorted(from_date):]
+    df_sent = df_in[df_in['sent'] & df_in['workout_type'].isin(workout_types)]
+    df_cum_top_k, state = pre.cumulative_top_k(df_sent, TOP_KS, top_k.state if top_k is not None else None)
+    if top_k is not None and len(top_k.df_cum_top_k):
+        df_cum_top_k = pd.concat([top_k.df_cum_top_k, df_cum_top_k], ignore_index=True)
+    last_date = df_sent['date'].iloc[-1] if len(df_sent) else top_k.last_date if top_k is not None else None
+    return CumulativeTopK(df_cum_top_k, state, last_date)
+
+
+@profiling.timed
+@st.cache_data(max_entries=CACHE_ENTRIES, show_spinner=False)
+def get_session_frames(key: FilterKey, lineage: Lineage, _df_climbs: pd.DataFrame, _df_in_all: pd.DataFrame,
+                       _grade_cube: cube.GradeCube):
+    """
+    Returns (df_agg_sess, df_cum_top_k) for the Session tab. The cumulative top-k is of every send from the start date,
+    cut at the last send shown, so that it's resumed from the previous data version's when climbs of later dates are
+    appended, like get_cumulative_sends.
+    """
+    df_agg_sess = cube.session_totals(_grade_cube)
+
+    start_date = pd.Timestamp(key.start_date)
+
+    def extend(top_k: CumulativeTopK, appended: Tuple[pd.DataFrame, ...]) -> CumulativeTopK:
+        from_date = _first_date(appended)
+        if top_k.last_date is not None and from_date <= top_k.last_date:
+            # The sends of the last date are already counted, and their top-k emitted, so it can't be resumed
+            return _cumulative_top_k(_df_in_all, start_date, key.workout_types)
+        return _cumulative_top_k(_df_in_all, max(from_date, start_date), key.workout_types, top_k)
+
+    top_k = _build_or_extend(
+        'cumulative_top_k', key.data_version, lineage, (_df_climbs,),
+        build=lambda: _cumulative_top_k(_df_in_all, start_date, key.workout_types), extend=extend,
+        params=(key.start_date, key.workout_types))
+    return df_agg_sess, pre.cumulative_top_k_until(top_k.df_cum_top_k, df_agg_sess['date'].max())
+
+
+@profiling.timed
+@st.cache_data(max_entries=CACHE_ENTRIES, show_spinner=False)
+def get_top_sends(key: FilterKey, _grade_cube: cube.GradeCube, freq: str) -> pd.DataFrame:
+    return cube.period_top_k(_grade_cube, TOP_KS, freq=freq)
+
+
+@profiling.timed
+@st.cache_data(max_entries=CACHE_ENTRIES, show_spinner=False)
+def get_time_series(key: FilterKey, _grade_cube: cube.GradeCube,
+                    _cumulative_sends: cube.CumulativeSends) -> pd.DataFrame:
+    return cube.daily_sends(_grade_cube, _cumulative_sends, key.start_date, key.end_date)
+
+
+@profiling.timed
+@st.cache_data(max_entries=CACHE_ENTRIES, show_spinner=False)
+def get_grade_totals(key: FilterKey, _grade_cube: cube.GradeCube, pyramid_ratio=None):
+    """
+    Returns (total_v_grades, workout_type_v_grades) for the Grade Total tab, with the targets of their grade pyramids
+    if given a pyramid ratio (see pre.get_pyramid_targets).
+    """
+    return cube.grade_totals(_grade_cube, pyramid_ratio), cube.workout_type_totals(_grade_cube, pyramid_ratio)
+
+
+@profiling.timed
+@st.cache_data(max_entries=CACHE_ENTRIES, show_spinner=False)
+def get_training_loads(key: FilterKey, _training_load: trainingload.TrainingLoad, freq: str) -> pd.DataFrame:
+    return _training_load.select(key.start_date, key.end_date, key.workout_types, freq=freq)
+
+
+@profiling.timed
+@st.cache_data(max_entries=CACHE_ENTRIES, show_spinner=False)
+def get_attempt_counts(key: FilterKey, _df_in: pd.DataFrame) -> pd.DataFrame:
+    df_att = _df_in.copy()
+    df_att['attempts'] = df_att['attempts'].fillna(1).astype(int)
+    df_att = pre.count_attempts(df_att)
+    df_att['sent_str'] = df_att['sent'].astype(str)
+    return df_att
@@ -1,57 +1,53 @@
 import altair as alt
 import pandas as pd
-import calmap
 import numpy as np
-from matplotlib import cm
-from mpl_toolkits.axes_grid1 import make_axes_locatable
-
-SEQUENTIAL_CMAPS = [
-    # 'blues',
-    # 'tealblues',
-    # 'teals',
-    # 'greens',
-    # 'browns',
-    # 'oranges',
-    # 'reds',
-    # 'purples',
-    # 'warmgreys',
-    # 'greys', # TODO: Re-enable Vega colormaps with Matplotlib equivalent
-    'viridis',
-    'magma',
-    'inferno',
-    'plasma',
-    # 'bluegreen',
-    # 'bluepurpl',
-    # 'oldgreen',
-    # 'oldorange',
-    # 'goldred',
-    # 'greenblue',
-    # 'orangered',
-    # 'purplebluegreen',
-    # 'purpleblue',
-    # 'purplered',
-    # 'redpurple',
-    # 'yellowgreenblue',
-    # 'yellowgreen',
-    # 'yelloworangebrown',
-    # 'yelloworangered',
-    # 'darkblue',
-    # 'darkgold',
-    # 'darkgreen',
-    # 'darkmulti',
-    # 'darkred',
-    # 'lightgreyred',
-    # 'lightgreyteal',
-    # 'lightmulti',
-    # 'lightorange',
-    # 'lighttealblue'
-]
+
+import profiling
 
 LABEL_FONT_SIZE = 10
 TITLE_FONT_SIZE = 13
 
+# Time resolution of date charts, by the maximum number of days in the date range it's used for
+TIME_RESOLUTIONS = [(366, 'D'), (3 * 366, 'W'), (None, 'M')]
+# Vega-Lite time unit and axis title of each time resolution
+TIME_UNITS = {'D': ('yearmonthdate', 'Date'), 'W': ('yearmonthdate', 'Week'), 'M': ('yearmonth', 'Month')}
+
+
+def time_resolution(start_date, end_date) -> str:
+    """ Picks a coarser time resolution for longer date ranges, to keep the number of points per chart bounded."""
+    num_days = (pd.Timestamp(end_date) - pd.Timestamp(start_date)).days
+    for max_days, freq in TIME_RESOLUTIONS:
+        if max_days is None or num_days <= max_days:
+            return freq
+
+
+def coarsen_dates(df_long: pd.DataFrame, freq: str, sum_cols=(), last_cols=()) -> pd.DataFrame:
+    """
+    Aggregates a (date, v_grade) frame sorted by date to the start of each period of the given frequency. Summing
+    sum_cols, and keeping the last value of last_cols (e.g. cumulative sums). Other columns are dropped.
+    """
+    if freq == 'D':
+        return df_long[['date', 'v_grade', *sum_cols, *last_cols]]
+    period_start = df_long['date'].dt.to_period(freq).dt.start_time.rename('date')
+    return df_long.groupby([period_start, 'v_grade']).agg(
+        **{col: (col, 'sum') for col in sum_cols},
+        **{col: (col, 'last') for col in last_cols}
+    ).reset_index()
+
 
+def payload_size(chart: alt.TopLevelMixin) -> int:
+    """ Size in bytes of the chart's JSON spec, including its data, as sent to the browser."""
+    with alt.data_transformers.enable('default', max_rows=None):  # Streamlit doesn't limit the rows either
+        return len(chart.to_json(indent=None).encode())
+
+
+@profiling.timed
 def calendar_heat_map(df_dates, label: str, colourmap: str):
+    # Imported here as matplotlib is slow to import and only needed by this renderer
+    import calmap
+    from matplotlib import cm
+    from mpl_toolkits.axes_grid1 import make_axes_locatable
+
     assert (df_dates[label] != 0).all()
     # Only use subset of labels present in dataframe.
     # This might be less than the original number of categories due to date filter.
@@ -76,7 +72,47 @@ def calendar_heat_map(df_dates, label: str, colourmap: str):
     return fig
 
 
-def cumulative_stacked_area_chart(df_long: pd.DataFrame, y: str, colourmap: str, title: str):
+@profiling.timed(json_size=payload_size)
+def calendar_heat_map_chart(df_dates, label: str, colourmap: str):
+    """ Altair equivalent of calendar_heat_map, with one row of weeks per year and days without a label in grey."""
+    labels = df_dates[label].astype('str').astype('category')
+    labels = labels.cat.remove_unused_categories()
+
+    days = pd.date_range(f'{df_dates.index.min().year}-01-01', f'{df_dates.index.max().year}-12-31', freq='D')
+    year_start_weekday = (days - pd.to_timedelta(days.dayofyear - 1, unit='D')).dayofweek
+    df_cal = pd.DataFrame({
+        'date': days,
+        'year': days.year,
+        'week': (days.dayofyear - 1 + year_start_weekday) // 7,
+        'day': days.dayofweek,
+        label: labels.reindex(days).to_numpy(),
+    })
+
+    return alt.Chart(df_cal).mark_rect(stroke='white', strokeWidth=1).encode(
+        x=alt.X('week:O', title=None, axis=None),
+        y=alt.Y('day:O', title=None,
+                axis=alt.Axis(labelExpr="['M', 'T', 'W', 'T', 'F', 'S', 'S'][datum.value]", values=[0, 2, 4, 6])),
+        color=alt.condition(f'isValid(datum.{label})',
+                            alt.Color(f'{label}:O', title=None,
+                                      scale=alt.Scale(scheme=colourmap, domain=list(labels.cat.categories))),
+                            alt.value('lightgrey')),
+        row=alt.Row('year:O', title=None,
+                    header=alt.Header(labelFontSize=20, labelAngle=0, labelAlign='left')),
+        tooltip=[alt.Tooltip('date:T', title='Date'), alt.Tooltip(f'{label}:N', title=label)],
+    ).properties(
+        width=alt.Step(12),
+        height=alt.Step(12)
+    ).configure_axis(
+        labelFontSize=LABEL_FONT_SIZE,
+        titleFontSize=TITLE_FONT_SIZE
+    ).configure_view(
+        strokeWidth=0
+    )
+
+
+@profiling.timed(json_size=payload_size)
+def cumulative_stacked_area_chart(df_long: pd.DataFrame, y: str, colourmap: str, title: str, freq: str = 'D'):
+    df_long = coarsen_dates(df_long, freq, last_cols=[y.split(':')[0]])
     return alt.Chart(df_long).mark_area().encode(
         x='date:T',
         y=alt.Y(y, title=title),
@@ -88,19 +124,26 @@ def cumulative_stacked_area_chart(df_long: pd.DataFrame, y: str, colourmap: str,
     )
 
 
-def stacked_bar_chart(df_long: pd.DataFrame, y: str, colourmap: str, title: str, show_labels: bool = True):
-    bars = alt.Chart(df_long).mark_bar().encode(
-        x=alt.X('yearmonthdate(date):O', title='Date'),
+@profiling.timed(json_size=payload_size)
+def stacked_bar_chart(df_long: pd.DataFrame, y: str, colourmap: str, title: str, show_labels: bool = True,
+                      freq: str = 'D'):
+    y_col = y.split(':')[0]
+    df_long = coarsen_dates(df_long, freq, sum_cols=[y_col])
+    time_unit, x_title = TIME_UNITS[freq]
+
+    # Zero-height bars draw nothing, so don't send them
+    bars = alt.Chart(df_long[df_long[y_col] != 0]).mark_bar().encode(
+        x=alt.X(f'{time_unit}(date):O', title=x_title),
         y=alt.Y(y, title=title),
         color=alt.Color('v_grade:O', scale=alt.Scale(scheme=colourmap), title='V Grade'),
         order=alt.Order('v_grade:O', sort='ascending'))
 
-    text = alt.Chart(df_long).mark_text(dy=-7).encode(
-        x=alt.X('yearmonthdate(date):O', title='Date'),
-        y=alt.Y(f'sum({y.split(":")[0]}):Q', stack='zero'),
-        text=f'sum({y.split(":")[0]}):Q')
-
     if show_labels:
+        totals = df_long.groupby('date')[y_col].sum().reset_index()
+        text = alt.Chart(totals).mark_text(dy=-7).encode(
+            x=alt.X(f'{time_unit}(date):O', title=x_title),
+            y=alt.Y(f'{y_col}:Q'),
+            text=f'{y_col}:Q')
         bars = (bars + text)
 
     return bars.configure_axis(
@@ -109,9 +152,28 @@ def stacked_bar_chart(df_long: pd.DataFrame, y: str, colourmap: str, title: str,
     )
 
 
+@profiling.timed(json_size=payload_size)
+def v_points_band_chart(df, colourmap, num_draws, freq='D'):
+    """ Median V-points of each period over the draws of splitgrades.v_points, within their percentile band."""
+    time_unit, x_title = TIME_UNITS[freq]
+    base = alt.Chart(df).encode(x=alt.X(f'{time_unit}(date):T', title=x_title))
+    band = base.mark_area(opacity=0.3, color='grey').encode(y=alt.Y('v_points_low:Q', title='V Points'),
+                                                             y2='v_points_high:Q')
+    line = base.mark_line(color='grey').encode(y='v_points:Q')
+    points = line.mark_circle(size=30).encode(color=alt.Color('v_points:Q', scale=alt.Scale(scheme=colourmap),
+                                                              legend=None))
+    return (band + line + points).properties(title=f'V Points over {num_draws} draws of split grades').configure_axis(
+        labelFontSize=LABEL_FONT_SIZE,
+        titleFontSize=TITLE_FONT_SIZE
+    )
+
+
+@profiling.timed(json_size=payload_size)
 def total_v_grade_horizontal_bar_char(total_v_grades, colourmap, draw_targets=False):
     assert not draw_targets or 'target_count' in total_v_grades.columns, "Cannot draw targets that don't exist!"
 
+    total_v_grades = total_v_grades[total_v_grades.columns.intersection(
+        ['v_grade', 'total_count', 'total_count_low', 'total_count_high'] + (['target_count'] if draw_targets else []))]
     v_grade_ints = sorted(total_v_grades['v_grade'], reverse=True)
     bars = alt.Chart(total_v_grades).mark_bar().encode(
         x=alt.X('total_count:Q', title='Climb Count'),
@@ -128,6 +190,12 @@ def total_v_grade_horizontal_bar_char(total_v_grades, colourmap, draw_targets=Fa
     )
 
     output = bars + text
+    if 'total_count_low' in total_v_grades.columns:
+        output += alt.Chart(total_v_grades).mark_rule(color='grey').encode(
+            x='total_count_low:Q',
+            x2='total_count_high:Q',
+            y=alt.Y('v_grade:O', sort=v_grade_ints),
+        )
     if draw_targets:
         bars_target = alt.Chart(total_v_grades).mark_bar(opacity=0.25).encode(
             x='target_count:Q',
@@ -141,12 +209,29 @@ def total_v_grade_horizontal_bar_char(total_v_grades, colourmap, draw_targets=Fa
     )
 
 
-def workout_type_v_grade_bar_charts(df, colourmap):
+@profiling.timed(json_size=payload_size)
+def workout_type_v_grade_bar_charts(df, colourmap, draw_targets=False, width=175, height=250):
+    """
+    Expects the count of sent climbs per (workout_type, v_grade), and their target_count to draw targets. The width
+    and height are of each workout type's chart.
+    """
+    assert not draw_targets or 'target_count' in df.columns, "Cannot draw targets that don't exist!"
+
+    df = df[['workout_type', 'v_grade', 'count'] + (['target_count'] if draw_targets else [])]
     v_grade_ints = sorted(df['v_grade'].unique(), reverse=True)
-    bars = alt.Chart(df).mark_bar().encode(
-        x=alt.X('sum(sent):Q', title='Climb Count'),
+    layers = [alt.Chart().mark_bar().encode(
+        x=alt.X('count:Q', title='Climb Count'),
         y=alt.Y('v_grade:O', sort=v_grade_ints, title='V Grade'),
         color=alt.Color('v_grade:O', scale=alt.Scale(scheme=colourmap), title='V Grade'),
+    )]
+    if draw_targets:
+        layers.append(alt.Chart().mark_bar(opacity=0.25).encode(
+            x='target_count:Q',
+            y=alt.Y('v_grade:O', sort=v_grade_ints),
+        ))
+
+    # Layers can only be split by workout type with a facet, rather than a column encoding
+    bars = alt.layer(*layers, data=df).properties(width=width, height=height).facet(
         column=alt.Column('workout_type:N', title='By Workout Type', sort='descending',
                           header=alt.Header(titleFontSize=12, labelFontSize=12))
     ).configure_axis(
@@ -156,10 +241,12 @@ def workout_type_v_grade_bar_charts(df, colourmap):
     return bars
 
 
+@profiling.timed(json_size=payload_size)
 def get_attempt_bar_chart(df, colourmap):
+    df = df.groupby(['v_grade', 'sent_str']).agg(count=('count', 'sum')).reset_index()
     v_grade_ints = sorted(df['v_grade'].unique(), reverse=True)
     bars = alt.Chart(df).mark_bar().encode(
-        x=alt.X('sum(count):Q', title='Total Attempts'),
+        x=alt.X('count:Q', title='Total Attempts'),
         y=alt.Y('v_grade:O', sort=v_grade_ints, title='V Grade'),
         color=alt.Color('sent_str:N', scale=alt.Scale(scheme=colourmap), title='Send Go'),
     ).configure_axis(
@@ -169,7 +256,9 @@ def get_attempt_bar_chart(df, colourmap):
     return bars
 
 
+@profiling.timed(json_size=payload_size)
 def get_send_attempt_normalized(df, colourmap):
+    df = df[['v_grade', 'attempt_num', 'count']]
     v_grade_ints = sorted(df['v_grade'].unique(), reverse=True)
     bars = alt.Chart(df).mark_bar().encode(
         x=alt.X('sum(count)', title='% of attempts', stack='normalize'),
@@ -182,7 +271,9 @@ def get_send_attempt_normalized(df, colourmap):
     return bars
 
 
+@profiling.timed(json_size=payload_size)
 def get_attempt_and_send_bubble_chart(df, colourmap):
+    df = df[['v_grade', 'attempt_num', 'sent_str', 'count']]
     v_grade_ints = sorted(df['v_grade'].unique(), reverse=True)
     bubbles = alt.Chart(df).mark_circle(opacity=1.0).encode(
         x=alt.X('attempt_num:O', title='Attempt Number'),
@@ -196,7 +287,9 @@ def get_attempt_and_send_bubble_chart(df, colourmap):
     return bubbles
 
 
+@profiling.timed(json_size=payload_size)
 def v_point_mean_and_sum_chart(df, colourmap):
+    df = df[['date', 'v_points_total_sess', 'v_points_mean_sess']]
     circles = alt.Chart(df).mark_circle(size=100, opacity=0.8).encode(
         y=alt.Y('v_points_total_sess', title='Sum of V Points'),
         x=alt.X('v_points_mean_sess', title='Mean V Grade'),
@@ -208,19 +301,26 @@ def v_point_mean_and_sum_chart(df, colourmap):
     return circles
 
 
-def top_k_sends_chart(df, colourmap):
-    return alt.Chart(df).mark_line().encode(
+@profiling.timed(json_size=payload_size)
+def top_k_sends_chart(df, colourmap, period='Month'):
+    """ Draws the percentile bands of the means too if given, e.g. by splitgrades.period_top_k."""
+    lines = alt.Chart(df).mark_line().encode(
         x=alt.Y('date:T', title='Date'),
-        y=alt.Y('mean_top_k:Q', title='Mean of top-K climbs per Month'),
+        y=alt.Y('mean_top_k:Q', title=f'Mean of top-K climbs per {period}'),
         color=alt.Color('k:O', scale=alt.Scale(scheme=colourmap, reverse=True), title='K')
-    ).configure_axis(
+    )
+    if 'mean_top_k_low' in df.columns:
+        lines = lines.mark_area(opacity=0.2).encode(y='mean_top_k_low:Q', y2='mean_top_k_high:Q') + lines
+    return lines.configure_axis(
         labelFontSize=LABEL_FONT_SIZE,
         titleFontSize=TITLE_FONT_SIZE
     )
 
 
+@profiling.timed(json_size=payload_size)
 def cum_top_k_sends_chart(df, colourmap):
-    return alt.Chart(df).mark_line().encode(
+    # Points are only given where the cumulative mean changes, so hold each value until the next one.
+    return alt.Chart(df).mark_line(interpolate='step-after').encode(
         x=alt.Y('date:T', title='Date'),
         y=alt.Y('cum_mean_top_k:Q', title='Cumulative mean of top-K climbs'),
         color=alt.Color('k:O', scale=alt.Scale(scheme=colourmap, reverse=True), title='K')
@@ -228,3 +328,37 @@ def cum_top_k_sends_chart(df, colourmap):
         labelFontSize=LABEL_FONT_SIZE,
         titleFontSize=TITLE_FONT_SIZE
     )
+
+
+@profiling.timed(json_size=payload_size)
+def training_load_chart(df, colourmap, title, freq='D'):
+    """ Load of each period as bars, under the mean daily load of the acute and chronic windows as lines."""
+    df = df[['date', 'load', 'acute', 'chronic']]
+    period = {'D': 'day', 'W': 'week', 'M': 'month'}[freq]
+    base = alt.Chart(df).encode(x=alt.X('date:T', title='Date'))
+    bars = base.mark_bar(opacity=0.3, color='grey').encode(y=alt.Y('load:Q', title=f'{title} per {period}'))
+    lines = base.transform_fold(['acute', 'chronic'], as_=['window', 'mean']).mark_line().encode(
+        y=alt.Y('mean:Q', title=f'Mean daily {title}'),
+        color=alt.Color('window:N', scale=alt.Scale(scheme=colourmap), title='Window')
+    )
+    return alt.layer(bars, lines).resolve_scale(y='independent').configure_axis(
+        labelFontSize=LABEL_FONT_SIZE,
+        titleFontSize=TITLE_FONT_SIZE
+    )
+
+
+@profiling.timed(json_size=payload_size)
+def acwr_chart(df, colourmap, target_range):
+    """ Acute:chronic workload ratio, over a band of its target range."""
+    df = df[['date', 'acwr']]
+    band = alt.Chart(pd.DataFrame({'low': [target_range[0]], 'high': [target_range[1]]})).mark_rect(
+        opacity=0.15, color='grey').encode(y='low:Q', y2='high:Q')
+    line = alt.Chart(df).mark_line(color='grey').encode(
+        x=alt.X('date:T', title='Date'),
+        y=alt.Y('acwr:Q', title='Acute:chronic workload ratio')
+    )
+    points = line.mark_circle(size=30).encode(color=alt.Color('acwr:Q', scale=alt.Scale(scheme=colourmap), legend=None))
+    return alt.layer(band, line, points).configure_axis(
+        labelFontSize=LABEL_FONT_SIZE,
+        titleFontSize=TITLE_FONT_SIZE
+    )
@@ -1,10 +1,9 @@
+import numpy as np
 import pandas as pd
-import random
-import streamlit as st
+from dataclasses import dataclass
 from typing import Optional
-from copy import deepcopy
-from typing import Dict
-from constants import V_GRADE_MULT
+from typing import Dict, Sequence, Tuple, Union
+from constants import MAX_VGRADE, V_GRADE_MULT_ARRAY
 
 
 def header_to_col(df):
@@ -13,49 +12,102 @@ def header_to_col(df):
 
 
 def drop_nan_rows(all_data: Dict[str, pd.DataFrame]) -> Dict[str, pd.DataFrame]:
+    """ Drops the rows with missing values, other than in OPTIONAL_COLUMNS. Frames may be raw or formatted."""
     output = {}
     for name, df in all_data.items():
-        output[name] = df.dropna(axis=0)
-        num_na = len(df) - len(output[name])
-        if num_na:
-            st.warning(f'Dropped {len(df) - len(output[name])} rows with NaNs from dataframe {name}...')
+        names, optional = COLUMN_NAMES.get(name, {}), OPTIONAL_COLUMNS.get(name, ())
+        output[name] = df.dropna(axis=0, subset=[col for col in df.columns if names.get(col, col) not in optional])
     return output
 
 
-def format_columns(all_data: Dict) -> Dict:
-    out = deepcopy(all_data)
-    # Rename
-    out['indoor'] = out['indoor'].rename(columns={'Date': 'date',
-                                                  'V Grade': 'v_grade',
-                                                  'Count Multiplier': 'count_multiplier',
-                                                  'Attempts (w/ send)': 'attempts',
-                                                  'Sent': 'sent'})
-    out['indoor_sessions'] = out['indoor_sessions'].rename(columns={'Date': 'date',
-                                                                    'workout type': 'workout_type',
-                                                                    'climbing time': 'climbing_time',
-                                                                    'total time': 'total_time'})
-    out['outdoor'] = out['outdoor'].rename(columns={'Date': 'date',
-                                                    'Grade': 'v_grade'})
-
-    def _format_date_col(date_col):
-        return pd.to_datetime(date_col, format='%d/%m/%Y')
-
-    # Remove "V"
-    out['indoor']['v_grade'] = out['indoor']['v_grade'].str[1:]
-
-    # apply types
-    out['indoor']['date'] = _format_date_col(out['indoor']['date'])
-    numeric_cols = ['count_multiplier', 'attempts']
-    out['indoor'][numeric_cols] = out['indoor'][numeric_cols].apply(pd.to_numeric)
-    out['indoor']['sent'] = out['indoor']['sent'].apply(lambda x: x == 'TRUE')
-
-    out['indoor_sessions']['date'] = _format_date_col(out['indoor_sessions']['date'])
-
-    out['outdoor']['date'] = _format_date_col(out['outdoor']['date'])
+# Sheet column names of each frame, renamed to the names used everywhere else
+COLUMN_NAMES = {
+    'indoor': {'Date': 'date',
+               'V Grade': 'v_grade',
+               'Count Multiplier': 'count_multiplier',
+               'Attempts (w/ send)': 'attempts',
+               'Sent': 'sent'},
+    'indoor_sessions': {'Date': 'date',
+                        'workout type': 'workout_type',
+                        'climbing time': 'climbing_time',
+                        'total time': 'total_time'},
+    'outdoor': {'Date': 'date',
+                'Grade': 'v_grade'},
+}
+
+# Columns whose missing values don't drop their row, by their renamed name. Session times only feed the training load,
+# in which missing times count as no load (see _format_minutes_col).
+OPTIONAL_COLUMNS = {'indoor_sessions': ('climbing_time', 'total_time')}
+
+
+def _format_date_col(date_col):
+    return pd.to_datetime(date_col, format='%d/%m/%Y')
+
+
+def _format_int_col(col, dtype):
+    """ Parses integers into a small dtype, falling back to float32 if there are missing values."""
+    values = pd.to_numeric(col)
+    return values.astype(dtype if values.notna().all() else 'float32')
+
+
+def _format_minutes_col(col):
+    """
+    Parses session times in minutes. Only the training load uses them, so times that aren't numbers (e.g. "1:30") are
+    missing rather than an error, and count as no load.
+    """
+    return pd.to_numeric(col, errors='coerce').astype('float32')
 
+
+def _format_grade_col(col):
+    """ Categorical grades without the "V", which is only stripped once per distinct grade."""
+    return col.astype('category').cat.rename_categories(lambda grade: grade[1:] if grade.startswith('V') else grade)
+
+
+def _format_bool_col(col):
+    return col if col.dtype == bool else pd.Series(col.to_numpy() == 'TRUE', index=col.index)
+
+
+# Parser of each typed column of each frame. Other columns are kept as they are.
+COLUMN_FORMATS = {
+    'indoor': {'date': _format_date_col,
+               'v_grade': _format_grade_col,
+               'count_multiplier': lambda col: _format_int_col(col, 'int16'),
+               'attempts': lambda col: _format_int_col(col, 'int16'),
+               'sent': _format_bool_col},
+    'indoor_sessions': {'date': _format_date_col,
+                        'workout_type': lambda col: col.astype('category'),
+                        'climbing_time': _format_minutes_col,
+                        'total_time': _format_minutes_col},
+    'outdoor': {'date': _format_date_col,
+                'v_grade': lambda col: col.astype('category')},
+}
+
+
+def format_columns(all_data: Dict) -> Dict:
+    """
+    Renames and types the columns of each frame: datetime64 dates, categorical grades and workout types, boolean sends
+    and small integer counts. The input frames are left untouched, without deep-copying them.
+
+    Formatting is idempotent, so frames may be formatted as they are loaded (e.g. chunk by chunk), or come with typed
+    columns (e.g. from Parquet).
+    """
+    out = {}
+    for name, df in all_data.items():
+        names = COLUMN_NAMES.get(name, {})
+        formats = COLUMN_FORMATS.get(name, {})
+        columns = {}
+        for col, values in df.items():
+            col = names.get(col, col)
+            columns[col] = formats[col](values) if col in formats else values
+        out[name] = pd.DataFrame(columns, index=df.index)
     return out
 
 
+def memory_usage(all_data: Dict[str, pd.DataFrame]) -> Dict[str, int]:
+    """ Memory used by each frame in bytes, including the contents of object columns."""
+    return {name: int(df.memory_usage(deep=True).sum()) for name, df in all_data.items()}
+
+
 def validate_indoor_data(df_in: pd.DataFrame, df_in_sess: pd.DataFrame) -> Optional[str]:
     climb_dates = set(df_in['date'])
     sess_dates = set(df_in_sess['date'])
@@ -81,73 +133,207 @@ def get_climbing_activity_df(df_in_sess: pd.DataFrame, df_out: pd.DataFrame) ->
     return df_dates.set_index(pd.to_datetime(df_dates['date'], format='%d/%m/%Y')).rename_axis(None)
 
 
-def _split_grade(v_grade):
-    if '-' in v_grade:
-        lower_grade, upper_grade = v_grade.split('-')
-        lower_grade = -1 if lower_grade == 'B' else int(lower_grade)
-        upper_grade = int(upper_grade)
+def _parse_grade_range(v_grade: str) -> Tuple[int, int]:
+    """ Parses a grade, or range of grades such as "3-5" or "B-1", into its lower and upper grades. VB is -1."""
+    lower_grade, _, upper_grade = v_grade.partition('-')
+    lower_grade = -1 if lower_grade == 'B' else int(lower_grade)
+    upper_grade = (-1 if upper_grade == 'B' else int(upper_grade)) if upper_grade else lower_grade
+    return lower_grade, upper_grade
 
-        grade = random.choice(range(lower_grade, upper_grade + 1))
-        return f'{"B" if grade == -1 else grade}'
-    else:
-        return v_grade
 
+def grade_bounds(v_grades: pd.Series) -> np.ndarray:
+    """ Lower and upper grade of each grade or range of grades, as an array of (grades, 2). Parses each one once."""
+    codes, uniques = pd.factorize(v_grades)
+    bounds = np.array([_parse_grade_range(v_grade) for v_grade in uniques], dtype=int).reshape(-1, 2)
+    return bounds[codes]
 
-def distribute_climbs(df_in: pd.DataFrame, random_seed: int, drop_vb=True) -> pd.DataFrame:
-    """ Distributes climbs based on the count multiplier and resolves split grades into integers."""
-    # Apply count multiplier
-    expected_num_climb = df_in['count_multiplier'].sum()
-    df_in = df_in.reindex(df_in.index.repeat(df_in['count_multiplier'])).reset_index(drop=True)
-    df_in = df_in.drop(columns='count_multiplier')
-    assert len(df_in) == expected_num_climb
 
-    random.seed(random_seed)
-    df_in['v_grade'] = df_in['v_grade'].apply(_split_grade)
+def resolve_grades(v_grades: pd.Series, repeats: np.ndarray, rng: np.random.Generator) -> np.ndarray:
+    """
+    Resolves grades into integers, repeating each one the given number of times. Ranges of grades are resolved by
+    uniformly drawing a grade from the range for each repeat. Each distinct grade string is only parsed once.
+    """
+    bounds = np.repeat(grade_bounds(v_grades), repeats, axis=0)
+    return rng.integers(bounds[:, 0], bounds[:, 1] + 1).astype(np.int8)
 
-    if drop_vb:
-        df_in = df_in[df_in['v_grade'] != 'B']
-        df_in['v_grade'] = df_in['v_grade'].astype(int)
 
-    return df_in
+def distribute_climbs(df_in: pd.DataFrame, random_seed: Union[int, np.random.Generator], drop_vb=True) -> pd.DataFrame:
+    """
+    Distributes climbs based on the count multiplier and resolves split grades into integers. Split grades are drawn
+    in the order of the climbs, so that given the generator the previous climbs were resolved with, appended climbs
+    are resolved as if they had been resolved along with them.
+    """
+    # Apply count multiplier
+    repeats = df_in['count_multiplier'].to_numpy(dtype=int)
+    v_grades = resolve_grades(df_in['v_grade'], repeats, np.random.default_rng(random_seed))
 
+    df_in = df_in.drop(columns=['count_multiplier', 'v_grade'])
+    df_in = df_in.iloc[np.repeat(np.arange(len(df_in)), repeats)].reset_index(drop=True)
+    assert len(df_in) == repeats.sum()
 
-def expand_date_grades(df: pd.DataFrame) -> pd.DataFrame:
-    """ Expands each date to include each v-grade. """
-    unique_dates = sorted(df['date'].unique())
-    unique_v_grades = sorted(df['v_grade'].unique())
-    expand_df = pd.DataFrame(index=pd.MultiIndex.from_product([unique_dates, unique_v_grades],
-                                                              names=['date', 'v_grade'])).reset_index()
-    df = expand_df.merge(df, on=['date', 'v_grade'], how='left', validate='one_to_many')
-    df['count'] = df['count'].fillna(0)
+    if drop_vb:
+        df_in['v_grade'] = v_grades
+        df_in = df_in[v_grades != -1]
+    else:
+        df_in['v_grade'] = np.where(v_grades == -1, 'B', v_grades.astype(str))
 
-    return df.sort_values(by=['date', 'v_grade'])
+    return df_in
 
 
 def expand_attempts(df: pd.DataFrame) -> pd.DataFrame:
     """ Converts number of attempts, to individual attempts."""
+    attempts = df['attempts'].to_numpy(dtype=int)
+    row_idx = np.repeat(np.arange(len(df)), attempts)
 
-    output = []
-    for _, row in df.iterrows():
-        sent = row['sent']
-        for i in range(1, row['attempts'] + 1):
-            row['attempt_num'] = i
-            row['sent'] = sent if i == row['attempts'] else False
-            output.append(pd.DataFrame([row]))
-
-    return pd.concat(output)
+    # Offset of each expanded row within the attempts of its original row
+    starts = np.cumsum(attempts) - attempts
+    attempt_num = np.arange(len(row_idx)) - starts[row_idx] + 1
 
+    out = df.iloc[row_idx].copy()
+    out['attempt_num'] = attempt_num
+    out['sent'] = df['sent'].to_numpy(dtype=bool)[row_idx] & (attempt_num == attempts[row_idx])
+    return out
 
-def apply_v_grade_multiplier(row, target_col):
-    return V_GRADE_MULT[f'V{row["v_grade"]}'] * row[target_col]
 
+def count_attempts(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Counts individual attempts per (v_grade, attempt_num, sent), without expanding the attempts into rows.
+    Equivalent to grouping the output of expand_attempts, but only scales with the number of grades and attempts.
+    """
+    grades, grade_idx = np.unique(df['v_grade'].to_numpy(), return_inverse=True)
+    attempts = df['attempts'].to_numpy(dtype=int)
+    sent = df['sent'].to_numpy(dtype=bool)
+
+    # Number of climbs per (grade, total attempts, sent)
+    final = np.zeros((len(grades), attempts.max(initial=0) + 1, 2), dtype=int)
+    np.add.at(final, (grade_idx, attempts, sent.astype(int)), 1)
+
+    # Every attempt before the last one of a climb is unsent, so attempt n is unsent once for each climb with more
+    # than n attempts.
+    totals = final.sum(axis=2)
+    more_attempts = np.cumsum(totals[:, ::-1], axis=1)[:, ::-1] - totals
+    counts = final.copy()
+    counts[:, :, 0] += more_attempts
+
+    counts[:, 0, :] = 0  # Climbs logged with zero attempts don't expand to any attempt
+    grade_pos, attempt_num, sent_pos = np.nonzero(counts)
+    return pd.DataFrame({'v_grade': grades[grade_pos],
+                         'attempt_num': attempt_num,
+                         'sent': sent_pos.astype(bool),
+                         'count': counts[grade_pos, attempt_num, sent_pos]})
+
+
+@dataclass
+class CumTopKState:
+    """ Running state of cumulative_top_k, so that newly appended climbs can extend the curves."""
+    top_ks: Tuple[int, ...]
+    grade_counts: np.ndarray  # Histogram of every grade seen so far
+    last_sums: Optional[np.ndarray] = None  # Last emitted top-k sum for each k
+
+
+def top_k_sums(grade_counts: np.ndarray, top_ks: np.ndarray) -> np.ndarray:
+    """ Sum of the top-k grades for each row of grade histograms and each k. Returns an array of (rows, ks)."""
+    counts_desc = grade_counts[:, ::-1]
+    grades_desc = np.arange(grade_counts.shape[1])[::-1]
+    counts_above = np.cumsum(counts_desc, axis=1) - counts_desc
+    # Number of climbs of each grade that make it into the top-k, for each k
+    taken = np.clip(top_ks[:, None, None] - counts_above[None], 0, counts_desc[None])
+    return (taken @ grades_desc).T
+
+
+def cumulative_top_k(df_sent: pd.DataFrame, top_ks: Sequence[int], state: Optional[CumTopKState] = None,
+                     chunk_size: int = 2 ** 16) -> Tuple[pd.DataFrame, CumTopKState]:
+    """
+    Computes the cumulative mean of the top-k sends for each k, in the order the climbs were logged.
+
+    Only the last value of each date is emitted, and only when it changed, so the output should be drawn as a step
+    function, up to the date it should reach (see cumulative_top_k_until). Pass the returned state back in along with
+    newly appended climbs, of later dates, to extend the curves without replaying the whole history.
+    """
+    if state is None:
+        state = CumTopKState(top_ks=tuple(top_ks), grade_counts=np.zeros(MAX_VGRADE, dtype=int))
+    assert state.top_ks == tuple(top_ks), 'Cannot resume cumulative top-k with different ks!'
+    ks = np.array(state.top_ks)
+
+    grades = df_sent['v_grade'].to_numpy(dtype=int)
+    dates = df_sent['date'].to_numpy()
+    grade_counts = state.grade_counts
+    if len(grades) and grades.max() >= len(grade_counts):
+        grade_counts = np.pad(grade_counts, (0, grades.max() + 1 - len(grade_counts)))
+    last_sums = state.last_sums
+
+    # Emit on the last climb of each date
+    last_of_date = np.ones(len(dates), dtype=bool)
+    last_of_date[:-1] = dates[1:] != dates[:-1]
 
-def get_pyramid_targets(total_v_count):
-    targets = total_v_count.copy()
-    for i, count in targets[::-1].items():
-        if i == len(targets) - 1:
-            continue
-        targets[i] = max(targets[i + 1] * 2, count)
-    return targets
+    output = []
+    for start in range(0, len(grades), chunk_size):
+        chunk = slice(start, start + chunk_size)
+        one_hot = np.zeros((len(grades[chunk]), len(grade_counts)), dtype=int)
+        one_hot[np.arange(len(one_hot)), grades[chunk]] = 1
+        chunk_counts = grade_counts + np.cumsum(one_hot, axis=0)
+        grade_counts = chunk_counts[-1]
+
+        rows = np.flatnonzero(last_of_date[chunk])
+        sums = top_k_sums(chunk_counts[rows], ks)
+
+        # Keep the sums that differ from the previously emitted one for the same k
+        prev_sums = np.vstack([sums[:1] + 1 if last_sums is None else last_sums, sums[:-1]])
+        emit = sums != prev_sums
+        if len(sums):
+            last_sums = sums[-1]
+
+        row_pos, k_pos = np.nonzero(emit)
+        output.append(pd.DataFrame({'date': dates[chunk][rows[row_pos]],
+                                    'k': ks[k_pos],
+                                    'cum_mean_top_k': sums[row_pos, k_pos] / ks[k_pos]}))
+
+    df_cum_top_k = pd.concat(output, ignore_index=True) if output else \
+        pd.DataFrame({'date': dates[:0], 'k': ks[:0], 'cum_mean_top_k': np.zeros(0)})
+    return df_cum_top_k, CumTopKState(top_ks=state.top_ks, grade_counts=grade_counts, last_sums=last_sums)
+
+
+def cumulative_top_k_until(df_cum_top_k: pd.DataFrame, last_date) -> pd.DataFrame:
+    """ The curves of cumulative_top_k up to last_date, e.g. of the last send shown, with a point on it for each k."""
+    df_cum_top_k = df_cum_top_k[df_cum_top_k['date'] <= last_date]
+    last = df_cum_top_k.drop_duplicates('k', keep='last')
+    last = last[last['date'] < last_date].assign(date=last_date)
+    return pd.concat([df_cum_top_k, last], ignore_index=True) if len(last) else df_cum_top_k.reset_index(drop=True)
+
+
+def add_v_points(df: pd.DataFrame, columns: Dict[str, str]) -> pd.DataFrame:
+    """
+    Adds V-point columns in one vectorized pass, by multiplying source columns with the multiplier of each row's grade.
+    E.g. columns={'v_points': 'count'} adds a "v_points" column computed from the "count" column.
+    """
+    mult = V_GRADE_MULT_ARRAY[df['v_grade'].to_numpy(dtype=int)]
+    return df.assign(**{v_points_col: mult * df[col].to_numpy() for v_points_col, col in columns.items()})
+
+
+def pyramid_scales(num_grades: int, ratio: Union[float, Sequence[float]]) -> np.ndarray:
+    """
+    Relative size of each grade's level in a pyramid, with V0 as 1. The ratio is either between all consecutive
+    grades, or between each pair from V0-V1 upwards, with the last ratio repeating for the grades above it.
+    """
+    ratios = np.atleast_1d(np.asarray(ratio, dtype=float))
+    steps = ratios[np.minimum(np.arange(num_grades - 1), len(ratios) - 1)]
+    return np.r_[1, np.cumprod(steps)] if num_grades else np.ones(0)
+
+
+def get_pyramid_targets(grade_counts: np.ndarray, ratio: Union[float, Sequence[float]] = 2.0) -> np.ndarray:
+    """
+    Target climb counts for a grade pyramid, given counts indexed by integer grade from V0 (along the first axis).
+    Each grade's target is at least its count, and at least ratio times the target of the grade above it. Other axes,
+    e.g. workout types, are independent pyramids, computed at once.
+
+    Unrolling the recursion, the target of grade i is max_{j >= i} count_j * scale_j / scale_i where scale is the
+    running product of the ratios, i.e. a reversed cumulative maximum of the scaled counts.
+    """
+    grade_counts = np.asarray(grade_counts)
+    scales = pyramid_scales(len(grade_counts), ratio).reshape(-1, *[1] * (grade_counts.ndim - 1))
+    scaled_max = np.maximum.accumulate((grade_counts * scales)[::-1], axis=0)[::-1]
+    # Rounded, as floating point errors would otherwise round counts up
+    return np.ceil(np.round(scaled_max / scales, 6)).astype(int)
 
 
 # Currently unused
@@ -0,0 +1,145 @@
+"""
+Opt-in instrumentation of the stages of crvx.main, shown in the sidebar.
+
+Functions decorated with `timed` record their wall time and the number of rows they take in and return, but only while
+a rerun is being profiled (see `rerun`), so they cost a single lookup otherwise. Chart builders also record the size
+of their chart's JSON spec. Pipeline stages are timed around their cache, so cache hits show up as fast stages.
+
+Profiled reruns can also be dumped with cProfile, to CRVX_PROFILE_DIR (~/.cache/crvx/profiles by default), e.g. to
+be viewed with snakeviz.
+"""
+import contextvars
+import cProfile
+import datetime as dt
+import functools
+import os
+import time
+from collections import deque
+from contextlib import contextmanager
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Callable, List, Optional
+
+import pandas as pd
+import streamlit as st
+
+PROFILE_DIR = Path(os.environ.get('CRVX_PROFILE_DIR', Path.home() / '.cache' / 'crvx' / 'profiles'))
+HISTORY_LENGTH = 20
+
+
+@dataclass
+class StageTiming:
+    name: str
+    seconds: float
+    rows_in: Optional[int] = None
+    rows_out: Optional[int] = None
+    json_bytes: Optional[int] = None
+
+
+_timings: contextvars.ContextVar = contextvars.ContextVar('timings', default=None)
+
+
+def _num_rows(value) -> Optional[int]:
+    """ Total rows of the dataframes in a value, looking into dicts and tuples. None if there are none."""
+    if isinstance(value, (pd.DataFrame, pd.Series)):
+        return len(value)
+    if isinstance(value, dict):
+        value = list(value.values())
+    if isinstance(value, (tuple, list)):
+        rows = [num_rows for num_rows in map(_num_rows, value) if num_rows is not None]
+        return sum(rows) if rows else None
+    return None
+
+
+def timed(func: Optional[Callable] = None, *, name: Optional[str] = None, json_size: Optional[Callable] = None):
+    """
+    Records the calls of func while a rerun is profiled. If given, json_size is called on the result to record the
+    size of its JSON payload, e.g. plot.payload_size for chart builders.
+    """
+    if func is None:
+        return functools.partial(timed, name=name, json_size=json_size)
+    name = name or f'{func.__module__}.{func.__name__}'
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        timings = _timings.get()
+        if timings is None:
+            return func(*args, **kwargs)
+
+        start = time.perf_counter()
+        result = func(*args, **kwargs)
+        timing = StageTiming(name, time.perf_counter() - start, rows_in=_num_rows([args, kwargs]),
+                             rows_out=_num_rows(result))
+        if json_size is not None:
+            timing.json_bytes = json_size(result)
+        timings.append(timing)
+        return result
+
+    return wrapper
+
+
+@contextmanager
+def collect():
+    """ Records the calls of timed functions in its body, yielding the list they're appended to."""
+    timings: List[StageTiming] = []
+    token = _timings.set(timings)
+    try:
+        yield timings
+    finally:
+        _timings.reset(token)
+
+
+@contextmanager
+def rerun(enabled: bool, dump: bool = False):
+    """ Profiles the rerun in its body if enabled, then adds its breakdown and history to the sidebar."""
+    if not enabled:
+        yield
+        return
+
+    profiler = cProfile.Profile() if dump else None
+    start = time.perf_counter()
+    with collect() as timings:
+        try:
+            if profiler:
+                profiler.enable()
+            yield
+        finally:
+            if profiler:
+                profiler.disable()
+            total = time.perf_counter() - start
+    dump_path = _dump(profiler) if profiler else None
+    _add_report(timings, total, dump_path)
+
+
+def _dump(profiler: cProfile.Profile) -> Path:
+    PROFILE_DIR.mkdir(parents=True, exist_ok=True)
+    path = PROFILE_DIR / f'crvx-{dt.datetime.now():%Y%m%d-%H%M%S-%f}.prof'
+    profiler.dump_stats(path)
+    return path
+
+
+def _add_report(timings: List[StageTiming], total: float, dump_path: Optional[Path]):
+    df = pd.DataFrame({'stage': [t.name for t in timings],
+                       'ms': [t.seconds * 1000 for t in timings],
+                       'rows in': pd.array([t.rows_in for t in timings], dtype='Int64'),
+                       'rows out': pd.array([t.rows_out for t in timings], dtype='Int64'),
+                       'JSON KiB': [t.json_bytes / 1024 if t.json_bytes is not None else None for t in timings]})
+
+    history = st.session_state.setdefault('profiling_history', deque(maxlen=HISTORY_LENGTH))
+    slowest = df.loc[df['ms'].idxmax()] if len(df) else None
+    history.append({'rerun': (history[-1]['rerun'] + 1) if history else 1,
+                    'total ms': total * 1000,
+                    'stages ms': df['ms'].sum(),
+                    'slowest': slowest['stage'] if slowest is not None else None,
+                    'slowest ms': slowest['ms'] if slowest is not None else None})
+
+    with st.sidebar.expander(f'Profile: {total * 1000:.0f}ms this rerun', expanded=True):
+        st.dataframe(df, hide_index=True, column_config={'ms': st.column_config.NumberColumn(format='%.1f'),
+                                                         'JSON KiB': st.column_config.NumberColumn(format='%.1f')})
+        st.caption(f'Last {len(history)} reruns')
+        st.dataframe(pd.DataFrame(list(history)[::-1]), hide_index=True,
+                     column_config={col: st.column_config.NumberColumn(format='%.1f')
+                                    for col in ('total ms', 'stages ms', 'slowest ms')})
+        if dump_path:
+            st.caption(f'cProfile dump: `{dump_path}`')
+            st.download_button('Download cProfile dump', dump_path.read_bytes(), file_name=dump_path.name)
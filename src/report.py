@@ -0,0 +1,390 @@
+"""
+Headless reports: runs the pipeline behind crvx.main and builds its charts without Streamlit, for many logbooks at
+once, and writes them to static files:
+
+    python src/report.py [LOGBOOK ...] [--output-dir reports] [--formats html json png] [--workers 4]
+
+Logbooks are ids from the registry (see logbooks) or source specs (see sources.from_spec), every logbook of the
+registry by default. Each logbook is run in a process of a pool and written to OUTPUT_DIR/<logbook>/: report.html with
+the headline totals and every chart, the Vega-Lite spec of each chart (<chart>.vl.json), and a PNG of each chart
+(<chart>.png, which needs vl-convert). Every section of the page is rendered (see sections.SECTIONS), with the default
+value of each widget unless set by its label with --set, e.g. --set "Top-K period=Week" "Load=Climbs". Charts are
+filtered like the page's defaults, unless set with --date-filter and --workout-types.
+
+The formatted tables of logbooks read from local files are cached in CRVX_REPORT_CACHE_DIR (~/.cache/crvx/reports by
+default) and reused until the files change. Google Sheets are synced with their local snapshots instead (see sheets).
+The time of each stage of each logbook is printed and written to OUTPUT_DIR/timings.json.
+"""
+import argparse
+import dataclasses
+import datetime as dt
+import hashlib
+import html
+import importlib.util
+import json
+import os
+import re
+import sys
+import time
+import warnings
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+from typing import Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+import pandas as pd
+import streamlit.logger
+
+# Before the caches of pipeline.py are made, which warn that there's no Streamlit runtime
+streamlit.logger.set_log_level('error')
+
+import constants  # noqa: E402
+import cube  # noqa: E402
+import dateindex  # noqa: E402
+import logbooks  # noqa: E402
+import pipeline  # noqa: E402
+import preprocess as pre  # noqa: E402
+import profiling  # noqa: E402
+import sections  # noqa: E402
+import sources  # noqa: E402
+
+CACHE_DIR = Path(os.environ.get('CRVX_REPORT_CACHE_DIR', Path.home() / '.cache' / 'crvx' / 'reports'))
+FORMATS = ('html', 'json', 'png')
+
+HTML_TEMPLATE = '''<!DOCTYPE html>
+<html>
+<head>
+  <meta charset="utf-8">
+  <title>CRVX: {title}</title>
+  <script src="https://cdn.jsdelivr.net/npm/vega@{vega_version}"></script>
+  <script src="https://cdn.jsdelivr.net/npm/vega-lite@{vegalite_version}"></script>
+  <script src="https://cdn.jsdelivr.net/npm/vega-embed@{vegaembed_version}"></script>
+  <style>
+    body {{ font-family: sans-serif; margin: 2em; }}
+    table {{ border-collapse: collapse; margin-bottom: 2em; }}
+    th, td {{ padding: 0.3em 1.5em 0.3em 0; text-align: left; }}
+    td {{ font-size: 200%; }}
+    .chart {{ margin-bottom: 2em; }}
+  </style>
+</head>
+<body>
+  <h1>CRVX: {title}</h1>
+  <p><em>{subtitle}</em></p>
+  <table>
+    <tr>{summary_headers}</tr>
+    <tr>{summary_values}</tr>
+  </table>
+{chart_divs}
+  <script>
+    const specs = {specs};
+    for (const [name, spec] of Object.entries(specs)) {{
+      vegaEmbed('#' + name, spec, {{actions: false}});
+    }}
+  </script>
+</body>
+</html>
+'''
+
+
+class Options(NamedTuple):
+    output_dir: Path
+    formats: Tuple[str, ...]
+    cache_dir: Optional[Path]  # None to not cache the formatted tables
+    colourmap: str
+    date_filter: str  # One of dateindex.PRESETS
+    workout_types: Optional[Tuple[str, ...]]  # None for every workout type
+    num_draws: int  # Resolutions of split grades to draw, see splitgrades
+    values: Dict[str, str]  # Values of the widgets of the sections, by label, see ReportView
+
+
+class Tables(NamedTuple):
+    all_data: Dict[str, pd.DataFrame]  # Formatted by pre.format_columns
+    fetch_time: dt.datetime
+    generations: Dict[str, Optional[str]]
+    cached: bool  # Whether the tables were read from the cache rather than the source
+
+
+def _cache_path(cache_dir: Path, spec: str) -> Path:
+    return cache_dir / hashlib.sha1(spec.encode()).hexdigest()[:16]
+
+
+def _read_cache(path: Path, fingerprint: str) -> Optional[Tables]:
+    try:
+        meta = json.loads((path / 'meta.json').read_text())
+    except (OSError, ValueError):
+        return None
+    if meta['fingerprint'] != fingerprint:
+        return None
+    return Tables({table: pd.read_parquet(path / f'{table}.parquet') for table in sources.TABLES},
+                  dt.datetime.fromisoformat(meta['fetch_time']), meta['generations'], cached=True)
+
+
+def _write_cache(path: Path, spec: str, fingerprint: str, tables: Tables):
+    path.mkdir(parents=True, exist_ok=True)
+    # The metadata goes last, so that a partly written cache never matches a fingerprint
+    (path / 'meta.json').unlink(missing_ok=True)
+    for table, df in tables.all_data.items():
+        df.to_parquet(path / f'{table}.parquet')  # Keeping the row labels
+    (path / 'meta.json').write_text(json.dumps({'spec': spec, 'fingerprint': fingerprint,
+                                                'fetch_time': tables.fetch_time.isoformat(),
+                                                'generations': tables.generations}))
+
+
+@profiling.timed(name='report.load_tables')  # Not __main__.load_tables, when run as a script
+def load_tables(spec: str, cache_dir: Optional[Path]) -> Tables:
+    """
+    Loads and formats the logbook's tables, or reads them from the cache if its source can tell they haven't changed
+    since they were cached (see sources.DataSource.fingerprint).
+    """
+    source = sources.from_spec(spec)
+    fingerprint = source.fingerprint() if cache_dir is not None else None
+    path = _cache_path(cache_dir, spec) if fingerprint is not None else None
+    if path is not None:
+        tables = _read_cache(path, fingerprint)
+        if tables is not None:
+            return tables
+
+    all_data, _, generations, _ = source.load()
+    tables = Tables(pre.format_columns(pre.drop_nan_rows(all_data)), dt.datetime.now(dt.timezone.utc), generations,
+                    cached=False)
+    if path is not None:
+        _write_cache(path, spec, fingerprint, tables)
+    return tables
+
+
+class ReportView(sections.View):
+    """
+    Renders sections into charts keyed by name, along with the heading of the section of each chart. Widgets take
+    their default value, unless given a value by their label.
+    """
+
+    def __init__(self, values: Dict[str, str]):
+        self.values = values
+        self.charts = {}
+        self.headings = {}  # Of the section of each chart
+        self.labels = set()  # Of the widgets rendered
+        self._heading = None
+
+    def heading(self, text: str):
+        self._heading = text
+
+    def chart(self, name: str, chart, use_container_width: bool = True):
+        self.charts[name] = chart
+        self.headings[name] = self._heading
+
+    def radio(self, label: str, options: List, index: int = 0):
+        return self._choose(label, options, index)
+
+    def selectbox(self, label: str, options: List, index: int = 0):
+        return self._choose(label, options, index)
+
+    def checkbox(self, label: str, value: bool = False) -> bool:
+        return self._choose(label, [False, True], int(value))
+
+    def text_input(self, label: str, value: str) -> str:
+        self.labels.add(label)
+        return self.values.get(label, value)
+
+    def error(self, message: str):
+        raise ValueError(message)
+
+    def _choose(self, label: str, options: List, index: int):
+        self.labels.add(label)
+        if label not in self.values:
+            return options[index]
+        for option in options:
+            if str(option).lower() == self.values[label].lower():
+                return option
+        raise ValueError(f'"{self.values[label]}" is not an option of "{label}": {", ".join(map(str, options))}')
+
+
+def build_charts(tables: Tables, spec: str, options: Options):
+    """
+    Runs the pipeline on the tables with the given filters and renders every section into a ReportView, like the page
+    does. Returns (key, summary, view), with the view's charts in page order.
+    """
+    import plot
+
+    data_version = (spec, tables.fetch_time)
+    lineage = tables.generations.get('indoor'), tables.generations.get('indoor_sessions')
+    all_data, df_activity_all, _, err_msg = pipeline.prepare_data(tables.all_data)
+    if err_msg:
+        raise ValueError(err_msg)
+    df_in_all, grade_cube_all, date_index = pipeline.get_grade_cube(data_version, lineage, all_data['indoor'],
+                                                                    all_data['indoor_sessions'], df_activity_all)
+
+    start_date, end_date = date_index.preset_range(options.date_filter)
+    df_activity = pipeline.filter_activity(data_version, df_activity_all, date_index, start_date, end_date)
+    workout_types = options.workout_types or tuple(df_activity['workout_type'].unique())
+    key = pipeline.FilterKey(data_version, start_date, end_date, workout_types)
+    df_in, grade_cube = pipeline.get_climbs(key, df_in_all, grade_cube_all, date_index)
+
+    view = ReportView(options.values)
+    view.heading('Climbing Activity')
+    view.chart('calendar', plot.calendar_heat_map_chart(df_activity, label='workout_type', colourmap=options.colourmap))
+
+    inputs = sections.get_inputs(key, lineage, all_data, df_in_all, grade_cube_all, df_in, grade_cube,
+                                 colourmap=options.colourmap, time_freq=plot.time_resolution(start_date, end_date),
+                                 num_draws=options.num_draws)
+    for section in sections.SECTIONS:
+        section.render(view, **{name: inputs[name] for name in section.inputs})
+    unknown = set(options.values) - view.labels
+    if unknown:
+        raise ValueError(f'No widget labelled {", ".join(map(repr, sorted(unknown)))} in any section')
+
+    return key, pipeline.get_summary(key, grade_cube), view
+
+
+@profiling.timed(name='report.chart_specs')
+def chart_specs(charts) -> Dict[str, dict]:
+    """ Vega-Lite specs of the charts, with their data inlined."""
+    import altair as alt
+
+    with alt.data_transformers.enable('default', max_rows=None):  # Like plot.payload_size
+        return {name: chart.to_dict() for name, chart in charts.items()}
+
+
+@profiling.timed(name='report.write_json')
+def write_json(specs: Dict[str, dict], directory: Path):
+    for name, spec in specs.items():
+        (directory / f'{name}.vl.json').write_text(json.dumps(spec))
+
+
+@profiling.timed(name='report.write_png')
+def write_png(specs: Dict[str, dict], directory: Path):
+    import vl_convert
+
+    for name, spec in specs.items():
+        (directory / f'{name}.png').write_bytes(vl_convert.vegalite_to_png(spec, scale=2))
+
+
+def _summary_cells(summary: cube.Summary) -> Dict[str, str]:
+    """ Headline totals, like sections.render_summary."""
+    return {'Sessions': f'{summary.sessions:,}', 'Climbs': f'{summary.climbs:,}', 'Sends': f'{summary.sends:,}',
+            'V-points': f'{summary.v_points:,.1f}',
+            'Hardest send': f'V{summary.max_grade}' if summary.max_grade is not None else '-'}
+
+
+@profiling.timed(name='report.write_html')
+def write_html(specs: Dict[str, dict], headings: Dict[str, str], directory: Path, title: str, subtitle: str,
+               summary: cube.Summary):
+    """ The headline totals and the charts of the specs, under the headings of their sections."""
+    import altair as alt
+
+    cells = _summary_cells(summary)
+    chart_divs, heading = [], None
+    for name in specs:
+        if headings[name] != heading:
+            heading = headings[name]
+            chart_divs.append(f'  <h2>{html.escape(heading)}</h2>')
+        chart_divs.append(f'  <div class="chart" id="{name}"></div>')
+    (directory / 'report.html').write_text(HTML_TEMPLATE.format(
+        title=html.escape(title), subtitle=html.escape(subtitle),
+        vega_version=alt.VEGA_VERSION, vegalite_version=alt.VEGALITE_VERSION,
+        vegaembed_version=alt.VEGAEMBED_VERSION,
+        summary_headers=''.join(f'<th>{html.escape(name)}</th>' for name in cells),
+        summary_values=''.join(f'<td>{html.escape(value)}</td>' for value in cells.values()),
+        chart_divs='\n'.join(chart_divs),
+        specs=json.dumps(specs).replace('</', '<\\/')))  # Data can't close the script tag
+
+
+def _init_worker():
+    # Streamlit warns about running its functions (e.g. st.cache_data) outside of an app
+    warnings.filterwarnings('ignore')
+    streamlit.logger.set_log_level('error')  # Again, in case the worker was spawned rather than forked
+
+
+def run_logbook(name: str, spec: str, options: Options) -> dict:
+    """ Writes the reports of one logbook, returning its total seconds and the timings of its stages."""
+    _init_worker()
+    start = time.perf_counter()
+    with profiling.collect() as timings:
+        tables = load_tables(spec, options.cache_dir)
+        key, summary, view = build_charts(tables, spec, options)
+        specs = chart_specs(view.charts)
+
+        directory = options.output_dir / name
+        directory.mkdir(parents=True, exist_ok=True)
+        if 'json' in options.formats:
+            write_json(specs, directory)
+        if 'png' in options.formats:
+            write_png(specs, directory)
+        if 'html' in options.formats:
+            date_fmt = '%Y/%m/%d'
+            write_html(specs, view.headings, directory, name,
+                       f'{key.start_date.strftime(date_fmt)} to {key.end_date.strftime(date_fmt)}, '
+                       f'{", ".join(key.workout_types)}. Fetched @ {tables.fetch_time.isoformat(timespec="seconds")}.',
+                       summary)
+    return {'spec': spec, 'cached': tables.cached, 'seconds': time.perf_counter() - start,
+            'stages': [dataclasses.asdict(timing) for timing in timings]}
+
+
+def resolve_logbooks(names: Sequence[str], registry: Dict[str, str]) -> Dict[str, str]:
+    """ Output names and source specs of the given registry ids or source specs, or of every logbook in the registry."""
+    if not names:
+        return dict(registry)
+    resolved = {}
+    for name in names:
+        spec = registry.get(name, name)
+        if name not in registry:
+            name = Path(spec[len(sources.FILES_PREFIX):]).name if spec.startswith(sources.FILES_PREFIX) else spec
+        resolved[re.sub(r'[^\w.-]+', '_', name)] = spec
+    return resolved
+
+
+def print_results(results: Dict[str, dict], errors: Dict[str, str]):
+    for name, result in results.items():
+        print(f'{name}: {result["seconds"]:.2f} s ({"cached" if result["cached"] else "loaded"} tables)')
+        for stage in result['stages']:
+            print(f'  {stage["name"]:<48}{stage["seconds"] * 1000:>10.1f} ms')
+    for name, error in errors.items():
+        print(f'{name}: failed: {error}')
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('logbooks', nargs='*', help='Registry ids or source specs, every registry logbook if none.')
+    parser.add_argument('--output-dir', type=Path, default=Path('reports'))
+    parser.add_argument('--formats', nargs='+', choices=FORMATS, default=['html', 'json'])
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help='Processes to run logbooks in.')
+    parser.add_argument('--cache-dir', type=Path, default=CACHE_DIR)
+    parser.add_argument('--no-cache', action='store_true', help="Don't read or write cached tables.")
+    parser.add_argument('--colourmap', choices=constants.SEQUENTIAL_CMAPS, default='inferno')
+    parser.add_argument('--date-filter', choices=list(dateindex.PRESETS), default='all')
+    parser.add_argument('--workout-types', nargs='+', help='Workout types to show, every one if not given.')
+    parser.add_argument('--draws', type=int, choices=[1, 10, 100, 1000], default=1,
+                        help='Resolutions of split grades to draw for uncertainty bands, 1 for none.')
+    parser.add_argument('--set', nargs='+', default=[], metavar='LABEL=VALUE',
+                        help='Values of the widgets of the sections, by label, e.g. "Top-K period=Week".')
+    args = parser.parse_args(argv)
+    if not all('=' in value for value in args.set):
+        parser.error('--set values must be LABEL=VALUE')
+
+    _init_worker()
+    formats = tuple(args.formats)
+    if 'png' in formats and importlib.util.find_spec('vl_convert') is None:
+        print('vl-convert is not installed (pip install vl-convert-python), skipping PNGs.', file=sys.stderr)
+        formats = tuple(fmt for fmt in formats if fmt != 'png')
+    options = Options(args.output_dir, formats, None if args.no_cache else args.cache_dir, args.colourmap,
+                      args.date_filter, tuple(args.workout_types) if args.workout_types else None, args.draws,
+                      dict(value.split('=', 1) for value in args.set))
+    targets = resolve_logbooks(args.logbooks, logbooks.get_registry())
+
+    results, errors = {}, {}
+    with ProcessPoolExecutor(max_workers=max(1, min(args.workers, len(targets)))) as executor:
+        futures = {executor.submit(run_logbook, name, spec, options): name for name, spec in targets.items()}
+        for future in as_completed(futures):
+            try:
+                results[futures[future]] = future.result()
+            except Exception as e:  # One failing logbook shouldn't stop the others
+                errors[futures[future]] = f'{type(e).__name__}: {e}'
+
+    # In the order given, rather than of completion
+    results = {name: results[name] for name in targets if name in results}
+    print_results(results, errors)
+    args.output_dir.mkdir(parents=True, exist_ok=True)
+    (args.output_dir / 'timings.json').write_text(json.dumps({'results': results, 'errors': errors}, indent=2))
+    return 1 if errors else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
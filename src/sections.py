@@ -0,0 +1,237 @@
+"""
+Sections of the page below the calendar heat map, of which only the selected one is computed and shown.
+
+Each section declares the inputs it renders, by name, and get_inputs gives the provider of each input (see Inputs).
+Inputs are only computed when the selected section asks for them, by the cached stages of pipeline.py, so the other
+sections cost nothing and switching back to a section only rebuilds its charts.
+
+Sections render their widgets and charts through a View, so that report.py renders the same sections without
+Streamlit.
+"""
+from typing import Any, Callable, Dict, List, NamedTuple, Tuple
+
+import pandas as pd
+import streamlit as st
+
+import components
+import constants
+import cube
+import pipeline
+
+
+class Section(NamedTuple):
+    title: str
+    inputs: Tuple[str, ...]
+    render: Callable[..., None]  # Called with a View and the section's inputs as keyword arguments
+
+
+class Inputs:
+    """
+    Inputs of the sections, either given as values or computed by their provider from the other inputs, e.g.
+    `lambda inputs: pipeline.get_time_series(key, inputs['grade_cube'], inputs['cumulative_sends'])`. Provided inputs
+    are computed the first time they're asked for, once per rerun.
+    """
+
+    def __init__(self, providers: Dict[str, Callable[['Inputs'], Any]], **values):
+        self._providers = providers
+        self._values = values
+
+    def __getitem__(self, name: str):
+        if name not in self._values:
+            self._values[name] = self._providers[name](self)
+        return self._values[name]
+
+
+class View:
+    """
+    Where sections are rendered: the page, with its widgets. Sections only render through a view, so that static
+    reports can render the same sections with another one (see report.ReportView).
+    """
+
+    def heading(self, text: str):
+        st.markdown(f'## {text}')
+
+    def chart(self, name: str, chart, use_container_width: bool = True):
+        components.altair_chart(chart, use_container_width=use_container_width)
+
+    def radio(self, label: str, options: List, index: int = 0):
+        return st.radio(label, options, index=index)
+
+    def selectbox(self, label: str, options: List, index: int = 0):
+        return st.selectbox(label, options, index=index)
+
+    def checkbox(self, label: str, value: bool = False) -> bool:
+        return st.checkbox(label, value=value)
+
+    def text_input(self, label: str, value: str) -> str:
+        return st.text_input(label, value)
+
+    def error(self, message: str):
+        """ Shows the error and stops rendering."""
+        st.error(message)
+        st.stop()
+
+
+def get_inputs(key: pipeline.FilterKey, lineage: pipeline.Lineage, all_data: Dict[str, pd.DataFrame],
+               df_in_all: pd.DataFrame, grade_cube_all: cube.GradeCube, df_in: pd.DataFrame, grade_cube: cube.GradeCube,
+               **values) -> Inputs:
+    """
+    Inputs of every section from the unfiltered and filtered data, provided by the cached pipeline stages. values
+    are the other inputs: the colourmap, time_freq and num_draws.
+    """
+    data_version = key.data_version
+    return Inputs(
+        {
+            'session_frames': lambda inputs: pipeline.get_session_frames(key, lineage, all_data['indoor'], df_in_all,
+                                                                         grade_cube),
+            'cumulative_sends': lambda inputs: pipeline.get_cumulative_sends(data_version, lineage, all_data['indoor'],
+                                                                             grade_cube_all),
+            'time_series': lambda inputs: pipeline.get_time_series(key, grade_cube, inputs['cumulative_sends']),
+            'attempt_counts': lambda inputs: pipeline.get_attempt_counts(key, df_in),
+            'training_load': lambda inputs: pipeline.get_training_load(data_version, lineage, all_data['indoor'],
+                                                                       all_data['indoor_sessions'], grade_cube_all),
+            # Only drawn from for uncertainty bands
+            'split_grade_sends': lambda inputs: (pipeline.get_split_grade_sends(data_version, all_data['indoor'],
+                                                                                all_data['indoor_sessions'])
+                                                 if inputs['num_draws'] > 1 else None),
+        },
+        key=key, grade_cube=grade_cube, **values)
+
+
+def render(section: Section, inputs: Inputs, view: View = View()):
+    """ Renders the section, with a spinner while its inputs are computed."""
+    with st.spinner(f'Loading {section.title}...'):
+        kwargs = {name: inputs[name] for name in section.inputs}
+    section.render(view, **kwargs)
+
+
+def render_summary(summary: cube.Summary):
+    """ Headline totals of the filtered climbs, shown above the calendar heat map."""
+    columns = st.columns(5)
+    columns[0].metric('Sessions', f'{summary.sessions:,}')
+    columns[1].metric('Climbs', f'{summary.climbs:,}')
+    columns[2].metric('Sends', f'{summary.sends:,}')
+    columns[3].metric('V-points', f'{summary.v_points:,.1f}')
+    columns[4].metric('Hardest send', f'V{summary.max_grade}' if summary.max_grade is not None else '-')
+
+
+def _pyramid_ratio(view: View):
+    """ Selects the shape of the grade pyramid, returning its ratio between consecutive grades (see constants)."""
+    shape = view.selectbox('Grade pyramid shape', list(constants.PYRAMID_SHAPES))
+    ratio = constants.PYRAMID_SHAPES[shape]
+    if ratio is not None:
+        return ratio
+
+    ratios = view.text_input('Ratio of climbs between consecutive grades, from V0-V1 upwards (the last one repeats)',
+                             '2, 2, 1.5')
+    try:
+        ratio = tuple(float(r) for r in ratios.split(','))
+    except ValueError:
+        ratio = ()
+    if not ratio or min(ratio) < 1:
+        view.error('Error: Ratios must be comma separated numbers, of at least 1.')
+    return ratio
+
+
+def _render_session(view, colourmap, key, grade_cube, session_frames, num_draws, split_grade_sends):
+    import plot  # Not imported at the top, so that importing sections doesn't import altair
+
+    view.heading('Session Visualisation')
+    df_agg_sess, df_cum_top_k = session_frames
+    view.chart('v_point_mean_and_sum', plot.v_point_mean_and_sum_chart(df_agg_sess, colourmap))
+
+    top_k_period = view.radio('Top-K period', list(constants.TOP_K_PERIODS), index=1)
+    if split_grade_sends is None:
+        df_top_sends = pipeline.get_top_sends(key, grade_cube, constants.TOP_K_PERIODS[top_k_period])
+    else:
+        df_top_sends = pipeline.get_top_send_bands(key, split_grade_sends, constants.TOP_K_PERIODS[top_k_period],
+                                                   num_draws)
+    view.chart('top_k_sends', plot.top_k_sends_chart(df_top_sends, colourmap, period=top_k_period))
+
+    view.chart('cum_top_k_sends', plot.cum_top_k_sends_chart(df_cum_top_k, colourmap))
+
+
+def _render_time_series(view, colourmap, key, time_freq, time_series, num_draws, split_grade_sends):
+    import plot
+
+    view.heading('Time series visualisations')
+    show_bar_labels = view.checkbox('Show bar chart labels', value=False)
+
+    view.chart('total_climb_count', plot.cumulative_stacked_area_chart(time_series, "count_csum:Q", colourmap,
+                                                                       title='Total climb count', freq=time_freq))
+
+    view.chart('climb_count',
+               plot.stacked_bar_chart(time_series, 'count:Q', colourmap, title='Climb Count',
+                                      show_labels=show_bar_labels, freq=time_freq))
+
+    view.chart('total_v_points', plot.cumulative_stacked_area_chart(time_series, "v_points_csum:Q", colourmap,
+                                                                    title='Total V-point', freq=time_freq))
+
+    view.chart('v_points',
+               plot.stacked_bar_chart(time_series, 'v_points:Q', colourmap, title='V Points',
+                                      show_labels=show_bar_labels, freq=time_freq))
+
+    if split_grade_sends is not None:
+        view.chart('v_point_bands',
+                   plot.v_points_band_chart(pipeline.get_v_point_bands(key, split_grade_sends, time_freq, num_draws),
+                                            colourmap, num_draws, freq=time_freq))
+
+
+def _render_grade_totals(view, colourmap, key, grade_cube, num_draws, split_grade_sends):
+    import plot
+
+    view.heading('Grade Total Visualisations')
+    draw_targets = view.checkbox('Enable "grade pyramid" target bars (grey).', value=False)
+    pyramid_ratio = _pyramid_ratio(view) if draw_targets else None
+    total_v_grades, workout_type_v_grades = pipeline.get_grade_totals(key, grade_cube, pyramid_ratio)
+    if split_grade_sends is not None:
+        total_v_grades = pipeline.get_grade_total_bands(key, split_grade_sends, num_draws, pyramid_ratio)
+    view.chart('total_v_grades',
+               plot.total_v_grade_horizontal_bar_char(total_v_grades, colourmap, draw_targets=draw_targets).properties(
+                   width=550,
+                   height=350))
+
+    view.chart('workout_type_v_grades',
+               plot.workout_type_v_grade_bar_charts(workout_type_v_grades, colourmap, draw_targets=draw_targets,
+                                                    width=175, height=250),
+               use_container_width=False)
+
+
+def _render_attempts(view, colourmap, attempt_counts):
+    import plot
+
+    view.heading('Attempt Visualisations')
+    df_att = attempt_counts
+    view.chart('attempts', plot.get_attempt_bar_chart(df_att, colourmap))
+
+    df_sent = df_att[df_att['sent']].copy()
+
+    view.chart('send_attempts', plot.get_send_attempt_normalized(df_sent, colourmap))
+
+    if view.checkbox('Hide flashes', value=True):
+        df_att = df_att[(df_att['attempt_num'] > 1) | (~df_att['sent'])]
+
+    view.chart('attempts_and_sends', plot.get_attempt_and_send_bubble_chart(df_att, colourmap))
+
+
+def _render_training_load(view, colourmap, key, time_freq, training_load):
+    import plot
+
+    view.heading('Training Load')
+    title = view.selectbox('Load', list(constants.TRAINING_LOAD_METRICS))
+    df_loads = pipeline.get_training_loads(key, training_load, time_freq)
+    df_loads = df_loads[df_loads['metric'] == constants.TRAINING_LOAD_METRICS[title]]
+    view.chart('training_load', plot.training_load_chart(df_loads, colourmap, title, freq=time_freq))
+    view.chart('acwr', plot.acwr_chart(df_loads, colourmap, constants.ACWR_TARGET_RANGE))
+
+
+SECTIONS = [
+    Section('Session', ('colourmap', 'key', 'grade_cube', 'session_frames', 'num_draws', 'split_grade_sends'),
+            _render_session),
+    Section('Time Series', ('colourmap', 'key', 'time_freq', 'time_series', 'num_draws', 'split_grade_sends'),
+            _render_time_series),
+    Section('Grade Total', ('colourmap', 'key', 'grade_cube', 'num_draws', 'split_grade_sends'),
+            _render_grade_totals),
+    Section('Attempts', ('colourmap', 'attempt_counts'), _render_attempts),
+    Section('Training Load', ('colourmap', 'key', 'time_freq', 'training_load'), _render_training_load),
+]
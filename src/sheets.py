@@ -0,0 +1,159 @@
+import json
+import os
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+import pandas as pd
+from gspread.utils import a1_range_to_grid_range, rowcol_to_a1
+
+SNAPSHOT_DIR = Path(os.environ.get('CRVX_SNAPSHOT_DIR', Path.home() / '.cache' / 'crvx'))
+
+
+class SheetSpec(NamedTuple):
+    worksheet: str
+    range_name: Optional[str] = None  # Whole worksheet if None
+
+
+SHEETS = {
+    'indoor': SheetSpec('Indoor Bouldering Climbs', 'raw_climb_data'),
+    'indoor_sessions': SheetSpec('Indoor Bouldering Sessions', 'raw_session_data'),
+    'outdoor': SheetSpec('Outdoor Bouldering'),
+}
+
+
+def _strip_row(row: List) -> List:
+    """ Drops trailing empty cells, which the Sheets API omits."""
+    row = list(row)
+    while row and row[-1] in ('', None):
+        row.pop()
+    return row
+
+
+def _grid_range(a1_range: str) -> Dict:
+    """ Grid range of an A1 range as returned by the Sheets API, e.g. "'Sheet 1'!A1:F1000"."""
+    return a1_range_to_grid_range(a1_range.rsplit('!', 1)[-1])
+
+
+def _load_snapshot(path: Path):
+    meta_path = path.with_suffix('.json')
+    if not path.exists() or not meta_path.exists():
+        return None, None
+    df = pd.read_parquet(path)
+    df.columns = range(len(df.columns))
+    df = df.astype(object).where(df.notna(), None)
+    return df, json.loads(meta_path.read_text())
+
+
+def _save_snapshot(path: Path, df: pd.DataFrame, meta: Dict):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    # Write to temporary files first so a crash never leaves a half-written snapshot behind
+    tmp_path = path.with_suffix('.parquet.tmp')
+    df.rename(columns=str).to_parquet(tmp_path, index=False)
+    os.replace(tmp_path, path)
+    tmp_path = path.with_suffix('.json.tmp')
+    tmp_path.write_text(json.dumps(meta))
+    os.replace(tmp_path, path.with_suffix('.json'))
+
+
+def _full_fetch(worksheet, range_name: Optional[str]):
+    values = worksheet.get(range_name) if range_name else worksheet.get()
+    # A new generation on every full fetch, which delta fetches keep as they only append rows
+    return pd.DataFrame(values), {'range': values.range, 'num_rows': len(values), 'generation': uuid.uuid4().hex}
+
+
+def _delta_fetch(worksheet, snapshot: pd.DataFrame, meta: Dict,
+                 grid_range: Optional[Dict] = None) -> Optional[pd.DataFrame]:
+    """
+    Fetches the rows appended below the snapshot, starting from the last row already stored as an overlap check, up to
+    the current end of the range if given (e.g. of a named range that was widened since), or else its stored end.
+    Returns None if the overlapping row doesn't match, or the range moved, in which case it must be reloaded.
+    """
+    stored = _grid_range(meta['range'])
+    grid = stored if grid_range is None else grid_range
+    if any(grid.get(index, 0) != stored.get(index, 0) for index in ('startRowIndex', 'startColumnIndex')):
+        return None
+    last_row = grid.get('startRowIndex', 0) + meta['num_rows']  # 1-indexed row of the last stored row
+    end_row = grid.get('endRowIndex')  # Inclusive, as the grid index is exclusive
+    if end_row is not None and end_row < last_row:
+        return None
+
+    start = rowcol_to_a1(last_row, grid.get('startColumnIndex', 0) + 1)
+    end = rowcol_to_a1(end_row or 1, grid.get('endColumnIndex', worksheet.col_count))
+    if end_row is None:
+        end = end.rstrip('0123456789')  # Open-ended range, e.g. "A5:F"
+
+    values = worksheet.get(f'{start}:{end}')
+    if not values or _strip_row(values[0]) != _strip_row(snapshot.iloc[-1]):
+        return None
+    return pd.DataFrame(values[1:])
+
+
+def sync_sheet(worksheet, range_name: Optional[str], snapshot_path: Path, full_refresh: bool = False,
+               grid_range: Optional[Dict] = None) -> Tuple[pd.DataFrame, Optional[str]]:
+    """
+    Returns the raw values of a worksheet (or one of its named ranges), keeping a local Parquet snapshot in sync, and
+    the generation of the snapshot. The generation only changes when the values are reloaded, so values with the same
+    generation only differ by the rows appended to them.
+
+    Only the rows appended since the last sync are fetched, up to the current bounds of the range if given as a grid
+    range (see sync_workbook), or else up to its bounds when it was last reloaded. Edits to the last synced row trigger
+    a full reload, but edits further up are only picked up by a full refresh.
+    """
+    snapshot, meta = (None, None) if full_refresh else _load_snapshot(snapshot_path)
+
+    if snapshot is not None:
+        new_rows = _delta_fetch(worksheet, snapshot, meta, grid_range)
+        if new_rows is not None:
+            if new_rows.empty:
+                return snapshot, meta.get('generation')
+            df = pd.concat([snapshot, new_rows], ignore_index=True).astype(object)
+            df = df.where(df.notna(), None)
+            meta = {**meta, 'num_rows': len(df)}
+            _save_snapshot(snapshot_path, df, meta)
+            return df, meta.get('generation')
+
+    df, meta = _full_fetch(worksheet, range_name)
+    _save_snapshot(snapshot_path, df, meta)
+    return df, meta['generation']
+
+
+def _current_grid_range(worksheet, range_name: Optional[str], named_ranges: Dict[str, Dict]) -> Optional[Dict]:
+    """ Current bounds of the worksheet, or of its named range, as a grid range. None if the range doesn't exist."""
+    if range_name is None:
+        return {'startRowIndex': 0, 'endRowIndex': worksheet.row_count,
+                'startColumnIndex': 0, 'endColumnIndex': worksheet.col_count}
+    return named_ranges.get(range_name)
+
+
+def _timed_sync_sheet(*args, **kwargs) -> Tuple[pd.DataFrame, Optional[str], float]:
+    start = time.perf_counter()
+    df, generation = sync_sheet(*args, **kwargs)
+    return df, generation, time.perf_counter() - start
+
+
+def sync_workbook(workbook, snapshot_dir: Path = SNAPSHOT_DIR, full_refresh: bool = False) \
+        -> Tuple[Dict[str, pd.DataFrame], Dict[str, float], Dict[str, Optional[str]]]:
+    """
+    Syncs every sheet in SHEETS concurrently, returning the raw values (header included) keyed by dataset name, how
+    long each sheet took to sync in seconds, and the generation of each sheet (see sync_sheet).
+    """
+    snapshot_dir = Path(snapshot_dir) / workbook.title
+    # A single metadata request for all worksheets, rather than one per worksheet, and one for the current bounds of
+    # the named ranges, which may have been widened since they were synced
+    worksheets = {ws.title: ws for ws in workbook.worksheets()}
+    named_ranges = {named_range['name']: named_range['range'] for named_range in workbook.list_named_ranges()}
+
+    with ThreadPoolExecutor(max_workers=len(SHEETS)) as executor:
+        futures = {name: executor.submit(_timed_sync_sheet, worksheets[spec.worksheet], spec.range_name,
+                                         snapshot_dir / f'{name}.parquet', full_refresh=full_refresh,
+                                         grid_range=_current_grid_range(worksheets[spec.worksheet], spec.range_name,
+                                                                        named_ranges))
+                   for name, spec in SHEETS.items()}
+        results = {name: future.result() for name, future in futures.items()}
+
+    return ({name: df for name, (df, _, _) in results.items()}, {name: t for name, (_, _, t) in results.items()},
+            {name: generation for name, (_, generation, _) in results.items()})
+
@@ -0,0 +1,181 @@
+"""
+Data sources of a logbook's tables: the climbs ('indoor'), sessions ('indoor_sessions') and outdoor climbs ('outdoor').
+
+Each source returns the tables keyed by name, with the sheet headers as column names. The values are either raw sheet
+strings or already typed by pre.format_columns, which is idempotent and applied to every table downstream anyway.
+Rows are labelled by their position in the table, from 1, and keep their labels when rows before them are dropped.
+
+Sources also return the generation of each table, if they can tell when a table only had rows appended to it: loads
+of a table with the same generation only differ by the rows appended to it, otherwise the generation is None.
+
+Sources are given as specs in the logbook registry: a Google Sheets workbook name, or a directory of local files
+prefixed with "files://", e.g. "files:///data/climbing", holding indoor.parquet (or indoor.csv) and so on.
+"""
+import time
+from abc import ABC, abstractmethod
+from pathlib import Path
+from typing import Dict, Iterator, NamedTuple, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+import streamlit as st
+
+import preprocess as pre
+
+TABLES = ('indoor', 'indoor_sessions', 'outdoor')
+FILE_FORMATS = ('parquet', 'csv')  # In order of preference when a directory has both
+FILES_PREFIX = 'files://'
+CHUNK_ROWS = 2 ** 16
+
+
+class SourceData(NamedTuple):
+    all_data: Dict[str, pd.DataFrame]
+    timings: Dict[str, float]  # Seconds each table took to load
+    generations: Dict[str, Optional[str]]
+    dropped_rows: Dict[str, int]  # Incomplete rows the source dropped from each table, if it drops any itself
+
+
+class DataSource(ABC):
+    def __init__(self, name: str):
+        self.name = name
+
+    @abstractmethod
+    def load(self, full_refresh: bool = False) -> SourceData:
+        """ Loads every table in TABLES. A full refresh reloads them rather than syncing any local copy."""
+
+    def fingerprint(self) -> Optional[str]:
+        """ Changes whenever the tables may have, without loading them, or None if that can't be told cheaply."""
+        return None
+
+
+@st.cache_resource
+def get_client():
+    """ Authorizes once, sharing the client across reruns, sessions and logbooks."""
+    import gspread
+    from google.oauth2.service_account import Credentials
+
+    return gspread.authorize(
+        Credentials.from_service_account_info(
+            st.secrets["gcp_service_account"],
+            scopes=[
+                'https://www.googleapis.com/auth/spreadsheets',
+                'https://www.googleapis.com/auth/drive'
+            ],
+        ))
+
+
+@st.cache_resource
+def get_workbook(name: str):
+    return get_client().open(name)
+
+
+class GSheetsSource(DataSource):
+    """ A Google Sheets workbook, synced with its local snapshot (see sheets.sync_workbook)."""
+
+    def load(self, full_refresh: bool = False) -> SourceData:
+        import sheets
+
+        raw_data, timings, generations = sheets.sync_workbook(get_workbook(self.name), full_refresh=full_refresh)
+        return SourceData({name: pre.header_to_col(df) for name, df in raw_data.items()}, timings, generations,
+                          dropped_rows={})  # Incomplete rows are dropped by pipeline.prepare_data
+
+
+def _read_chunks(path: Path) -> Iterator[pd.DataFrame]:
+    if path.suffix == '.parquet':
+        import pyarrow.parquet as pq
+
+        for batch in pq.ParquetFile(path).iter_batches(batch_size=CHUNK_ROWS):
+            yield batch.to_pandas()
+    else:
+        # Read as strings, like the values of a sheet, rather than letting pandas guess types
+        yield from pd.read_csv(path, dtype=str, keep_default_na=False, na_values=[''], chunksize=CHUNK_ROWS)
+
+
+def _concat_chunks(chunks) -> pd.DataFrame:
+    """ Concatenates formatted chunks, merging the categories of categorical columns rather than making them objects."""
+    if len(chunks) == 1:
+        return chunks[0]
+    columns = {}
+    for col in chunks[0].columns:
+        values = [chunk[col] for chunk in chunks]
+        if isinstance(values[0].dtype, pd.CategoricalDtype):
+            columns[col] = pd.api.types.union_categoricals(values)
+        else:
+            columns[col] = pd.concat(values, ignore_index=True)
+    return pd.DataFrame(columns).set_axis(np.concatenate([chunk.index for chunk in chunks]))
+
+
+class FileSource(DataSource):
+    """
+    A directory with a CSV or Parquet file of each table. Files are read in chunks, each of which is formatted as soon
+    as it's read, so only one chunk of raw strings is held in memory at a time.
+    """
+
+    def __init__(self, name: str, directory: Path):
+        super().__init__(name)
+        self.directory = Path(directory)
+
+    def table_path(self, table: str) -> Path:
+        for fmt in FILE_FORMATS:
+            path = self.directory / f'{table}.{fmt}'
+            if path.exists():
+                return path
+        raise FileNotFoundError(f'No {" or ".join(FILE_FORMATS)} file for table {table} in {self.directory}')
+
+    def load_table(self, table: str) -> Tuple[pd.DataFrame, int]:
+        """ The formatted table and the number of incomplete rows dropped from it."""
+        chunks = []
+        num_rows = num_dropped = 0
+        for chunk in _read_chunks(self.table_path(table)):
+            chunk.index = pd.RangeIndex(num_rows + 1, num_rows + 1 + len(chunk))
+            num_rows += len(chunk)
+            # Rows with missing values are dropped before formatting, as missing sends would otherwise become False
+            chunk_na = pre.drop_nan_rows({table: chunk})[table]
+            num_dropped += len(chunk) - len(chunk_na)
+            chunks.append(pre.format_columns({table: chunk_na})[table])
+        if not chunks:  # Header only
+            path = self.table_path(table)
+            empty = pd.read_parquet(path) if path.suffix == '.parquet' else pd.read_csv(path, dtype=str)
+            chunks.append(pre.format_columns({table: empty})[table])
+        return _concat_chunks(chunks), num_dropped
+
+    def table_fingerprint(self, table: str) -> str:
+        path = self.table_path(table)
+        stat = path.stat()
+        return f'{path.name}:{stat.st_size}:{stat.st_mtime_ns}'
+
+    def load(self, full_refresh: bool = False) -> SourceData:
+        all_data = {}
+        timings = {}
+        generations = {}
+        dropped_rows = {}
+        for table in TABLES:
+            start = time.perf_counter()
+            # Files are read whole, so there's no telling whether they were only appended to, but unchanged files are
+            # the same generation, as they don't even have rows appended
+            generations[table] = self.table_fingerprint(table)
+            all_data[table], dropped_rows[table] = self.load_table(table)
+            timings[table] = time.perf_counter() - start
+        return SourceData(all_data, timings, generations, dropped_rows)
+
+    def fingerprint(self) -> Optional[str]:
+        return ';'.join(map(self.table_fingerprint, TABLES))
+
+
+def write_files(all_data: Dict[str, pd.DataFrame], directory: Path, fmt: str = 'parquet'):
+    """ Writes raw tables (e.g. as fetched from a sheet, with header_to_col) to a directory readable by FileSource."""
+    directory = Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+    for table, df in all_data.items():
+        df = df.rename(columns=str).reset_index(drop=True)
+        if fmt == 'parquet':
+            df.to_parquet(directory / f'{table}.parquet', index=False, row_group_size=CHUNK_ROWS)
+        else:
+            df.to_csv(directory / f'{table}.csv', index=False)
+
+
+def from_spec(spec: str) -> DataSource:
+    """ The data source of a logbook spec from the registry (see module docstring)."""
+    if spec.startswith(FILES_PREFIX):
+        return FileSource(spec, Path(spec[len(FILES_PREFIX):]).expanduser())
+    return GSheetsSource(spec)
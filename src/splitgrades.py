@@ -0,0 +1,130 @@
+"""
+Uncertainty of the metrics of sent climbs that depend on how split grades (e.g. "3-5") are resolved.
+
+pre.distribute_climbs resolves every climb of a split grade with a single seeded draw. Here, many resolutions are
+drawn at once, the metrics are computed for every draw in batched array operations, and shown as their median and
+percentile bands.
+
+Climbs of a split grade are resolved uniformly and independently, so the number of the climbs of a range in a period
+resolving to each grade of the range is multinomial. Draws are made of those counts rather than of every climb, which
+gives the same distribution of every per-period metric, in arrays of (draws, periods, grades) that don't grow with the
+number of climbs.
+"""
+import datetime as dt
+from dataclasses import dataclass
+from typing import Sequence
+
+import numpy as np
+import pandas as pd
+
+import preprocess as pre
+from constants import MAX_VGRADE, V_GRADE_MULT_ARRAY
+
+BAND_PERCENTILES = (5, 95)
+
+
+@dataclass
+class Sends:
+    """ Sent climbs with their grades unresolved, sorted by date."""
+    dates: np.ndarray  # datetime64
+    workout_types: np.ndarray
+    bounds: np.ndarray  # Lower and upper grade of each climb, VB being -1
+    counts: np.ndarray  # Count multiplier of each climb
+
+
+@dataclass
+class GradeDraws:
+    periods: pd.PeriodIndex  # Periods with at least one send
+    counts: np.ndarray  # Sends of each draw, indexed by (draw, period, v_grade)
+
+
+def build(df_in: pd.DataFrame) -> Sends:
+    """ Collects the sends of the formatted climbs, with workout types merged in like for pre.distribute_climbs."""
+    df_sent = df_in[df_in['sent']]
+    order = np.argsort(df_sent['date'].to_numpy(), kind='stable')
+    return Sends(dates=df_sent['date'].to_numpy()[order],
+                 workout_types=df_sent['workout_type'].astype(str).to_numpy()[order],
+                 bounds=pre.grade_bounds(df_sent['v_grade'])[order],
+                 counts=df_sent['count_multiplier'].to_numpy(dtype=int)[order])
+
+
+def draw(sends: Sends, start_date: dt.date, end_date: dt.date, workout_types: Sequence[str], freq: str,
+         num_draws: int, random_seed: int = 42) -> GradeDraws:
+    """ Draws the grade histogram of every period of the given frequency in [start_date, end_date], num_draws times."""
+    rows = slice(sends.dates.searchsorted(np.datetime64(start_date, 'D'), side='left'),
+                 sends.dates.searchsorted(np.datetime64(end_date, 'D') + 1, side='left'))
+    mask = np.isin(sends.workout_types[rows], list(workout_types))
+    bounds, counts = sends.bounds[rows][mask], sends.counts[rows][mask]
+    period_idx, periods = pd.factorize(pd.DatetimeIndex(sends.dates[rows][mask]).to_period(freq), sort=True)
+
+    # Grades are offset by one so that VB is 0, and dropped at the end like in pre.distribute_climbs
+    num_grades = max(MAX_VGRADE, bounds[:, 1].max(initial=0) + 1) + 1
+    hist = np.zeros((num_draws, len(periods), num_grades), dtype=np.int32)
+
+    fixed = bounds[:, 0] == bounds[:, 1]
+    hist += np.bincount(period_idx[fixed] * num_grades + bounds[fixed, 0] + 1, weights=counts[fixed],
+                        minlength=len(periods) * num_grades).astype(np.int32).reshape(len(periods), num_grades)
+
+    # Sends of each range in each period, each range being drawn from in one batch. Ranges are few, maybe none.
+    ranges, range_idx = np.unique(bounds[~fixed], axis=0, return_inverse=True)
+    range_idx = range_idx.ravel()  # Some numpy versions shape it like the bounds
+    range_counts = np.zeros((len(ranges), len(periods)), dtype=int)
+    np.add.at(range_counts, (range_idx, period_idx[~fixed]), counts[~fixed])
+    rng = np.random.default_rng(random_seed)
+    for (lower, upper), num_sends in zip(ranges, range_counts):
+        width = upper - lower + 1
+        hist[:, :, lower + 1:upper + 2] += rng.multinomial(num_sends, np.full(width, 1 / width),
+                                                           size=(num_draws, len(periods)))
+    return GradeDraws(periods=periods, counts=hist[:, :, 1:])
+
+
+def _bands(values: np.ndarray) -> np.ndarray:
+    """ Median and BAND_PERCENTILES of values over their first axis, ignoring NaNs, stacked on the last axis."""
+    if not values.size:  # e.g. no periods, which nanpercentile doesn't keep the shape of
+        return np.zeros((*values.shape[1:], 1 + len(BAND_PERCENTILES)))
+    return np.moveaxis(np.nanpercentile(values, [50, *BAND_PERCENTILES], axis=0), 0, -1)
+
+
+def v_points(draws: GradeDraws) -> pd.DataFrame:
+    """ V-points of each period, labelled by its first day, like plot.coarsen_dates."""
+    bands = _bands(draws.counts @ V_GRADE_MULT_ARRAY[np.arange(draws.counts.shape[2])])
+    return pd.DataFrame({'date': draws.periods.start_time, 'v_points': bands[:, 0],
+                         'v_points_low': bands[:, 1], 'v_points_high': bands[:, 2]})
+
+
+def grade_totals(draws: GradeDraws, pyramid_ratio=None) -> pd.DataFrame:
+    """
+    Total sends of each grade sent in any draw, like cube.grade_totals. Given a pyramid ratio, also the targets of the
+    pyramid of the median totals, for every grade from the lowest to the highest one sent.
+    """
+    totals = draws.counts.sum(axis=1)
+    bands = _bands(totals)
+    grades = np.flatnonzero(totals.max(axis=0))
+    if pyramid_ratio is not None and len(grades):
+        grades = np.arange(grades[0], grades[-1] + 1)  # Every grade from the lowest to the highest one sent
+    df = pd.DataFrame({'v_grade': grades, 'total_count': bands[grades, 0],
+                       'total_count_low': bands[grades, 1], 'total_count_high': bands[grades, 2]})
+    if pyramid_ratio is not None:
+        df['target_count'] = pre.get_pyramid_targets(bands[:, 0], pyramid_ratio)[grades]
+    return df
+
+
+def period_top_k(draws: GradeDraws, top_ks: Sequence[int], chunk_rows: int = 2 ** 14) -> pd.DataFrame:
+    """ Mean of the top-k sends of each period and k, like cube.period_top_k."""
+    ks = np.array(top_ks)
+    counts = draws.counts.reshape(-1, draws.counts.shape[2])
+    # In chunks of (draw, period) rows, as top_k_sums takes (ks, rows, grades) of memory
+    sums = np.concatenate([pre.top_k_sums(counts[start:start + chunk_rows], ks)
+                           for start in range(0, len(counts), chunk_rows)]) if len(counts) else np.zeros((0, len(ks)))
+    num_sends = counts.sum(axis=1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mean_top_k = (sums / np.minimum(ks, num_sends[:, None])).reshape(*draws.counts.shape[:2], len(ks))
+
+    # Periods whose only sends are split grades including VB may have no sends in some draws, which are left out
+    sent = draws.counts.sum(axis=2).max(axis=0) > 0
+    bands = _bands(mean_top_k[:, sent])
+    return pd.DataFrame({'date': np.repeat(draws.periods[sent].end_time.normalize(), len(ks)),
+                         'k': np.tile(ks, sent.sum()),
+                         'mean_top_k': bands[..., 0].ravel(),
+                         'mean_top_k_low': bands[..., 1].ravel(),
+                         'mean_top_k_high': bands[..., 2].ravel()})
@@ -0,0 +1,119 @@
+"""
+Training load: the V-points, climbs and minutes of each day, and their sums over acute (7 day) and chronic (28 day)
+rolling windows, whose ratio is the acute:chronic workload ratio (ACWR).
+
+Loads are kept as running totals over every day from the first session to the last, rest days included, so the sum
+over any window is the difference of two totals, and appending sessions only extends the totals from their first date.
+"""
+import datetime as dt
+from dataclasses import dataclass
+from typing import Sequence
+
+import numpy as np
+import pandas as pd
+
+import cube
+from constants import V_GRADE_MULT_ARRAY
+
+METRICS = ('v_points', 'climbs', 'climbing_time', 'total_time')
+ACUTE_DAYS = 7
+CHRONIC_DAYS = 28
+
+
+@dataclass
+class TrainingLoad:
+    dates: pd.DatetimeIndex  # Every day from the first session to the last
+    workout_types: pd.Index
+    totals: np.ndarray  # Loads up to and including each date, indexed by (date, metric, workout_type)
+
+    def select(self, start_date: dt.date, end_date: dt.date, workout_types: Sequence[str],
+               freq: str = 'D') -> pd.DataFrame:
+        """
+        Load of each metric over each period of the given frequency in [start_date, end_date], e.g. 'D', 'W' or 'M',
+        labelled by its last day. Along with the mean daily load over the acute and chronic windows ending on that
+        day, which reach back before start_date, and their ratio. The ratio is NaN without any chronic load.
+        """
+        start = self.dates.searchsorted(pd.Timestamp(start_date), side='left')
+        end = self.dates.searchsorted(pd.Timestamp(end_date), side='right')
+        # Zero loads before the first day, so that every window has a start
+        totals = np.concatenate([np.zeros((CHRONIC_DAYS, len(METRICS))),
+                                 self.totals[:, :, self.workout_types.isin(workout_types)].sum(axis=2)])
+        days = np.arange(start, end) + CHRONIC_DAYS
+        if freq != 'D':
+            periods = self.dates[start:end].to_period(freq)
+            days = days[np.r_[periods[1:] != periods[:-1], True]]
+        period_starts = np.r_[start + CHRONIC_DAYS, days[:-1] + 1]
+
+        acute = (totals[days] - totals[days - ACUTE_DAYS]) / ACUTE_DAYS
+        chronic = (totals[days] - totals[days - CHRONIC_DAYS]) / CHRONIC_DAYS
+        with np.errstate(divide='ignore', invalid='ignore'):
+            acwr = np.where(chronic > 0, acute / chronic, np.nan)
+        return pd.DataFrame({'date': np.repeat(self.dates[days - CHRONIC_DAYS], len(METRICS)),
+                             'metric': np.tile(METRICS, len(days)),
+                             'load': (totals[days] - totals[period_starts - 1]).ravel(),
+                             'acute': acute.ravel(),
+                             'chronic': chronic.ravel(),
+                             'acwr': acwr.ravel()})
+
+
+def _dates(df_sessions: pd.DataFrame, grade_cube: cube.GradeCube) -> pd.DatetimeIndex:
+    return pd.date_range(min(df_sessions['date'].min(), grade_cube.dates.min()),
+                         max(df_sessions['date'].max(), grade_cube.dates.max()), freq='D')
+
+
+def _workout_types(df_sessions: pd.DataFrame, grade_cube: cube.GradeCube) -> pd.Index:
+    return grade_cube.workout_types.union(pd.Index(df_sessions['workout_type'].astype(str).unique())).sort_values()
+
+
+def _daily_loads(dates: pd.DatetimeIndex, workout_types: pd.Index, df_sessions: pd.DataFrame,
+                 grade_cube: cube.GradeCube) -> np.ndarray:
+    """ Loads of each of the dates, indexed by (date, metric, workout_type), from the sessions and cube on them."""
+    loads = np.zeros((len(dates), len(METRICS), len(workout_types)))
+
+    climb_days = (grade_cube.dates - dates[0]).days.to_numpy()
+    climb_types = workout_types.get_indexer(grade_cube.workout_types)
+    sends = grade_cube.counts[..., 1]
+    v_points = np.einsum('dgt,g->dt', sends, V_GRADE_MULT_ARRAY[np.arange(sends.shape[1])])
+    loads[climb_days[:, None], METRICS.index('v_points'), climb_types] = v_points
+    loads[climb_days[:, None], METRICS.index('climbs'), climb_types] = grade_cube.counts.sum(axis=(1, 3))
+
+    session_days = (pd.DatetimeIndex(df_sessions['date']) - dates[0]).days.to_numpy()
+    session_types = workout_types.get_indexer(df_sessions['workout_type'].astype(str))
+    for metric in ('climbing_time', 'total_time'):
+        np.add.at(loads, (session_days, METRICS.index(metric), session_types),
+                  df_sessions[metric].to_numpy(dtype=float, na_value=0))
+    return loads
+
+
+def build(df_sessions: pd.DataFrame, grade_cube: cube.GradeCube) -> TrainingLoad:
+    """ Builds the loads of the sessions, with the times of their formatted columns, and of the climbs in the cube."""
+    dates = _dates(df_sessions, grade_cube)
+    workout_types = _workout_types(df_sessions, grade_cube)
+    return TrainingLoad(dates=dates, workout_types=workout_types,
+                        totals=np.cumsum(_daily_loads(dates, workout_types, df_sessions, grade_cube), axis=0))
+
+
+def extend(load: TrainingLoad, df_sessions: pd.DataFrame, grade_cube: cube.GradeCube,
+           from_date: dt.date) -> TrainingLoad:
+    """
+    Updates the loads to sessions and a cube that only differ from the ones they were built from on or after
+    from_date, e.g. after sessions were appended to the logbook, like cube.extend_cumulative_sends. Only the loads from
+    from_date onwards are computed, unless the dates before it or the workout types changed.
+    """
+    dates = _dates(df_sessions, grade_cube)
+    workout_types = _workout_types(df_sessions, grade_cube)
+    start = dates.searchsorted(pd.Timestamp(from_date), side='left')
+    if not load.workout_types.equals(workout_types) or not load.dates[:start].equals(dates[:start]):
+        return build(df_sessions, grade_cube)
+
+    if start == len(dates):  # Nothing on or after from_date
+        return TrainingLoad(dates=dates, workout_types=workout_types, totals=load.totals[:start])
+
+    climb_start = grade_cube.dates.searchsorted(pd.Timestamp(from_date), side='left')
+    new_cube = cube.GradeCube(dates=grade_cube.dates[climb_start:], workout_types=grade_cube.workout_types,
+                              counts=grade_cube.counts[climb_start:])
+    new_sessions = df_sessions[df_sessions['date'] >= pd.Timestamp(from_date)]
+    before_start = load.totals[start - 1] if start else 0
+    new_loads = _daily_loads(dates[start:], workout_types, new_sessions, new_cube)
+    totals = np.concatenate([load.totals[:start], before_start + np.cumsum(new_loads, axis=0)])
+    return TrainingLoad(dates=dates, workout_types=workout_types, totals=totals)
@@ -0,0 +1,64 @@
+"""
+Local fakes of the gspread interface used by sheets.sync_workbook, so that syncs can be run offline, e.g. by the tests
+and benchmarks/startup.py.
+"""
+from typing import Dict, List, Optional
+
+from gspread.utils import a1_range_to_grid_range, rowcol_to_a1
+
+
+class FakeValueRange(list):
+    def __init__(self, values, range):
+        super().__init__(values)
+        self.range = range
+
+
+def _api_row(row: List) -> List[str]:
+    """ A row as the Sheets API returns it: formatted values, without the trailing empty cells."""
+    cells = ['' if cell is None else str(cell) for cell in row]
+    num_cells = max((i + 1 for i, cell in enumerate(cells) if cell != ''), default=0)
+    return cells[:num_cells]
+
+
+class FakeWorksheet:
+    def __init__(self, title: str, values: List[List[str]], named_ranges: Optional[Dict[str, str]] = None,
+                 row_count: int = 1000, col_count: int = 26):
+        self.title = title
+        self.values = [list(row) for row in values]
+        self.named_ranges = named_ranges or {}
+        self.row_count = row_count
+        self.col_count = col_count
+        self.num_requests = 0
+
+    def append_rows(self, rows: List[List[str]]):
+        self.values.extend(list(row) for row in rows)
+
+    def get(self, range_name: Optional[str] = None) -> FakeValueRange:
+        """ Values of an A1 or named range, the way the Sheets API returns them, with the range clipped to the grid."""
+        self.num_requests += 1
+        whole_sheet = f'A1:{rowcol_to_a1(self.row_count, self.col_count)}'
+        grid = a1_range_to_grid_range(self.named_ranges.get(range_name, range_name) if range_name else whole_sheet)
+        start_row, start_col = grid.get('startRowIndex', 0), grid.get('startColumnIndex', 0)
+        end_row = min(grid.get('endRowIndex', self.row_count), self.row_count)
+        end_col = min(grid.get('endColumnIndex', self.col_count), self.col_count)
+
+        values = [_api_row(row[start_col:end_col]) for row in self.values[start_row:end_row]]
+        num_rows = max((i + 1 for i, row in enumerate(values) if row), default=0)
+        a1_range = f'{rowcol_to_a1(start_row + 1, start_col + 1)}:{rowcol_to_a1(end_row, end_col)}'
+        return FakeValueRange(values[:num_rows], f"'{self.title}'!{a1_range}")
+
+
+class FakeWorkbook:
+    def __init__(self, title: str, worksheets: List[FakeWorksheet]):
+        self.title = title
+        self._worksheets = {ws.title: ws for ws in worksheets}
+
+    def worksheet(self, title: str) -> FakeWorksheet:
+        return self._worksheets[title]
+
+    def worksheets(self) -> List[FakeWorksheet]:
+        return list(self._worksheets.values())
+
+    def list_named_ranges(self) -> List[Dict]:
+        return [{'name': name, 'range': a1_range_to_grid_range(a1_range)}
+                for worksheet in self._worksheets.values() for name, a1_range in worksheet.named_ranges.items()]
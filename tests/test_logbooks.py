@@ -0,0 +1,60 @@
+import datetime as dt
+import time
+
+import pandas as pd
+
+import logbooks
+
+
+def _fetch(generation, num_climbs=3, num_bytes=0):
+    def fetch():
+        all_data = {'indoor': pd.DataFrame({'date': pd.date_range('2021-01-01', periods=num_climbs)}),
+                    'indoor_sessions': pd.DataFrame({'date': pd.date_range('2021-01-01', periods=num_climbs)})}
+        return logbooks.LogbookData('logbook', all_data, None, None, dt.datetime.now(dt.timezone.utc), {}, num_bytes,
+                                    {'indoor': generation, 'indoor_sessions': generation},
+                                    {'indoor': 0, 'indoor_sessions': 0})
+    return fetch
+
+
+def _refresh(cache, fetch):
+    """ Refreshes the logbook in the background and waits for it."""
+    cache.get('logbook', fetch, force=True)
+    while cache.freshness('logbook').refreshing:
+        time.sleep(0.01)
+    return cache.get('logbook', fetch)
+
+
+def test_refresh_from_the_same_tables_keeps_the_cached_data():
+    cache = logbooks.LogbookCache()
+    data = cache.get('logbook', _fetch('a'))
+
+    assert _refresh(cache, _fetch('a')) is data
+    assert cache.freshness('logbook').fetch_time > data.fetch_time
+
+
+def test_refresh_with_new_rows_or_generation_swaps_in_the_new_data():
+    cache = logbooks.LogbookCache()
+    data = cache.get('logbook', _fetch('a'))
+
+    appended = _refresh(cache, _fetch('a', num_climbs=4))
+    assert appended.version != data.version
+
+    reloaded = _refresh(cache, _fetch('b', num_climbs=4))
+    assert reloaded.version != appended.version
+
+    # Without generations, there's no telling whether the tables changed
+    assert _refresh(cache, _fetch(None, num_climbs=4)) is not _refresh(cache, _fetch(None, num_climbs=4))
+
+
+def test_evicted_logbooks_are_passed_on():
+    evicted = []
+    cache = logbooks.LogbookCache(max_bytes=100, on_evict=evicted.append)
+    cache.get('a', _fetch('a', num_bytes=40))
+    cache.get('b', _fetch('b', num_bytes=40))
+    cache.get('a', _fetch('a', num_bytes=40))  # Now the most recently used
+    assert evicted == []
+
+    cache.get('c', _fetch('c', num_bytes=40))
+
+    assert evicted == ['b']
+    assert cache.num_bytes == 80
@@ -0,0 +1,112 @@
+import datetime as dt
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import cube
+import dateindex
+import pipeline
+import preprocess as pre
+from constants import TOP_KS
+
+GRADES = ['VB', 'V0', 'V1', 'V2', 'V3', 'V4', 'V5', 'V6', 'V2-3', 'V3-5', 'V4-6']
+
+
+def _tables(num_days, num_climbs, seed=0):
+    """ Formatted climbs and sessions, with rows labelled from 1 like the sources do."""
+    rng = np.random.default_rng(seed)
+    days = pd.date_range('2021-01-01', periods=num_days, freq='2D')
+    dates = np.sort(rng.choice(days, num_climbs))
+    dates[:num_days] = days  # Every session has a climb
+    dates.sort()
+    climbs = pd.DataFrame({'Date': pd.DatetimeIndex(dates).strftime('%d/%m/%Y'),
+                           'V Grade': rng.choice(GRADES, num_climbs),
+                           'Count Multiplier': rng.choice(['1', '1', '2', '3'], num_climbs),
+                           'Attempts (w/ send)': rng.integers(1, 5, num_climbs).astype(str),
+                           'Sent': rng.choice(['TRUE', 'FALSE'], num_climbs)},
+                          index=pd.RangeIndex(1, num_climbs + 1))
+    # A workout type that only shows up in the later sessions
+    workout_types = np.where(np.arange(num_days) < num_days * 3 // 4, rng.choice(['board', 'volume'], num_days),
+                             rng.choice(['board', 'power'], num_days))
+    sessions = pd.DataFrame({'Date': days.strftime('%d/%m/%Y'), 'workout type': workout_types,
+                             'climbing time': rng.integers(30, 120, num_days).astype(str),
+                             'total time': rng.integers(60, 180, num_days).astype(str)},
+                            index=pd.RangeIndex(1, num_days + 1))
+    all_data = pre.format_columns({'indoor': climbs, 'indoor_sessions': sessions})
+    return all_data['indoor'], all_data['indoor_sessions']
+
+
+def _activity(df_sessions):
+    df_activity = pre.get_climbing_activity_df(df_sessions, pd.DataFrame({'date': pd.DatetimeIndex(['2021-01-02'])}))
+    return dateindex.sort_by_date(df_activity, df_activity['date'])
+
+
+@pytest.mark.parametrize('num_old_climbs', [300, 301, 400])  # Appending to the last session, or starting new ones
+def test_appended_climbs_extend_to_the_same_stages_as_a_rebuild(num_old_climbs, monkeypatch):
+    df_climbs, df_sessions = _tables(num_days=60, num_climbs=500)
+    last_date = df_climbs['date'].iloc[num_old_climbs - 1]
+    df_old_climbs, df_old_sessions = df_climbs.iloc[:num_old_climbs], df_sessions[df_sessions['date'] <= last_date]
+    lineage = ('climbs', 'sessions')
+    fetch_time = dt.datetime(2021, 6, 1, tzinfo=dt.timezone.utc)
+
+    def stages(logbook, fetch_time, df_climbs, df_sessions):
+        data_version = (logbook, fetch_time)
+        df_in, grade_cube, date_index = pipeline.get_grade_cube(data_version, lineage, df_climbs, df_sessions,
+                                                                _activity(df_sessions))
+        key = pipeline.FilterKey(data_version, dt.date(2021, 1, 5), date_index.max_date, ('board', 'power'))
+        _, df_cum_top_k = pipeline.get_session_frames(key, lineage, df_climbs, df_in,
+                                                      pipeline.get_climbs(key, df_in, grade_cube, date_index)[1])
+        return (df_in, grade_cube, pipeline.get_cumulative_sends(data_version, lineage, df_climbs, grade_cube),
+                pipeline.get_training_load(data_version, lineage, df_climbs, df_sessions, grade_cube), df_cum_top_k)
+
+    stages(f'extended-{num_old_climbs}', fetch_time, df_old_climbs, df_old_sessions)
+    built_rows = []
+    build = cube.build
+    monkeypatch.setattr(cube, 'build', lambda df_in: built_rows.append(len(df_in)) or build(df_in))
+    df_in, grade_cube, cumulative_sends, training_load, df_cum_top_k = stages(f'extended-{num_old_climbs}',
+                                                                fetch_time + dt.timedelta(minutes=1), df_climbs,
+                                                                df_sessions)
+    df_in_built, grade_cube_built, cumulative_sends_built, training_load_built, df_cum_top_k_built = stages(
+        f'built-{num_old_climbs}', fetch_time, df_climbs, df_sessions)
+    # Only the appended climbs were built into a cube when extending, labelled after the old distributed climbs
+    assert built_rows == [(df_in.index >= df_old_climbs['count_multiplier'].sum()).sum(), len(df_in)]
+
+    pd.testing.assert_frame_equal(df_in, df_in_built)
+    assert grade_cube.dates.equals(grade_cube_built.dates)
+    assert grade_cube.workout_types.equals(grade_cube_built.workout_types)
+    np.testing.assert_array_equal(grade_cube.counts, grade_cube_built.counts)
+    np.testing.assert_array_equal(cumulative_sends.totals, cumulative_sends_built.totals)
+    np.testing.assert_allclose(training_load.totals, training_load_built.totals)
+    pd.testing.assert_frame_equal(df_cum_top_k, df_cum_top_k_built)
+
+    # Same as the cumulative top-k of the filtered sends
+    df_sent = df_in[df_in['sent'] & (df_in['date'] >= '2021-01-05') & df_in['workout_type'].isin(['board', 'power'])]
+    df_cum_top_k_sent, _ = pre.cumulative_top_k(df_sent, TOP_KS)
+    pd.testing.assert_frame_equal(df_cum_top_k, pre.cumulative_top_k_until(df_cum_top_k_sent, df_sent['date'].max()))
+
+
+def test_adding_climbs_to_a_cube_is_building_it_from_all_of_them():
+    df_climbs, df_sessions = _tables(num_days=30, num_climbs=200)
+    df_in = pre.distribute_climbs(pd.merge(df_climbs, df_sessions[['date', 'workout_type']], on='date'), 42)
+    df_in['workout_type'] = df_in['workout_type'].astype(str)
+
+    built = cube.build(df_in)
+    added = cube.add(cube.build(df_in.iloc[::2]), df_in.iloc[1::2])
+
+    assert added.dates.equals(built.dates)
+    assert added.workout_types.equals(built.workout_types)
+    np.testing.assert_array_equal(added.counts, built.counts)
+
+
+def test_forgetting_a_logbook_drops_its_append_states():
+    df_climbs, df_sessions = _tables(num_days=10, num_climbs=50)
+    fetch_time = dt.datetime(2021, 6, 1, tzinfo=dt.timezone.utc)
+    for logbook in ('forgotten', 'kept'):
+        pipeline.get_grade_cube((logbook, fetch_time), ('climbs', 'sessions'), df_climbs, df_sessions,
+                                _activity(df_sessions))
+
+    pipeline.forget('forgotten')
+
+    logbooks = {logbook for _, logbook in pipeline._append_states()}
+    assert 'forgotten' not in logbooks and 'kept' in logbooks
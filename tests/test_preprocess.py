@@ -0,0 +1,92 @@
+import numpy as np
+import pandas as pd
+
+import pytest
+
+import preprocess as pre
+from constants import PYRAMID_SHAPES
+
+
+def test_session_times_that_arent_minutes_are_missing():
+    sessions = pd.DataFrame({'Date': ['01/01/2021', '02/01/2021', '03/01/2021'],
+                             'workout type': ['board', 'volume', 'board'],
+                             'climbing time': ['60', '1:30', '45.5'],
+                             'total time': ['90', 'n/a', '60']})
+
+    df = pre.format_columns({'indoor_sessions': sessions})['indoor_sessions']
+
+    np.testing.assert_array_equal(df['climbing_time'], [60, np.nan, 45.5])
+    np.testing.assert_array_equal(df['total_time'], [90, np.nan, 60])
+    pd.testing.assert_frame_equal(pre.format_columns({'indoor_sessions': df})['indoor_sessions'], df)
+
+
+def _sends(num_sends, seed=0):
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({'date': np.sort(rng.choice(pd.date_range('2021-01-01', periods=50), num_sends)),
+                         'v_grade': rng.integers(0, 10, num_sends)})
+
+
+def test_cumulative_top_k_resumes_from_its_state():
+    df_sent = _sends(500)
+    split = df_sent['date'].searchsorted(df_sent['date'].iloc[250])  # On a date boundary
+
+    df_cum_top_k, state = pre.cumulative_top_k(df_sent, [1, 5, 20], chunk_size=64)
+    df_start, start_state = pre.cumulative_top_k(df_sent.iloc[:split], [1, 5, 20], chunk_size=64)
+    df_end, end_state = pre.cumulative_top_k(df_sent.iloc[split:], [1, 5, 20], state=start_state, chunk_size=64)
+
+    pd.testing.assert_frame_equal(pd.concat([df_start, df_end], ignore_index=True), df_cum_top_k)
+    np.testing.assert_array_equal(end_state.grade_counts, state.grade_counts)
+    np.testing.assert_array_equal(end_state.last_sums, state.last_sums)
+
+
+def test_cumulative_top_k_until_reaches_the_last_date():
+    df_sent = _sends(200)
+    df_cum_top_k, _ = pre.cumulative_top_k(df_sent, [1, 5])
+    last_date = df_sent['date'].iloc[150]
+
+    df = pre.cumulative_top_k_until(df_cum_top_k, last_date)
+
+    assert df['date'].max() == last_date
+    last = df.drop_duplicates('k', keep='last').set_index('k')['cum_mean_top_k']
+    expected, _ = pre.cumulative_top_k(df_sent[df_sent['date'] <= last_date], [1, 5])
+    pd.testing.assert_series_equal(last, expected.drop_duplicates('k', keep='last').set_index('k')['cum_mean_top_k'])
+    assert (last.index == [1, 5]).all() and (df.drop_duplicates('k', keep='last')['date'] == last_date).all()
+
+
+def test_count_attempts_is_the_expanded_attempts_grouped():
+    dates = pd.to_datetime(['2021-01-01'] * 4 + ['2021-01-02'] * 4)
+    df = pd.DataFrame({'date': dates,
+                       'v_grade': [3, 3, 3, 5, 3, 5, 5, 1],
+                       'attempts': [0, 1, 4, 1, 4, 0, 2, 3],  # Zero attempts, flashes, and repeats of a climb
+                       'sent': [True, True, True, False, False, True, True, True]})
+
+    df_expanded = pre.expand_attempts(df)
+    expected = df_expanded.groupby(['v_grade', 'attempt_num', 'sent']).agg(count=('date', 'count')).reset_index()
+
+    assert len(df_expanded) == df['attempts'].sum()
+    pd.testing.assert_frame_equal(pre.count_attempts(df), expected, check_dtype=False)
+
+
+def _looped_pyramid_targets(grade_counts, ratio):
+    """ The grade by grade loop the pyramid targets used to be computed with, with the ratio of each pair of grades."""
+    ratios = np.atleast_1d(ratio)
+    targets = pd.Series(grade_counts, dtype=float)
+    for i, count in targets[::-1].items():
+        if i == len(targets) - 1:
+            continue
+        targets[i] = max(targets[i + 1] * ratios[min(i, len(ratios) - 1)], count)
+    return np.ceil(targets.round(6)).astype(int).to_numpy()
+
+
+@pytest.mark.parametrize('shape', [shape for shape, ratio in PYRAMID_SHAPES.items() if ratio is not None])
+def test_pyramid_targets_are_the_looped_targets(shape):
+    # Gaps between the grades sent, and none sent above V7
+    grade_counts = np.array([[12, 0, 7, 0, 0, 2, 0, 1, 0, 0],
+                             [0, 4, 0, 9, 1, 0, 0, 0, 0, 0]]).T
+
+    targets = pre.get_pyramid_targets(grade_counts, PYRAMID_SHAPES[shape])
+
+    for column in range(grade_counts.shape[1]):  # Each workout type is its own pyramid
+        np.testing.assert_array_equal(targets[:, column],
+                                      _looped_pyramid_targets(grade_counts[:, column], PYRAMID_SHAPES[shape]))
+    assert (targets >= grade_counts).all()
@@ -0,0 +1,119 @@
+import pytest
+
+import sheets
+from fakes import FakeWorkbook, FakeWorksheet
+
+HEADER = ['Date', 'V Grade', 'Sent']
+
+
+def _rows(start, stop):
+    return [[f'{day:02d}/01/2021', f'V{day % 8}', 'TRUE'] for day in range(start, stop)]
+
+
+@pytest.fixture
+def worksheet():
+    return FakeWorksheet('Climbs', [HEADER, *_rows(1, 6)], {'raw_climb_data': 'A1:C'})
+
+
+def _sync(worksheet, tmp_path, **kwargs):
+    return sheets.sync_sheet(worksheet, 'raw_climb_data', tmp_path / 'indoor.parquet', **kwargs)
+
+
+def test_cold_start_fetches_everything(worksheet, tmp_path):
+    df, generation = _sync(worksheet, tmp_path)
+
+    assert df.values.tolist() == [HEADER, *_rows(1, 6)]
+    assert generation is not None
+    assert worksheet.num_requests == 1
+    assert (tmp_path / 'indoor.parquet').exists()
+
+
+def test_appended_rows_are_fetched_as_a_delta(worksheet, tmp_path):
+    _, generation = _sync(worksheet, tmp_path)
+    worksheet.append_rows(_rows(6, 9))
+
+    df, new_generation = _sync(worksheet, tmp_path)
+
+    assert df.values.tolist() == [HEADER, *_rows(1, 9)]
+    assert new_generation == generation  # Only rows were appended
+    assert worksheet.num_requests == 2  # A single delta request, from the last stored row
+
+    # The snapshot holds the appended rows, so the next sync finds nothing new
+    df, new_generation = _sync(worksheet, tmp_path)
+    assert df.values.tolist() == [HEADER, *_rows(1, 9)]
+    assert new_generation == generation
+    assert worksheet.num_requests == 3
+
+
+def test_rows_with_trailing_empty_cells_are_fetched_as_a_delta(worksheet, tmp_path):
+    worksheet.append_rows([['06/01/2021', 'V6', None]])  # The API omits the empty cell
+    _, generation = _sync(worksheet, tmp_path)
+    worksheet.append_rows(_rows(7, 8))
+
+    df, new_generation = _sync(worksheet, tmp_path)
+
+    assert df.values.tolist() == [HEADER, *_rows(1, 6), ['06/01/2021', 'V6', None], *_rows(7, 8)]
+    assert new_generation == generation
+    assert worksheet.num_requests == 2
+
+
+def test_overlap_mismatch_falls_back_to_a_full_fetch(worksheet, tmp_path):
+    _, generation = _sync(worksheet, tmp_path)
+    worksheet.values[-1] = ['05/01/2021', 'V7', 'FALSE']  # Edits the last stored row
+    worksheet.append_rows(_rows(6, 7))
+
+    df, new_generation = _sync(worksheet, tmp_path)
+
+    assert df.values.tolist() == [HEADER, *_rows(1, 5), ['05/01/2021', 'V7', 'FALSE'], *_rows(6, 7)]
+    assert new_generation != generation
+    assert worksheet.num_requests == 3  # The delta request, then the full fetch
+
+
+def test_full_refresh_ignores_the_snapshot(worksheet, tmp_path):
+    _, generation = _sync(worksheet, tmp_path)
+    worksheet.values[1] = ['01/01/2021', 'V3', 'FALSE']  # Above the overlap row, so only a full refresh sees it
+
+    df, _ = _sync(worksheet, tmp_path)
+    assert df.values.tolist()[1] == _rows(1, 2)[0]
+
+    df, new_generation = _sync(worksheet, tmp_path, full_refresh=True)
+    assert df.values.tolist()[1] == ['01/01/2021', 'V3', 'FALSE']
+    assert new_generation != generation
+
+
+def test_sync_workbook_syncs_every_sheet(tmp_path):
+    workbook = FakeWorkbook('Climbing Data', [
+        FakeWorksheet('Indoor Bouldering Climbs', [HEADER, *_rows(1, 4)], {'raw_climb_data': 'A1:C'}),
+        FakeWorksheet('Indoor Bouldering Sessions', [['Date', 'workout type'], ['01/01/2021', 'board']],
+                      {'raw_session_data': 'A1:B'}),
+        FakeWorksheet('Outdoor Bouldering', [['Date', 'Grade'], ['02/01/2021', 'V3']]),
+    ])
+
+    all_data, timings, generations = sheets.sync_workbook(workbook, snapshot_dir=tmp_path)
+
+    assert set(all_data) == set(timings) == set(generations) == set(sheets.SHEETS)
+    assert all_data['indoor'].values.tolist() == [HEADER, *_rows(1, 4)]
+    assert (tmp_path / 'Climbing Data' / 'outdoor.parquet').exists()
+
+
+def test_appended_rows_are_fetched_once_a_bounded_named_range_is_widened(tmp_path):
+    worksheet = FakeWorksheet('Indoor Bouldering Climbs', [HEADER, *_rows(1, 6)], {'raw_climb_data': 'A1:C6'})
+    workbook = FakeWorkbook('Climbing Data', [
+        worksheet,
+        FakeWorksheet('Indoor Bouldering Sessions', [['Date', 'workout type'], ['01/01/2021', 'board']],
+                      {'raw_session_data': 'A1:B'}),
+        FakeWorksheet('Outdoor Bouldering', [['Date', 'Grade'], ['02/01/2021', 'V3']]),
+    ])
+    _, _, generations = sheets.sync_workbook(workbook, snapshot_dir=tmp_path)
+
+    # Rows appended below the full range aren't part of it yet
+    worksheet.append_rows(_rows(6, 9))
+    all_data, _, _ = sheets.sync_workbook(workbook, snapshot_dir=tmp_path)
+    assert all_data['indoor'].values.tolist() == [HEADER, *_rows(1, 6)]
+
+    worksheet.named_ranges['raw_climb_data'] = 'A1:C20'
+    all_data, _, new_generations = sheets.sync_workbook(workbook, snapshot_dir=tmp_path)
+
+    assert all_data['indoor'].values.tolist() == [HEADER, *_rows(1, 9)]
+    assert new_generations['indoor'] == generations['indoor']  # Fetched as a delta rather than reloaded
+    assert worksheet.num_requests == 3
@@ -0,0 +1,31 @@
+import numpy as np
+import pandas as pd
+
+import preprocess as pre
+import sources
+
+TABLES = {
+    'indoor': pd.DataFrame({'Date': ['01/01/2021', '02/01/2021', '02/01/2021'], 'V Grade': ['V2', 'V3-5', 'V4'],
+                            'Count Multiplier': ['1', '2', '1'], 'Attempts (w/ send)': ['1', '3', None],
+                            'Sent': ['TRUE', 'FALSE', 'TRUE']}),
+    'indoor_sessions': pd.DataFrame({'Date': ['01/01/2021', '02/01/2021'], 'workout type': ['board', 'volume'],
+                                     'climbing time': ['60', '1:30'], 'total time': ['90', None]}),
+    'outdoor': pd.DataFrame({'Date': ['03/01/2021'], 'Grade': ['V5']}),
+}
+
+
+def test_file_source_keeps_sessions_with_times_that_arent_minutes(tmp_path):
+    sources.write_files(TABLES, tmp_path, fmt='csv')
+
+    all_data, _, _, dropped_rows = sources.from_spec(f'{sources.FILES_PREFIX}{tmp_path}').load()
+
+    assert dropped_rows == {'indoor': 1, 'indoor_sessions': 0, 'outdoor': 0}  # The climb without attempts
+    df_sessions = all_data['indoor_sessions']
+    assert df_sessions.index.tolist() == [1, 2]
+    np.testing.assert_array_equal(df_sessions['climbing_time'], [60, np.nan])
+    np.testing.assert_array_equal(df_sessions['total_time'], [90, np.nan])
+
+    # Dropping rows again downstream, as the page and reports do, keeps them too
+    all_data = pre.format_columns(pre.drop_nan_rows(all_data))
+    assert len(all_data['indoor_sessions']) == 2
+    assert pre.validate_indoor_data(all_data['indoor'], all_data['indoor_sessions']) is None
@@ -0,0 +1,90 @@
+import datetime as dt
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import cube
+import preprocess as pre
+import splitgrades
+from constants import TOP_KS
+
+
+def _sends(grades, dates=None):
+    climbs = pd.DataFrame({'Date': dates or ['01/01/2021'] * len(grades), 'V Grade': grades,
+                           'Count Multiplier': ['1'] * len(grades), 'Attempts (w/ send)': ['1'] * len(grades),
+                           'Sent': ['TRUE'] * len(grades)})
+    df_in = pre.format_columns({'indoor': climbs})['indoor']
+    df_in['workout_type'] = 'board'
+    return splitgrades.build(df_in)
+
+
+def _draw(sends, start_date=dt.date(2021, 1, 1), end_date=dt.date(2021, 12, 31), num_draws=10, freq='M'):
+    return splitgrades.draw(sends, start_date, end_date, ['board'], freq, num_draws)
+
+
+def test_draws_without_split_grades_are_the_fixed_grades():
+    draws = _draw(_sends(['V1', 'V3', 'V3', 'VB']))
+
+    assert draws.counts.shape[:2] == (10, 1)
+    np.testing.assert_array_equal(draws.counts[:, 0, :4], np.tile([0, 1, 0, 2], (10, 1)))  # VB is dropped
+    df = splitgrades.grade_totals(draws)
+    assert df['v_grade'].tolist() == [1, 3]
+    assert (df['total_count_low'] == df['total_count_high']).all()
+
+
+def test_draws_of_a_period_without_sends_are_empty():
+    draws = _draw(_sends(['V1', 'V3-5']), start_date=dt.date(2022, 1, 1), end_date=dt.date(2022, 12, 31))
+
+    assert draws.counts.shape[:2] == (10, 0)
+    assert splitgrades.v_points(draws).empty
+    assert splitgrades.grade_totals(draws).empty
+    assert splitgrades.period_top_k(draws, TOP_KS).empty
+
+
+def test_split_grades_are_drawn_within_their_range():
+    draws = _draw(_sends(['V2'] + ['V3-5'] * 20), num_draws=100)
+
+    totals = draws.counts.sum(axis=1)
+    np.testing.assert_array_equal(totals.sum(axis=1), 21)
+    np.testing.assert_array_equal(totals[:, 2], 1)
+    assert totals[:, [0, 1, 6, 7]].sum() == 0
+    assert totals[:, 3:6].mean(axis=0) == pytest.approx([20 / 3] * 3, abs=1)
+
+
+def _nlargest_period_top_k(df_sent, top_ks, freq):
+    """ The per-period sort and sum of the top-k sends, as the Session tab used to compute them."""
+    top_sends = df_sent.groupby(pd.Grouper(key='date', freq=freq))['v_grade'].nlargest(max(top_ks))
+    top_k_per_period = []
+    for date, period_top_sends in top_sends.groupby(level=0):
+        period_top_sends = period_top_sends.sort_values(ascending=False)
+        for k in sorted(top_ks):
+            top_k_per_period.append({'date': date, 'k': k, 'mean_top_k': period_top_sends.head(k).mean()})
+    return pd.DataFrame(top_k_per_period)
+
+
+@pytest.mark.filterwarnings('ignore:.*deprecated:FutureWarning')  # The 'M' alias of pd.Grouper, on recent pandas
+@pytest.mark.parametrize('freq', ['W', 'M', 'Q'])
+def test_period_top_k_is_the_mean_of_the_sorted_top_k_sends_of_each_period(freq):
+    rng = np.random.default_rng(0)
+    # Sparse dates over a year, so that some periods have fewer sends than the largest k, and some none
+    dates = pd.DatetimeIndex(np.sort(rng.choice(pd.date_range('2021-01-01', '2021-12-31'), 150)))
+    climbs = pd.DataFrame({'Date': dates.strftime('%d/%m/%Y'), 'V Grade': rng.choice([f'V{i}' for i in range(9)], 150),
+                           'Count Multiplier': rng.choice(['1', '1', '2'], 150), 'Attempts (w/ send)': ['1'] * 150,
+                           'Sent': rng.choice(['TRUE', 'FALSE'], 150)})
+    df_in = pre.format_columns({'indoor': climbs})['indoor']
+    df_in['workout_type'] = 'board'
+    df_dist = pre.distribute_climbs(df_in, 42)
+    df_sent = df_dist[df_dist['sent']]
+    num_sends = df_sent.groupby(df_sent['date'].dt.to_period(freq)).size()
+    assert (num_sends < max(TOP_KS)).any()
+    expected = _nlargest_period_top_k(df_sent, TOP_KS, freq)
+
+    df_cube = cube.period_top_k(cube.build(df_dist), TOP_KS, freq)
+    pd.testing.assert_frame_equal(df_cube, expected, check_dtype=False)
+
+    # Without split grades, every draw is the same
+    df_draws = splitgrades.period_top_k(_draw(splitgrades.build(df_in), freq=freq), TOP_KS)
+    pd.testing.assert_frame_equal(df_draws[['date', 'k', 'mean_top_k']], expected, check_dtype=False)
+    np.testing.assert_allclose(df_draws['mean_top_k_low'], expected['mean_top_k'])
+    np.testing.assert_allclose(df_draws['mean_top_k_high'], expected['mean_top_k'])